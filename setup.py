@@ -14,7 +14,7 @@ setup(
     url='http://www.gremwell.com/sslcaudit',
     version='1.1',
     license='GPLv3',
-    scripts=['bin/sslcaudit'],
+    scripts=['bin/sslcaudit', 'bin/sslcaudit-prune'],
     package_dir={'sslcaudit': 'sslcaudit'},
     packages=['sslcaudit', 'sslcaudit.core', 'sslcaudit.modules',
               'sslcaudit.modules.base', 'sslcaudit.modules.dummy',
@@ -4,15 +4,24 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
-from Queue import Empty
 from exceptions import Exception
 import logging
 import sys
-from threading import Thread
-from sslcaudit.core import CFG_PTA_EXIT
+import time
+from threading import Thread, Event
+from sslcaudit.core import CFG_PTA_EXIT, CFG_ENGINE_EPOLL
 from sslcaudit.core.ClientAuditorServer import ClientAuditorServer
-from sslcaudit.core.ConnectionAuditEvent import SessionEndResult
+from sslcaudit.core.ConnectionAuditEvent import SessionEndResult, ConnectionAuditResult
 from sslcaudit.core.ConfigError import ConfigError
+from sslcaudit.core.ConnectionEngine import ConnectionEngine
+from sslcaudit.core.EventDispatcher import EventDispatcher
+from sslcaudit.core.EventQueue import EventQueue
+from sslcaudit.core.CertCache import init_default_cert_cache
+from sslcaudit.core.CertFactory import DEFAULT_BITS
+from sslcaudit.core.KeyPool import init_default_key_pool
+from sslcaudit.core.ShardedClientAuditorServer import ShardedClientAuditorServer, ShardClientAuditorServer
+from sslcaudit.core.WorkerPool import WorkerPool
+from sslcaudit.modules.base.BaseProfileFactory import BaseDynamicProfile
 from sslcaudit.test.ExternalCommandHammer import CurlHammer
 from sslcaudit.test.SSLConnectionHammer import ChainVerifyingSSLConnectionHammer, CNVerifyingSSLConnectionHammer
 from sslcaudit.test.TCPConnectionHammer import TCPConnectionHammer
@@ -26,22 +35,67 @@ PROFILE_FACTORY_CLASS_NAME = 'ProfileFactory'
 PROG_NAME = 'sslcaudit'
 PROG_VERSION = '1.1'
 
+STATS_LOG_INTERVAL = 60.0
+SESSION_EXPIRY_INTERVAL = 10.0
+
 logger = logging.getLogger('BaseClientAuditController')
 
 class BaseClientAuditController(Thread):
 
-    def __init__(self, options, file_bag, event_handler):
+    def __init__(self, options, file_bag, event_handler=None):
         Thread.__init__(self, target=self.run, name='BaseClientAuditController')
         self.options = options
         self.event_handler = event_handler
-        self.queue_read_timeout = 0.1
 
         self.file_bag = file_bag
 
+        self.init_key_pool()
+        self.init_cert_cache()
         self.init_profile_factories()
 
-        self.server = ClientAuditorServer(self.options.listen_on, self.profile_factories, options.post_test_action, None, self.file_bag)
-        self.res_queue = self.server.res_queue
+        # session start and end events always wait for room in the queue, the results of connections are up to the user
+        self.res_queue = EventQueue(self.options.event_queue_size,
+            {ConnectionAuditResult: self.options.result_overflow_policy})
+
+        if self.options.nprocesses > 1:
+            # the choice of the next profile of a dynamic profile depends on the results of all connections of the
+            # session, which the worker processes do not share
+            for profile_factory in self.profile_factories:
+                for profile in profile_factory.profiles:
+                    if isinstance(profile, BaseDynamicProfile):
+                        raise ConfigError('profile %s cannot be used with multiple processes' % profile)
+
+            if not self.file_bag.fork_safe:
+                raise ConfigError('%s cannot be used with multiple processes' % self.file_bag.__class__.__name__)
+
+            # worker pools and engines get created in the worker processes, see mk_worker_server()
+            try:
+                self.server = ShardedClientAuditorServer(self.options.listen_on, self.profile_factories,
+                    options.post_test_action, self.res_queue, self.file_bag, self.options.nprocesses,
+                    self.mk_worker_server, self.options.max_sessions, self.options.session_ttl)
+            except RuntimeError as ex:
+                raise ConfigError(str(ex))
+        else:
+            self.init_worker_pool()
+            self.init_engine()
+
+            try:
+                self.server = ClientAuditorServer(self.options.listen_on, self.profile_factories,
+                    options.post_test_action, self.res_queue, self.file_bag, self.worker_pool, self.engine,
+                    max_sessions=self.options.max_sessions, session_ttl=self.options.session_ttl)
+            except Exception as ex:
+                if self.engine is not None:
+                    self.engine.stop()
+                elif self.worker_pool is not None:
+                    self.worker_pool.stop()
+                raise ex
+
+        # the dispatcher delivers the events to the subscribers, the controller itself watches for the end of sessions
+        self.dispatcher = EventDispatcher(self.res_queue)
+        if self.event_handler is not None:
+            self.dispatcher.subscribe(self.event_handler)
+        self.dispatcher.subscribe(self.handle_event)
+        self.stats_stop_event = Event()
 
         logger.debug('dumping options')
         for (key, value) in self.options.__dict__.items():
@@ -60,8 +114,13 @@ class BaseClientAuditController(Thread):
             raise ex
 
     def init_profile_factories(self):
-        self.profile_factories = []
-
+        '''
+        This method loads the modules and builds their profile factories. The factories get built in parallel, one
+        thread per module, as some of them spend a while waiting for the network (fetching server certificates) or for
+        the key pool. If some factory fails, the exception of the first one failing, in the order of the modules, is
+        passed to the caller.
+        '''
+        profile_factory_classes = []
         for module_name in self.options.modules.split(','):
             # load the module from under MODULE_NAME_PREFIX
             module_name = MODULE_MODULE_NAME_PREFIX + "." + module_name + '.' + PROFILE_FACTORY_MODULE_NAME
@@ -70,50 +129,164 @@ class BaseClientAuditController(Thread):
             except Exception as ex:
                 raise ConfigError("cannot load module %s, exception: %s" % (module_name, ex))
 
-            # find and instantiate the profile factory class
-            profile_factory_class = sys.modules[module_name].__dict__[PROFILE_FACTORY_CLASS_NAME]
-            self.profile_factories.append(profile_factory_class(self.file_bag, self.options))
+            # find the profile factory class
+            profile_factory_classes.append(sys.modules[module_name].__dict__[PROFILE_FACTORY_CLASS_NAME])
+
+        # instantiate the profile factories
+        results = [None] * len(profile_factory_classes)
+
+        def build(index):
+            profile_factory_class = profile_factory_classes[index]
+            start_time = time.time()
+            try:
+                results[index] = (profile_factory_class(self.file_bag, self.options), None)
+            except:
+                results[index] = (None, sys.exc_info())
+                return
+            logger.info('built %s in %.2fs', results[index][0], time.time() - start_time)
+
+        if len(profile_factory_classes) == 1:
+            build(0)
+        else:
+            threads = [Thread(target=build, args=(index,), name='ProfileFactory-%d' % index)
+                for index in range(len(profile_factory_classes))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.profile_factories = []
+        for (profile_factory, exc_info) in results:
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            self.profile_factories.append(profile_factory)
 
         # there must be some profile factories in the list, otherwise we die right here
         if len(self.profile_factories) == 0:
             raise ConfigError("no single profile factory configured, nothing to do")
 
+    def init_key_pool(self):
+        if self.options.key_pool_size == 0:
+            self.key_pool = None
+            return
+
+        # profile factories pick the default key pool up via CertFactory
+        self.key_pool = init_default_key_pool(self.options.key_pool_size)
+        self.key_pool.prefill(DEFAULT_BITS)
+        logger.info('using %s', self.key_pool)
+
+    def init_cert_cache(self):
+        if self.options.no_cert_cache:
+            self.cert_cache = None
+            return
+
+        # profile factories pick the default cache up on their own
+        try:
+            self.cert_cache = init_default_cert_cache(self.file_bag, self.options.cert_cache_dir, self.options.cert_cache_size)
+        except OSError as ex:
+            raise ConfigError('failed to create certificate cache directory, exception: %s' % ex)
+        logger.info('using %s', self.cert_cache)
+
+    def init_worker_pool(self):
+        # by default each connection is handled in its own thread
+        if self.options.nworkers == 0:
+            self.worker_pool = None
+            return
+
+        self.worker_pool = WorkerPool(self.options.nworkers, self.options.accept_queue_size,
+            self.options.overflow_policy, self.options.overflow_timeout, name='ConnectionWorkerPool')
+        logger.info('handling connections with %d workers, accept queue size %d, overflow policy %s',
+            self.options.nworkers, self.options.accept_queue_size, self.options.overflow_policy)
+
+    def init_engine(self):
+        if self.options.engine != CFG_ENGINE_EPOLL:
+            self.engine = None
+            return
+
+        # in event-driven mode the worker pool, if any, runs blocking handlers of the modules lacking non-blocking ones
+        try:
+            self.engine = ConnectionEngine(self.options.nevent_loops, self.worker_pool)
+        except RuntimeError as ex:
+            raise ConfigError(str(ex))
+        logger.info('handling connections with %s', self.engine)
+
+    def mk_worker_server(self, shard_queue, listen_sock):
+        '''
+        This method gets invoked in each worker process of ShardedClientAuditorServer.
+        '''
+        self.init_worker_pool()
+        self.init_engine()
+        return ShardClientAuditorServer(self.options.listen_on, self.profile_factories, self.options.post_test_action,
+            shard_queue, self.file_bag, listen_sock, self.worker_pool, self.engine, self.options.max_sessions,
+            self.options.session_ttl)
+
+    def subscribe(self, handler):
+        '''
+        Registers a function to be invoked with each event. Has to be invoked before start().
+        '''
+        self.dispatcher.subscribe(handler)
+
+    def subscribe_batch(self, handler):
+        '''
+        Registers a function to be invoked with lists of events, as they come in. Has to be invoked before start().
+        '''
+        self.dispatcher.subscribe_batch(handler)
+
     def start(self):
-        self.do_stop = False
         self.server.start()
         Thread.start(self)
 
+        stats_thread = Thread(target=self.housekeeping, name='ControllerHousekeeping')
+        stats_thread.daemon = True
+        stats_thread.start()
+
         if self.selftest_hammer is not None:
             self.selftest_hammer.start()
 
     def stop(self):
-        # signal the controller thread to stop
-        self.do_stop = True
+        # wake the controller thread up and make it stop
+        self.dispatcher.stop()
         # tell the test hammer to stop as well
         if self.selftest_hammer:
             self.selftest_hammer.stop()
 
+    def handle_event(self, res):
+        logger.debug("got result %s", res)
+        if isinstance(res, SessionEndResult) and not res.partial:
+            if self.options.post_test_action == CFG_PTA_EXIT:
+                self.dispatcher.stop()
+
+    def housekeeping(self):
+        last_stats_time = time.time()
+        while not self.stats_stop_event.wait(SESSION_EXPIRY_INTERVAL):
+            if self.options.session_ttl is not None:
+                self.server.expire_sessions()
+
+            if time.time() - last_stats_time >= STATS_LOG_INTERVAL:
+                self.log_stats()
+                last_stats_time = time.time()
+
+    def log_stats(self):
+        stats = self.server.get_stats()
+        if stats is not None:
+            logger.info('server stats: %s', stats)
+        if self.key_pool is not None:
+            logger.info('key pool stats: %s', self.key_pool.get_stats())
+        logger.info('event queue stats: %s', self.res_queue.get_stats())
+
     def run(self):
         '''
         SSLCAuditCLI loop function. Will run until the desired number of clients is handled.
         '''
         logger.debug('entering main loop in run()')
 
-        # loop until get all desired results, quit if stopped
-        while not self.do_stop:
-            try:
-                # wait for a message blocking for short intervals, check stop flag frequently
-                res = self.server.res_queue.get(True, self.queue_read_timeout)
-                logger.debug("got result %s", res)
-                self.event_handler(res)
-
-                if isinstance(res, SessionEndResult):
-                    if self.options.post_test_action == CFG_PTA_EXIT:
-                        break
-            except Empty:
-                pass
+        # deliver the events until stopped
+        self.dispatcher.run()
 
+        self.stats_stop_event.set()
         self.server.stop()
+        if self.key_pool is not None:
+            self.key_pool.stop()
         if self.selftest_hammer:
             self.selftest_hammer.stop()
         logger.debug('exited main loop in run()')
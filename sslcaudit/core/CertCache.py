@@ -0,0 +1,157 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from sslcaudit.core.CertFactory import CertAndKey, CERT_FILE_SUFFIX, KEY_FILE_SUFFIX, SELFSIGNED
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.sslcaudit', 'cert-cache')
+DEFAULT_MAX_ENTRIES = 1000
+
+# bump it whenever the way certificates get generated changes, to invalidate old entries
+CACHE_FORMAT_VERSION = '1'
+
+class CertCache(object):
+    '''
+    This class keeps generated certificates and keys in a directory, to reuse them across the runs. The entries are
+    addressed by a hash of a cache id, a string describing everything the content depends on (key size, subject,
+    extensions, the issuer). It is up to the callers to come up with complete ids.
+    Once the number of entries exceeds max_entries, least recently used ones get removed. Several processes can share
+    the same directory, the files are put into place with atomic renames. As another process can evict an entry at any
+    moment, the cached files are not handed out: on a hit they get copied into the file bag of this run.
+    '''
+    logger = logging.getLogger('CertCache')
+
+    def __init__(self, file_bag, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+        self.file_bag = file_bag
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+        try:
+            os.makedirs(self.cache_dir, 0700)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+        self.lock = threading.Lock()  # this lock has to be acquired before updating the counters
+        self.nhits = 0
+        self.nmisses = 0
+
+    def get(self, cache_id, mk_certnkey):
+        '''
+        Returns CertAndKey object for given cache id. If there is no such entry in the cache, it gets produced by
+        mk_certnkey() and stored.
+        '''
+        digest = hashlib.sha1(CACHE_FORMAT_VERSION + '|' + cache_id).hexdigest()
+        cert_filename = os.path.join(self.cache_dir, digest + CERT_FILE_SUFFIX)
+        key_filename = os.path.join(self.cache_dir, digest + KEY_FILE_SUFFIX)
+
+        certnkey = self.load(cert_filename, key_filename)
+        if certnkey is not None:
+            self.logger.debug('cache hit for %s', cache_id)
+            with self.lock:
+                self.nhits += 1
+            return certnkey
+
+        with self.lock:
+            self.nmisses += 1
+        certnkey = mk_certnkey()
+        try:
+            # the key goes first, the presence of the cert file marks a complete entry
+            self.store(certnkey.key_filename, key_filename)
+            self.store(certnkey.cert_filename, cert_filename)
+            self.evict()
+        except (IOError, OSError) as ex:
+            self.logger.warn('failed to store %s in the cache: %s', cache_id, ex)
+        return certnkey
+
+    def load(self, cert_filename, key_filename):
+        try:
+            with open(cert_filename, 'rb') as f:
+                cert_data = f.read()
+            with open(key_filename, 'rb') as f:
+                key_data = f.read()
+        except IOError:
+            # not there, or evicted by another process
+            return None
+
+        (bag_cert_filename, bag_key_filename) = self.file_bag.store_two(CERT_FILE_SUFFIX, cert_data,
+            KEY_FILE_SUFFIX, key_data)
+        try:
+            certnkey = CertAndKey(None, bag_cert_filename, bag_key_filename, None, None)
+        except Exception as ex:
+            self.logger.warn('failed to load cached %s, will regenerate it: %s', cert_filename, ex)
+            return None
+
+        # recently used entries survive eviction
+        try:
+            os.utime(cert_filename, None)
+        except OSError:
+            pass
+
+        if certnkey.cert.get_issuer().as_text() == certnkey.cert.get_subject().as_text():
+            signed_by = SELFSIGNED
+        else:
+            signed_by = certnkey.cert.get_issuer().CN
+        certnkey.name = (certnkey.cert.get_subject().CN, signed_by)
+        return certnkey
+
+    def store(self, src_filename, dst_filename):
+        (fd, tmp_filename) = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        os.close(fd)
+        shutil.copyfile(src_filename, tmp_filename)
+        os.chmod(tmp_filename, 0600)
+        os.rename(tmp_filename, dst_filename)
+
+    def evict(self):
+        cert_filenames = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                          if name.endswith(CERT_FILE_SUFFIX)]
+        nexcess = len(cert_filenames) - self.max_entries
+        if nexcess <= 0:
+            return
+
+        entries = []
+        for cert_filename in cert_filenames:
+            try:
+                entries.append((os.path.getmtime(cert_filename), cert_filename))
+            except OSError:
+                # removed by another process
+                pass
+        entries.sort()
+
+        for (_, cert_filename) in entries[:nexcess]:
+            key_filename = cert_filename[:-len(CERT_FILE_SUFFIX)] + KEY_FILE_SUFFIX
+            for filename in (cert_filename, key_filename):
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.nhits, 'misses': self.nmisses}
+
+    def __str__(self):
+        return 'CertCache(%s, max %d entries)' % (self.cache_dir, self.max_entries)
+
+
+default_cert_cache = None
+
+def init_default_cert_cache(file_bag, cache_dir, max_entries):
+    '''
+    Creates the cache used by profile factories.
+    '''
+    global default_cert_cache
+    default_cert_cache = CertCache(file_bag, cache_dir, max_entries)
+    return default_cert_cache
+
+def get_default_cert_cache():
+    return default_cert_cache
@@ -4,13 +4,17 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
+import logging
 import socket
+import threading
 import time
+from Queue import Queue, Empty
 
 from M2Crypto import X509, ASN1, RSA, EVP, util, SSL
 import M2Crypto
 from M2Crypto.SSL import SSLError
 from sslcaudit.core.ConfigError import ConfigError
+from sslcaudit.core.KeyPool import get_default_key_pool, gen_rsa_key
 
 DEFAULT_X509_C = 'BE'
 DEFAULT_X509_ORG = 'Gremwell bvba'
@@ -19,6 +23,7 @@ BITS = 1024
 
 CERT_FILE_SUFFIX = '-cert.pem'
 KEY_FILE_SUFFIX = '-key.pem'
+CERT_TEXT_FILE_SUFFIX = '-cert.txt'
 
 class CertAndKey(object):
     '''
@@ -54,14 +59,27 @@ class CertAndKey(object):
 
 DEFAULT_BITS = 1024
 
+DEFAULT_GRAB_TIMEOUT = 10.0
+DEFAULT_GRAB_RETRIES = 2
+DEFAULT_GRAB_THREADS = 32
+GRAB_RETRY_DELAY = 0.5
+
+logger = logging.getLogger('CertFactory')
+
 class CertFactory(object):
     '''
     This class provides methods to generate new X509 certificates and corresponding
     keys, encapsulated into CertAndKey objects.
+    Certificate requests can be signed from several threads at once, as long as it happens via sign_cert_req().
+    The keys are taken from the given KeyPool or, by default, from the default one, if it is initialized.
     '''
 
-    def __init__(self, file_bag):
+    def __init__(self, file_bag, key_pool=None):
         self.file_bag = file_bag
+        if key_pool is None:
+            key_pool = get_default_key_pool()
+        self.key_pool = key_pool
+        self.lock = threading.Lock()  # this lock has to be acquired before signing a certificate request
 
     def load_certnkey_files(self, cert_file, key_file):
         '''
@@ -106,7 +124,10 @@ class CertFactory(object):
 
     def dododo(self, bits, subj, not_before, not_after, v3_exts, version=3):
         # create a new keypair
-        rsa_keypair = RSA.gen_key(bits, 65537, util.no_passphrase_callback)
+        if self.key_pool is not None:
+            rsa_keypair = self.key_pool.get_key(bits)
+        else:
+            rsa_keypair = gen_rsa_key(bits)
         pkey = EVP.PKey()
         pkey.assign_rsa(rsa_keypair, capture=False)
 
@@ -129,6 +150,11 @@ class CertFactory(object):
         Expects a tuple (X509, EVP, RSA) as returned by mk_certreq_n_keys().
         Returns CertAndKey() object.
         '''
+        # same request can get signed by different CAs, make sure it does not happen in parallel
+        with self.lock:
+            return self.do_sign_cert_req(certreq_n_keys, ca_certnkey)
+
+    def do_sign_cert_req(self, certreq_n_keys, ca_certnkey):
         (cert_req, pkey, rsa_keypair) = certreq_n_keys
 
         # hardcoded parameters
@@ -152,36 +178,57 @@ class CertFactory(object):
             cert_req.sign(pkey, md)
             signed_by = SELFSIGNED
 
-        # save the certificate in a file
-        (cert_file, key_file) = self.file_bag.mk_two_files(suffix1=CERT_FILE_SUFFIX, suffix2=KEY_FILE_SUFFIX)
-        cert_file.write(cert_req.as_text())
-        cert_file.write(cert_req.as_pem())
+        # save the certificate and the private key in files
+        certs = [cert_req]
         if ca_certnkey is not None:
-            cert_file.write(ca_certnkey.cert.as_text())
-            cert_file.write(ca_certnkey.cert.as_pem())
-        cert_file.close()
-
-        # save the private key in a file
-        rsa_keypair.save_key(key_file.name, None)
-        key_file.close()
+            certs.append(ca_certnkey.cert)
+        if self.file_bag.compress_level is None:
+            # human-readable dumps go along with PEM
+            cert_data = ''.join(cert.as_text() + cert.as_pem() for cert in certs)
+        else:
+            # OpenSSL has to be able to read the certificate file, the dumps go in a compressed file of their own
+            cert_data = ''.join(cert.as_pem() for cert in certs)
+        (cert_filename, key_filename) = self.file_bag.store_two(CERT_FILE_SUFFIX, cert_data,
+            KEY_FILE_SUFFIX, rsa_keypair.as_pem(None))
+        if self.file_bag.compress_level is not None:
+            self.file_bag.store_file(cert_filename[:-len(CERT_FILE_SUFFIX)] + CERT_TEXT_FILE_SUFFIX,
+                ''.join(cert.as_text() for cert in certs))
 
-        return CertAndKey((cert_req.get_subject().CN, signed_by), cert_file.name, key_file.name, cert_req, pkey)
+        return CertAndKey((cert_req.get_subject().CN, signed_by), cert_filename, key_filename, cert_req, pkey)
 
-    def grab_server_x509_cert(self, server, protocol):
+    def grab_server_x509_cert(self, server, protocol, timeout=None, retries=0):
         '''
         This function connects to the specified server and grabs its certificate.
-        Expects (server, port) tuple as input.
+        Expects (server, port) tuple as input. If timeout is set, connecting to the server and each read and write
+        during the handshake are limited to that many seconds. Failed attempts are repeated up to retries times.
         '''
+        attempt = 0
+        while True:
+            try:
+                return self.do_grab_server_x509_cert(server, protocol, timeout)
+            except (socket.error, SSLError) as ex:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                logger.debug('failed to grab certificate of %s (%s), retry %d of %d', server, ex, attempt, retries)
+                time.sleep(GRAB_RETRY_DELAY * attempt)
+
+    def do_grab_server_x509_cert(self, server, protocol, timeout):
         # create context
         ctx = SSL.Context(protocol=protocol)
         ctx.set_allow_unknown_ca(True)
         ctx.set_verify(SSL.verify_none, 0)
 
         # establish TCP connection to the server
-        sock = socket.create_connection(server)
+        sock = socket.create_connection(server, timeout)
+        # OpenSSL does blocking I/O on the file descriptor, python socket timeout would make it non-blocking
+        sock.settimeout(None)
 
         # prepare SSL context
         sslsock = SSL.Connection(ctx, sock=sock)
+        if timeout is not None:
+            sslsock.set_socket_read_timeout(SSL.timeout(timeout))
+            sslsock.set_socket_write_timeout(SSL.timeout(timeout))
         sslsock.set_post_connection_check_callback(None)
         sslsock.setup_ssl()
         sslsock.set_connect_state()
@@ -201,10 +248,46 @@ class CertFactory(object):
 
         if server_cert is None:
             # failed to grab the certificate, rethrow the exception
+            if ssl_connect_ex is None:
+                ssl_connect_ex = SSLError('no certificate received from %s:%d' % server)
             raise ssl_connect_ex
 
         return server_cert
 
+    def grab_server_x509_certs(self, servers, protocol, timeout=DEFAULT_GRAB_TIMEOUT, retries=DEFAULT_GRAB_RETRIES,
+                               nthreads=DEFAULT_GRAB_THREADS):
+        '''
+        This function grabs the certificates of a list of servers in parallel, using up to nthreads threads. Timeout
+        and retries are applied to each server, as in grab_server_x509_cert(). It returns a list of
+        (server, certificate, exception) tuples in the order of the input, where either the certificate or the
+        exception is None.
+        '''
+        results = [None] * len(servers)
+        jobs = Queue()
+        for job in enumerate(servers):
+            jobs.put(job)
+
+        def grab():
+            while True:
+                try:
+                    (index, server) = jobs.get_nowait()
+                except Empty:
+                    return
+                try:
+                    cert = self.grab_server_x509_cert(server, protocol, timeout, retries)
+                    results[index] = (server, cert, None)
+                except Exception as ex:
+                    results[index] = (server, None, ex)
+
+        threads = [threading.Thread(target=grab, name='CertGrabber-%d' % i)
+                   for i in range(min(nthreads, len(servers)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
     def mk_replica_certreq_n_keys(self, orig_cert):
         '''
         This function creates a certificate request replicating given certificate. It returns a tuple of certificate and
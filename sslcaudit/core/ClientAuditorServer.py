@@ -9,9 +9,12 @@ from threading import Thread
 from Queue import Queue
 import itertools
 import threading
+from sslcaudit.core.ProfileTable import ProfileTable
 from sslcaudit.core.ClientConnection import ClientConnection
 from sslcaudit.core.ClientServerSessionHandler import ClientServerSessionHandler
-from sslcaudit.core.ThreadingTCPServer import ThreadingTCPServer
+from sslcaudit.core.PooledTCPServer import PooledTCPServer
+from sslcaudit.core.SessionTable import SessionTable, DEFAULT_MAX_SESSIONS
+from sslcaudit.core.ThreadingTCPServer import ThreadingTCPServer, ReusingTCPServer
 from sslcaudit.core.get_original_dst import get_original_dst
 
 logger = logging.getLogger('ClientAuditorTCPServer')
@@ -23,22 +26,30 @@ class ClientAuditorServer(Thread):
     It works in a separate Thread and relies on ClientAuditorTCPServer server to actually receive TCP connections from
     clients and invoke finish_request() method (weird name, but it is the way the stock TCP python server works).
     It distinguishes between different clients by their IP addresses, ignoring TCP port.
-    It distinguishes between different servers (may be more than one if redirection takes place) by address/port pairs.
+    It distinguishes between different servers (may be more than one if redirection takes place) by address/port pairs:
+    the connections redirected by iptables get their original destination looked up once, it becomes part of the
+    session id and is available to the handlers as conn.orig_dst.
     It creates an instance of ClientServerSessionHandler class for each distinct client-server pair and calls its
     handle() for each incoming connection relevant to that session.
-    Right now this generates the list of profiles by flattening 'profile_factories' and passes the result to the
-    constructor of ClientServerSessionHandler. This will change.
+    It flattens 'profile_factories' into a ProfileTable once, all session handlers share it.
     If res_queue is None, this class will create its own Queue and make accessible to users via res_queue attribute.
+    If worker_pool is None, each connection gets handled in its own thread. Otherwise connections are handed over
+    to the given WorkerPool. If engine is not None, connections get accepted in the server thread and handed over to
+    the given ConnectionEngine, which takes care of closing them. If listen_sock is given, connections get accepted
+    from that socket (already bound and listening) instead of a new one.
+    Session handlers are kept in a SessionTable, bounded by max_sessions and session_ttl (in seconds, None for no
+    expiry). The dropped sessions report the results collected so far as partial SessionEndResult.
     '''
 
-    def __init__(self, listen_on, profile_factories, post_test_action, res_queue, file_bag):
+    def __init__(self, listen_on, profile_factories, post_test_action, res_queue, file_bag, worker_pool=None,
+                 engine=None, listen_sock=None, max_sessions=DEFAULT_MAX_SESSIONS, session_ttl=None):
         Thread.__init__(self, target=self.run, name='ClientAuditorServer')
         self.daemon = True
 
         self.listen_on = listen_on
-        self.client_server_sessions = {}
-        self.lock = threading.Lock()  # this lock has to be acquired before using clients dictionary
+        self.client_server_sessions = SessionTable(max_sessions, session_ttl, self.on_session_evicted)
         self.profile_factories = profile_factories
+        self.profile_table = ProfileTable(itertools.chain.from_iterable(profile_factories))
         self.post_test_action = post_test_action
 
         # create a local result queue unless one is already provided
@@ -49,7 +60,18 @@ class ClientAuditorServer(Thread):
 	self.file_bag = file_bag
 
         # create TCP server and make it use our method to handle the requests
-        self.tcp_server = ThreadingTCPServer(self.listen_on)
+        self.worker_pool = worker_pool
+        self.engine = engine
+        if self.engine is not None:
+            self.tcp_server = ReusingTCPServer(self.listen_on, listen_sock=listen_sock)
+            # sockets handed over to the engine must survive until the engine is done with them
+            self.detached_socks = set()
+            self.detached_socks_lock = threading.Lock()  # this lock has to be acquired before using detached_socks
+            self.tcp_server.shutdown_request = self.shutdown_request
+        elif self.worker_pool is not None:
+            self.tcp_server = PooledTCPServer(self.listen_on, self.worker_pool, listen_sock=listen_sock)
+        else:
+            self.tcp_server = ThreadingTCPServer(self.listen_on, listen_sock=listen_sock)
         self.tcp_server.finish_request = self.finish_request
 
     def finish_request(self, sock, client_address):
@@ -61,26 +83,42 @@ class ClientAuditorServer(Thread):
             logger.debug('original destination is %s' % str(orig_dst))
         except Exception as ex:
             logger.debug('get_original_dst() has thrown an exception: %s', ex)
+            orig_dst = None
 
         # create new conn object and obtain client id
-        conn = ClientConnection(sock, client_address)
+        conn = ClientConnection(sock, client_address, orig_dst=orig_dst)
         session_id = conn.get_session_id()
 
         # find or create a session handler
-        with self.lock:
-            if not self.client_server_sessions.has_key(session_id):
-                logger.debug('new session [id %s]', session_id)
-                profiles = self.mk_session_profiles()
-                handler = ClientServerSessionHandler(session_id, profiles, self.post_test_action, self.res_queue, self.file_bag)
-                self.client_server_sessions[session_id] = handler
-            else:
-                handler = self.client_server_sessions[session_id]
+        handler = self.client_server_sessions.get(session_id, lambda: self.mk_session_handler(session_id))
 
         # handle the request
-        handler.handle(conn)
+        if self.engine is None:
+            handler.handle(conn)
+        else:
+            with self.detached_socks_lock:
+                self.detached_socks.add(sock)
+            if not handler.handle_async(conn, self.engine, lambda: self.close_detached_request(sock)):
+                with self.detached_socks_lock:
+                    self.detached_socks.discard(sock)
+
+    def shutdown_request(self, sock):
+        # this method overrides TCPServer implementation in event-driven mode, it leaves the sockets handed over to
+        # the engine alone
+        with self.detached_socks_lock:
+            if sock in self.detached_socks:
+                self.detached_socks.remove(sock)
+                return
+        ReusingTCPServer.shutdown_request(self.tcp_server, sock)
+
+    def close_detached_request(self, sock):
+        # invoked by the engine once it is done with the socket
+        ReusingTCPServer.shutdown_request(self.tcp_server, sock)
 
     def run(self):
         logger.info('listen_on: %s' % str(self.listen_on))
+        if self.engine is not None:
+            self.engine.start()
         self.tcp_server.serve_forever()
 
     def stop(self):
@@ -90,6 +128,31 @@ class ClientAuditorServer(Thread):
 
     def server_close(self):
         self.tcp_server.server_close()
+        if self.engine is not None:
+            self.engine.stop()
+
+    def get_stats(self):
+        '''
+        Returns session table statistics, along with engine or worker pool statistics (queue depth, worker
+        utilization, counters) if there is either.
+        '''
+        stats = {'sessions': self.client_server_sessions.get_stats()}
+        if self.engine is not None:
+            stats['engine'] = self.engine.get_stats()
+        elif self.worker_pool is not None:
+            stats['worker_pool'] = self.worker_pool.get_stats()
+        return stats
+
+    def expire_sessions(self):
+        self.client_server_sessions.expire()
+
+    def on_session_evicted(self, handler):
+        handler.evict()
+
+    def mk_session_handler(self, session_id):
+        logger.debug('new session [id %s]', session_id)
+        profiles = self.mk_session_profiles()
+        return ClientServerSessionHandler(session_id, profiles, self.post_test_action, self.res_queue, self.file_bag)
 
     def mk_session_profiles(self):
-        return list(itertools.chain.from_iterable(self.profile_factories))
+        return self.profile_table
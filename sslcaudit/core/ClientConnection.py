@@ -4,18 +4,50 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
+from time import time
+
 class ClientConnection(object):
-    def __init__(self, sock, client_address):
+    def __init__(self, sock, client_address, sockname=None, orig_dst=None):
         self.sock = sock
         self.client_address = client_address
-        self.sockname = self.sock.getsockname()
+        if sockname is None:
+            self.sockname = self.sock.getsockname()
+        else:
+            self.sockname = sockname
+
+        # the destination the client meant to connect to, if the connection got redirected to us
+        if orig_dst is not None and tuple(orig_dst) != tuple(self.sockname[:2]):
+            self.orig_dst = tuple(orig_dst)
+        else:
+            self.orig_dst = None
+
+        self.start_time = time()
+        self.end_time = None
+
+    def release(self):
+        '''
+        This method is invoked once the connection is handled. It drops the reference to the socket, so that the
+        results referring to this connection do not keep it alive, and records the time the handling has ended.
+        '''
+        self.sock = None
+        if self.end_time is None:
+            self.end_time = time()
+
+    def get_duration(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
 
     def get_session_id(self):
         '''
         This function returns a key is used to distinguish between different sessions between clients and servers.
-        In the current implementation we use client IP address as a key.
+        In the current implementation we use client IP address as a key, along with the original destination if the
+        connection got redirected, so that each client-server pair gets audited on its own.
         '''
-        return self.client_address[0]
+        if self.orig_dst is None:
+            return self.client_address[0]
+        else:
+            return '%s->%s:%d' % (self.client_address[0], self.orig_dst[0], self.orig_dst[1])
 
     def __str__(self):
         return "%s [%s->%s]" % (self.get_session_id(), self.client_address, self.sockname)
@@ -6,8 +6,16 @@
 
 import logging, threading
 from exceptions import StopIteration
+from time import time
 from sslcaudit.core import CFG_PTA_REPEAT, CFG_PTA_DROP, CFG_PTA_EXIT
-from sslcaudit.core.ConnectionAuditEvent import SessionStartEvent, SessionEndResult
+from sslcaudit.core.ConnectionAuditEvent import SessionStartEvent, SessionEndResult, ConnectionAuditResult
+from sslcaudit.core.ProfileTable import ProfileTable
+
+# returned by next_profile() when a dynamic profile needs the results of the connections in progress to choose
+PROFILE_PENDING = 'pending'
+
+# how long handle() waits for those results before dropping the connection, in seconds
+DEFAULT_PARK_TIMEOUT = 30.0
 
 class ClientServerSessionHandler(object):
     '''
@@ -21,6 +29,13 @@ class ClientServerSessionHandler(object):
     After each connection is handled, it pushes the result returned by the handler, which normally is
     ConnectionAuditResult or another subclass of ConnectionAuditEvent.
     After the last auditor has finished its work it pushes ClientAuditEndEvent and ClientAuditResult into the queue.
+    The profiles come from a ProfileTable shared by all sessions, the session refers to them by index.
+    The table may contain dynamic profiles (see BaseDynamicProfile). The session keeps its own instance of each of
+    them, which decides which concrete profiles to use based on the results of previous connections. The session
+    moves on to the next profile in the table only once the dynamic profile is done. A connection arriving while the
+    dynamic profile waits for the results of the connections in progress gets parked: handle() waits for the next
+    result (park_timeout seconds at most), handle_async() keeps the connection aside and hands it over again once the
+    next result is recorded.
     '''
     logger = logging.getLogger('ClientServerSessionHandler')
 
@@ -30,12 +45,37 @@ class ClientServerSessionHandler(object):
         self.res_queue = res_queue
         self.file_bag = file_bag
 
+        if not isinstance(profiles, ProfileTable):
+            profiles = ProfileTable(profiles)
         self.profiles = profiles
         self.post_test_action = post_test_action
 
+        # index -> session instance of the dynamic profile
+        self.dynamic_profiles = dict((index, profiles[index].mk_session_instance())
+            for index in profiles.dynamic_indices)
+        self.dynamic = len(self.dynamic_profiles) > 0
+
         self.nused_profiles = 0
         self.lock = threading.Lock()  # this lock has to be acquired before using nused_profiles and result attributes
+        self.result_recorded = threading.Condition(self.lock)  # notified on each result of a dynamic profile
+
+        # progress of sessions with dynamic profiles: index of the current profile, the number of connections in
+        # progress, and (index, concrete profile) tuples handed out so far
+        self.next_index = 0
+        self.npending = 0
+        self.used_profiles = []
+        self.finished = False
+
+        # (conn, engine, on_done) tuples of the connections parked by handle_async()
+        self.parked = []
+        self.park_timeout = DEFAULT_PARK_TIMEOUT
+
+        # set once the session is dropped from the session table, no more SessionEndResult events after that
+        self.evicted = False
+
+        self.report_start()
 
+    def report_start(self):
         self.res_queue.put(SessionStartEvent(self.session_id, self.profiles))
 
     def handle(self, conn):
@@ -45,50 +85,235 @@ class ClientServerSessionHandler(object):
         uses it to handle this connection, and submits the result of handling this specific connection
         to the results queue. It detects when the very last handler quits and issues audit-end-res event.
         '''
+        next_profile = self.next_profile(conn)
+        if next_profile == PROFILE_PENDING:
+            next_profile = self.wait_for_profile(conn)
+        if next_profile is None:
+            return
+        (profile_index, excess, profile) = next_profile
+
+        # handle this connection with this profile
+        self.logger.debug('will use profile %d to handle connection %s', profile_index, conn)
+        handler = profile.get_handler()
+        res = handler.handle(conn, profile, self.file_bag)
+        conn.release()
+
+        self.record_result(conn, profile, profile_index, excess, res)
+
+    def handle_async(self, conn, engine, on_done):
+        '''
+        This method does the same as handle(), but hands the connection over to ConnectionEngine instead of handling
+        it in the calling thread. Returns True if the connection was handed over, in that case on_done() will be
+        invoked once the connection is handled and the result is recorded.
+        '''
+        next_profile = self.next_profile(conn, (conn, engine, on_done))
+        if next_profile == PROFILE_PENDING:
+            # handed over again once the next result arrives, see resume_parked()
+            return True
+        if next_profile is None:
+            return False
+        (profile_index, excess, profile) = next_profile
+
+        self.logger.debug('will use profile %d to handle connection %s asynchronously', profile_index, conn)
+        handler = profile.get_handler()
+
+        def callback(res):
+            try:
+                conn.release()
+                if res is None:
+                    # the handler has failed, the session still has to account for this connection
+                    res = ConnectionAuditResult(conn, profile, 'handler failed')
+                self.record_result(conn, profile, profile_index, excess, res)
+            finally:
+                on_done()
+
+        return engine.submit(handler, conn, profile, self.file_bag, callback)
+
+    def next_profile(self, conn, parked=None):
+        '''
+        Returns a tuple of the index of the profile in the table, 'excess' flag, and the profile to use to handle this
+        connection (same as the one in the table, unless it is a dynamic profile), or None if the connection should be
+        dropped. In PTA_REPEAT mode, 'excess' flag will be set if the number of handled connections exceeds the number
+        of available profiles.
+        Returns PROFILE_PENDING if a dynamic profile can only choose once the results of the connections in progress
+        arrive. In that case 'parked' tuple, unless it is None, gets appended to the parked connections.
+        '''
+        if self.dynamic:
+            return self.next_dynamic_profile(conn, parked)
+
+        nused_profiles = self.alloc_profile_slot()
+        if nused_profiles < len(self.profiles):
+            return (nused_profiles, False, self.profiles[nused_profiles])
+        else:
+            if (self.post_test_action == CFG_PTA_DROP) or (self.post_test_action == CFG_PTA_EXIT):
+                # no more profiles to apply, just let the connection drop
+                self.logger.debug('no unused profiles for connection %s', conn)
+                return None
+
+            if self.post_test_action != CFG_PTA_REPEAT:
+                raise ValueError('unexpected post-test-action value')
+
+            profile_index = nused_profiles%len(self.profiles)
+            return (profile_index, True, self.profiles[profile_index])
+
+    def next_dynamic_profile(self, conn, parked=None):
+        with self.lock:
+            next_profile = self.choose_dynamic_profile(conn)
+            if next_profile == PROFILE_PENDING and parked is not None:
+                self.parked.append(parked)
+            return next_profile
+
+    def wait_for_profile(self, conn):
+        '''
+        Waits until the profile for given connection can be chosen, park_timeout seconds at most. Returns the same as
+        next_profile(), or None if the time is over.
+        '''
+        deadline = time() + self.park_timeout
+        with self.lock:
+            while True:
+                next_profile = self.choose_dynamic_profile(conn)
+                if next_profile != PROFILE_PENDING:
+                    return next_profile
+                timeout = deadline - time()
+                if timeout <= 0:
+                    self.logger.debug('no profile for connection %s in %.1fs, dropping it', conn, self.park_timeout)
+                    return None
+                self.result_recorded.wait(timeout)
+
+    def choose_dynamic_profile(self, conn):
+        # this method has to be invoked with the lock held
+        while self.next_index < len(self.profiles):
+            profile_index = self.next_index
+            entry = self.dynamic_profiles.get(profile_index)
+            if entry is None:
+                self.next_index += 1
+                return self.hand_out(profile_index, self.profiles[profile_index])
 
-        # get the index of the profile to use to handle this connection
-        # in PTA_REPEAT mode, 'excess' flag will be set if the number of handled connections exceeds
-        # the number of available profiles
+            profile = entry.next_profile()
+            if profile is not None:
+                return self.hand_out(profile_index, profile)
+            if not entry.is_done():
+                # the next profile depends on the results of the connections in progress
+                self.logger.debug('parking connection %s until pending results arrive', conn)
+                return PROFILE_PENDING
+            self.next_index += 1
+
+        if (self.post_test_action == CFG_PTA_DROP) or (self.post_test_action == CFG_PTA_EXIT):
+            self.logger.debug('no unused profiles for connection %s', conn)
+            return None
+
+        if self.post_test_action != CFG_PTA_REPEAT:
+            raise ValueError('unexpected post-test-action value')
+
+        if len(self.used_profiles) == 0:
+            # none of the dynamic profiles had anything to offer
+            self.logger.debug('no profiles to repeat for connection %s', conn)
+            return None
+
+        # go over the concrete profiles used so far
+        (profile_index, profile) = self.used_profiles[self.nused_profiles%len(self.used_profiles)]
+        self.nused_profiles += 1
+        return (profile_index, True, profile)
+
+    def hand_out(self, profile_index, profile):
+        # this method has to be invoked with the lock held
+        self.npending += 1
+        self.used_profiles.append((profile_index, profile))
+        return (profile_index, False, profile)
+
+    def alloc_profile_slot(self):
+        '''
+        Returns the number of connections seen in this session so far, counting this one in for the next time.
+        '''
+        with self.lock:
+            nused_profiles = self.nused_profiles
+            self.nused_profiles += 1
+            return nused_profiles
+
+    def record_result(self, conn, profile, profile_index, excess, res):
+        # log the results of the test
+        self.logger.debug('handling connection %s (excess=%s) using %s (%d/%d) resulted in %s',
+            conn, str(excess), profile, profile_index, len(self.profiles), res)
+
+        #if excess:
+        #    return
+
+        # record the results of the test
+        self.res_queue.put(res)
+
+        if self.dynamic:
+            self.record_dynamic_result(conn, profile, profile_index, excess, res)
+            if not excess:
+                self.resume_parked()
+            return
+
+        # see if this thread is the very last handler out there
+        with self.lock:
+            self.result.add(res, excess)
+            if self.evicted:
+                return
+            if len(self.result.results) >= len(self.profiles):
+                # the result object seems to contains enough results, this must be the very last handler out there
+                # submit the final result to the queue
+                self.logger.debug('last profile for connection %s', conn)
+                self.finished = True
+                self.res_queue.put(self.result)
+
+    def record_dynamic_result(self, conn, profile, profile_index, excess, res):
+        with self.lock:
+            self.result.add(res, excess)
+            if excess:
+                return
+
+            self.npending -= 1
+            entry = self.dynamic_profiles.get(profile_index)
+            if entry is not None:
+                entry.add_result(profile, res)
+                if entry.is_done():
+                    summary = entry.get_summary()
+                    if summary is not None:
+                        # reported against the profile from the table, the one SessionStartEvent has announced
+                        summary_res = ConnectionAuditResult(conn, self.profiles[profile_index], summary)
+                        self.res_queue.put(summary_res)
+                        self.result.add(summary_res)
+
+            # skip dynamic profiles which are done
+            while self.next_index < len(self.profiles):
+                entry = self.dynamic_profiles.get(self.next_index)
+                if entry is None or not entry.is_done():
+                    break
+                self.next_index += 1
+            self.result_recorded.notify_all()
+
+            if self.evicted:
+                return
+            if not self.finished and self.next_index >= len(self.profiles) and self.npending == 0:
+                self.logger.debug('last profile for connection %s', conn)
+                self.finished = True
+                self.res_queue.put(self.result)
+
+    def resume_parked(self):
+        '''
+        Hands the connections parked by handle_async() over again, the ones still lacking a profile get parked again.
+        '''
+        with self.lock:
+            parked = self.parked
+            self.parked = []
+        for (conn, engine, on_done) in parked:
+            if not self.handle_async(conn, engine, on_done):
+                on_done()
+
+    def evict(self):
+        '''
+        This method is invoked when the session gets dropped from the session table. Unless the session has already
+        ended, it reports the results collected so far as a partial SessionEndResult. The connections still in progress
+        get their results reported as usual, but the session does not end again.
+        '''
         with self.lock:
-            if self.nused_profiles < len(self.profiles):
-                profile_index = self.nused_profiles
-                self.nused_profiles += 1
-                excess = False
-            else:
-                if (self.post_test_action == CFG_PTA_DROP) or (self.post_test_action == CFG_PTA_EXIT):
-                    # no more profiles to apply, just let the connection drop
-                    self.logger.debug('no unused profiles for connection %s', conn)
-                    return
-
-                if self.post_test_action != CFG_PTA_REPEAT:
-                    raise ValueError('unexpected post-test-action value')
-
-                profile_index = self.nused_profiles%len(self.profiles)
-                self.nused_profiles += 1
-                excess = True
-
-        if True:
-            # handle this connection with this profile
-            self.logger.debug('will use profile %d to handle connection %s', profile_index, conn)
-            profile = self.profiles[profile_index]
-            handler = profile.get_handler()
-            res = handler.handle(conn, profile, self.file_bag)
-
-            # log the results of the test
-            self.logger.debug('handling connection %s (excess=%s) using %s (%d/%d) resulted in %s',
-                conn, str(excess), profile, profile_index, len(self.profiles), res)
-
-            #if excess:
-            #    return
-
-            # record the results of the test
-            self.res_queue.put(res)
-
-            # see if this thread is the very last handler out there
-            with self.lock:
-                self.result.add(res)
-                if len(self.result.results) >= len(self.profiles):
-                    # the result object seems to contains enough results, this must be the very last handler out there
-                    # submit the final result to the queue
-                    self.logger.debug('last profile for connection %s', conn)
-                    self.res_queue.put(self.result)
+            if self.evicted or self.finished:
+                self.evicted = True
+                return
+            self.evicted = True
+            self.logger.debug('session %s evicted before its end', self.session_id)
+            self.result.partial = True
+            self.res_queue.put(self.result)
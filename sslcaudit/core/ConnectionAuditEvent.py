@@ -35,10 +35,55 @@ class ConnectionAuditResult(ConnectionAuditEvent):
     def __str__(self):
         return 'ConnectionAuditResult(%s, %s)' % (self.profile, self.result)
 
+
+class ResultRecord(object):
+    '''
+    This class is a compact form of ConnectionAuditResult, kept for the whole lifetime of a session. It does not
+    refer to the connection nor to the profile, only holds client and server addresses (the original destination if
+    the connection got redirected), the name of the profile, the outcome, and the timings. The outcome is kept as the
+    name of the class of the result plus its text, both interned, so that the records of all sessions share them;
+    the result object itself, possibly holding the data received from the client, is dropped. The reference to the
+    captured data in the FileBag, if any, is kept as capture_ref.
+    '''
+    __slots__ = ('client_address', 'server_address', 'profile_id', 'result_class', 'result', 'capture_ref',
+        'start_time', 'duration')
+
+    def __init__(self, res):
+        self.client_address = intern_address(res.conn.client_address)
+        if res.conn.orig_dst is not None:
+            self.server_address = share_address(res.conn.orig_dst)
+        else:
+            self.server_address = share_address(res.conn.sockname)
+        self.profile_id = intern(str(res.profile))
+        self.result_class = intern(res.result.__class__.__name__)
+        self.result = intern(str(res.result))
+        self.capture_ref = getattr(res.result, 'req_file', None)
+        self.start_time = res.conn.start_time
+        self.duration = res.conn.get_duration()
+
+    def __str__(self):
+        return 'ResultRecord(%s, %s)' % (self.profile_id, self.result)
+
+
+def intern_address(address):
+    # all connections of a session come from the same host, there is no need to keep many copies of its address
+    if address is None:
+        return None
+    return (intern(address[0]),) + tuple(address[1:])
+
+MAX_SHARED_ADDRESSES = 4096
+shared_addresses = {}
+
+def share_address(address):
+    # the clients connect to a few server addresses only, the records share a single copy of each
+    if address is None or len(shared_addresses) >= MAX_SHARED_ADDRESSES:
+        return address
+    return shared_addresses.setdefault(address, address)
+
 class SessionStartEvent(ControllerEvent):
     '''
     This event is generated by ClientServerSessionHandler on very first connection.
-    It carries the list of test profiles scheduled for this client.
+    It carries the ProfileTable with test profiles scheduled for this client, the same object for all clients.
     '''
     def __init__(self, session_id, profiles):
         self.session_id = session_id
@@ -48,12 +93,44 @@ class SessionStartEvent(ControllerEvent):
 class SessionEndResult(ControllerEvent):
     '''
     This event is generated by ClientServerSessionHandler after very last connection.
-    It contains results produced by handle() methods of all client connection auditors, for a single client.
+    It contains results produced by handle() methods of all client connection auditors, for a single client. The
+    results of the connections are kept as ResultRecord objects. The results of excess connections (the ones beyond
+    the profiles, in repeat mode) are only counted. If the session gets dropped before all the profiles are used, the
+    result is marked as partial.
     '''
 
     def __init__(self, session_id):
         self.session_id = session_id
         self.results = []
+        self.nexcess = 0
+        self.partial = False
 
-    def add(self, res):
+    def add(self, res, excess=False):
+        if excess:
+            self.nexcess += 1
+            return
+        if isinstance(res, ConnectionAuditResult):
+            res = ResultRecord(res)
         self.results.append(res)
+
+
+class CoalescedResults(ControllerEvent):
+    '''
+    This event stands for the events left out because the queue of events was full (see EventQueue). It only keeps
+    the number of such events per session, so that the connections they refer to can be released.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.counts = {}  # session id -> number of events, None stands for events not related to a connection
+
+    def add(self, event):
+        if isinstance(event, ConnectionAuditEvent):
+            session_id = event.conn.get_session_id()
+        else:
+            session_id = None
+        self.counts[session_id] = self.counts.get(session_id, 0) + 1
+        self.count += 1
+
+    def __str__(self):
+        return 'CoalescedResults(%d events)' % self.count
@@ -0,0 +1,291 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import select
+import threading
+from threading import Thread
+from time import time
+from sslcaudit.core.WorkerPool import WorkerPool, OVERFLOW_WAIT
+
+DEFAULT_NLOOPS = 1
+DEFAULT_NSHIM_WORKERS = 16
+
+# upper bound for a single epoll wait, keeps the loop responsive to stop()
+MAX_POLL_INTERVAL = 1.0
+
+class ConnectionTask(object):
+    '''
+    This is a base class for per-connection state machines driven by ConnectionEngine. The engine invokes start()
+    once, then on_readable() every time the client socket becomes readable, and on_timeout() once the deadline set by
+    set_timeout() passes. Each of these methods returns None if the task needs to wait for more input, or the final
+    result of the connection audit (normally ConnectionAuditResult). If any of them throws an exception, on_error() is
+    invoked to turn it into the result.
+
+    Tasks only wait for the socket to become readable. Server side of SSL handshake writes a handful of records,
+    which always fit into the socket send buffer of a freshly accepted connection.
+    '''
+
+    def __init__(self, conn, profile):
+        self.conn = conn
+        self.profile = profile
+        self.deadline = None
+
+    def fileno(self):
+        return self.conn.sock.fileno()
+
+    def set_timeout(self, timeout):
+        self.deadline = time() + timeout
+
+    def start(self):
+        raise NotImplementedError('subclasses must override this method')
+
+    def on_readable(self):
+        raise NotImplementedError('subclasses must override this method')
+
+    def on_timeout(self):
+        raise NotImplementedError('subclasses must override this method')
+
+    def on_error(self, ex):
+        raise NotImplementedError('subclasses must override this method')
+
+
+class EventLoop(Thread):
+    '''
+    This class multiplexes many ConnectionTasks over a single epoll object in a single thread. Once the loop is
+    stopped, submit() rejects new tasks, and the tasks still in progress or waiting to be picked up get their
+    callbacks invoked with None.
+    '''
+    logger = logging.getLogger('EventLoop')
+
+    def __init__(self, name):
+        Thread.__init__(self, target=self.run, name=name)
+        self.daemon = True
+
+        self.epoll = select.epoll()
+        self.tasks = {}  # fd -> (task, callback)
+        self.deadlines = []  # heap of (deadline, seq, fd, task)
+        self.seq = itertools.count()
+
+        # tasks submitted from other threads wait here until the loop picks them up
+        self.lock = threading.Lock()  # this lock has to be acquired before using 'pending', 'stopped' and the pipe
+        self.pending = []
+        self.stopped = False
+        (self.wakeup_r, self.wakeup_w) = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.epoll.register(self.wakeup_r, select.EPOLLIN)
+
+        self.should_stop = False
+
+    def submit(self, task, callback):
+        '''
+        Hands the task over to the loop. Returns False if the loop is stopped, the callback will not be invoked then.
+        '''
+        with self.lock:
+            if self.stopped:
+                return False
+            self.pending.append((task, callback))
+            self.wakeup()
+        return True
+
+    def wakeup(self):
+        # this method has to be invoked with the lock held, the pipe gets closed once the loop is stopped
+        try:
+            os.write(self.wakeup_w, 'x')
+        except OSError as ex:
+            if ex.errno != errno.EAGAIN:
+                raise
+
+    def stop(self):
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.should_stop = True
+            self.wakeup()
+
+    def get_ntasks(self):
+        return len(self.tasks)
+
+    def run(self):
+        try:
+            self.run_loop()
+        finally:
+            self.shutdown()
+
+    def run_loop(self):
+        while not self.should_stop:
+            if len(self.deadlines) > 0:
+                poll_timeout = min(max(self.deadlines[0][0] - time(), 0), MAX_POLL_INTERVAL)
+            else:
+                poll_timeout = MAX_POLL_INTERVAL
+
+            try:
+                events = self.epoll.poll(poll_timeout)
+            except IOError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, _) in events:
+                if fd == self.wakeup_r:
+                    os.read(self.wakeup_r, 4096)
+                    self.add_pending_tasks()
+                elif fd in self.tasks:
+                    task = self.tasks[fd][0]
+                    self.step(task, task.on_readable)
+
+            self.expire_tasks()
+
+    def shutdown(self):
+        '''
+        Closes the loop and finishes the tasks left with None result.
+        '''
+        with self.lock:
+            # nothing can write to the pipe once the flag is set
+            self.stopped = True
+            pending = self.pending
+            self.pending = []
+            os.close(self.wakeup_r)
+            os.close(self.wakeup_w)
+
+        callbacks = []
+        for (fd, (task, callback)) in self.tasks.items():
+            self.epoll.unregister(fd)
+            callbacks.append((task, callback))
+        self.tasks = {}
+        self.deadlines = []
+        self.epoll.close()
+
+        for (task, callback) in callbacks + pending:
+            try:
+                callback(None)
+            except Exception as ex:
+                self.logger.error('callback for task %s has thrown an exception: %s', task, ex)
+
+    def add_pending_tasks(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+
+        for (task, callback) in pending:
+            fd = task.fileno()
+            self.tasks[fd] = (task, callback)
+            self.epoll.register(fd, select.EPOLLIN)
+            self.step(task, task.start)
+
+    def expire_tasks(self):
+        now = time()
+        while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+            (deadline, _, fd, task) = heapq.heappop(self.deadlines)
+            # skip stale entries, left behind by finished tasks or tasks which have moved their deadlines
+            if fd in self.tasks and self.tasks[fd][0] is task and task.deadline == deadline:
+                self.step(task, task.on_timeout)
+
+    def step(self, task, method):
+        '''
+        Advances the state machine of the task and finishes the task if it has produced the result.
+        '''
+        prev_deadline = task.deadline
+        try:
+            res = method()
+        except Exception as ex:
+            try:
+                res = task.on_error(ex)
+            except Exception as ex:
+                # the callback still has to learn the task is over, the other tasks of the loop go on
+                self.logger.error('error handler of task %s has thrown an exception: %s', task, ex)
+                self.finish(task, None)
+                return
+
+        if res is None:
+            if task.deadline is not None and task.deadline != prev_deadline:
+                heapq.heappush(self.deadlines, (task.deadline, self.seq.next(), task.fileno(), task))
+            return
+
+        self.finish(task, res)
+
+    def finish(self, task, res):
+        fd = task.fileno()
+        callback = self.tasks.pop(fd)[1]
+        self.epoll.unregister(fd)
+        try:
+            callback(res)
+        except Exception as ex:
+            self.logger.error('callback for task %s has thrown an exception: %s', task, ex)
+
+
+class ConnectionEngine(object):
+    '''
+    This class handles client connections without dedicating a thread to each of them. Server handlers which are
+    able to produce a ConnectionTask (see BaseServerHandler.mk_task()) get multiplexed over a few EventLoop threads.
+    For the rest of them the engine provides a compatibility shim: their blocking handle() method gets invoked in a
+    small WorkerPool.
+    Either way the result of the connection audit is passed to a callback, invoked from a thread belonging to the
+    engine. If a blocking handler throws an exception, or the engine gets stopped before the connection is handled,
+    the callback receives None. The engine does not close client sockets, it is up to the callback.
+    '''
+    logger = logging.getLogger('ConnectionEngine')
+
+    def __init__(self, nloops=DEFAULT_NLOOPS, shim_pool=None):
+        if not hasattr(select, 'epoll'):
+            raise RuntimeError('event-driven connection engine requires epoll support')
+
+        self.loops = [EventLoop('EventLoop-%d' % n) for n in range(nloops)]
+        self.next_loop = itertools.cycle(self.loops)
+
+        if shim_pool is None:
+            shim_pool = WorkerPool(DEFAULT_NSHIM_WORKERS, overflow_policy=OVERFLOW_WAIT, overflow_timeout=None,
+                name='ConnectionEngineShim')
+        self.shim_pool = shim_pool
+
+    def start(self):
+        for loop in self.loops:
+            loop.start()
+
+    def stop(self):
+        for loop in self.loops:
+            loop.stop()
+        self.shim_pool.stop()
+
+    def submit(self, handler, conn, profile, file_bag, callback):
+        '''
+        Starts handling the connection with given handler and profile. Returns False if the engine is not able to
+        accept the connection (it is shutting down), the callback will not be invoked then.
+        '''
+        task = handler.mk_task(conn, profile, file_bag)
+        if task is not None:
+            return self.next_loop.next().submit(task, callback)
+        else:
+            return self.shim_pool.submit(self.run_blocking_handler, handler, conn, profile, file_bag, callback,
+                on_discard=lambda: callback(None))
+
+    def run_blocking_handler(self, handler, conn, profile, file_bag, callback):
+        try:
+            res = handler.handle(conn, profile, file_bag)
+        except Exception as ex:
+            self.logger.error('handler %s has thrown an exception: %s', handler, ex)
+            res = None
+        callback(res)
+
+    def get_stats(self):
+        '''
+        Returns a dictionary with the number of connections handled by each event loop and the stats of the shim
+        worker pool.
+        '''
+        return {
+            'ntasks': [loop.get_ntasks() for loop in self.loops],
+            'shim': self.shim_pool.get_stats()
+        }
+
+    def __str__(self):
+        return 'ConnectionEngine(%d loops)' % len(self.loops)
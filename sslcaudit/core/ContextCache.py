@@ -0,0 +1,49 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import threading
+from collections import OrderedDict
+from sslcaudit.core.LazyValue import LazyValue
+
+DEFAULT_MAX_ENTRIES = 1024
+
+class ContextCache(object):
+    '''
+    This class keeps SSL contexts for reuse across connections. A configured context is never modified, so it can be
+    shared by any number of connections at once. The key must cover everything the context depends on (protocol,
+    paths to the certificate and key files, etc), so that a changed profile gets a new context.
+    Each context gets built once, by the first caller asking for it, the others wait for it. Once there are more than
+    max_entries contexts, least recently used ones get dropped.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> LazyValue, least recently used first
+        self.lock = threading.Lock()  # this lock has to be acquired before using entries attribute
+
+    def get(self, key, mk_context):
+        '''
+        Returns the context for given key, building it with mk_context() if necessary. If mk_context() throws an
+        exception, nothing gets cached and the exception is passed to the caller.
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = LazyValue(mk_context)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        try:
+            return entry.get()
+        except:
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            raise
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,88 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import logging
+from Queue import Empty
+
+DEFAULT_MAX_BATCH = 256
+
+class StopDispatch(object):
+    '''
+    This class is a marker put into the queue to wake up the dispatcher when it gets stopped.
+    '''
+    pass
+
+
+class EventDispatcher(object):
+    '''
+    This class delivers the events coming from a queue to the subscribers. It blocks on the queue without a timeout,
+    so it wakes up as soon as an event arrives. Then it takes all the events already waiting in the queue, up to
+    max_batch, and hands them over at once: as a list to the subscribers registered with subscribe_batch(), one by one
+    to the subscribers registered with subscribe(). A failing subscriber does not prevent the others from getting the
+    events. stop() wakes the dispatcher up immediately, it returns from run() once it has delivered the events queued
+    before the stop.
+    '''
+    logger = logging.getLogger('EventDispatcher')
+
+    def __init__(self, queue, max_batch=DEFAULT_MAX_BATCH):
+        self.queue = queue
+        self.max_batch = max_batch
+        self.handlers = []
+        self.batch_handlers = []
+
+        self.nevents = 0
+        self.nbatches = 0
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+
+    def subscribe_batch(self, handler):
+        self.batch_handlers.append(handler)
+
+    def stop(self):
+        self.queue.put(StopDispatch())
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            (batch, stopped) = self.next_batch()
+            if len(batch) > 0:
+                self.dispatch(batch)
+        self.logger.debug('dispatched %d events in %d batches', self.nevents, self.nbatches)
+
+    def next_batch(self):
+        '''
+        Returns a tuple of the list of events waiting in the queue, blocking until there is at least one, and a flag
+        telling if the dispatcher got stopped. The events queued after the stop are left in the queue.
+        '''
+        events = []
+        event = self.queue.get()
+        try:
+            while not isinstance(event, StopDispatch):
+                events.append(event)
+                if len(events) >= self.max_batch:
+                    return (events, False)
+                event = self.queue.get_nowait()
+        except Empty:
+            return (events, False)
+        return (events, True)
+
+    def dispatch(self, batch):
+        self.nevents += len(batch)
+        self.nbatches += 1
+
+        for handler in self.batch_handlers:
+            try:
+                handler(batch)
+            except Exception as ex:
+                self.logger.exception('subscriber %s failed: %s', handler, ex)
+
+        for handler in self.handlers:
+            for event in batch:
+                try:
+                    handler(event)
+                except Exception as ex:
+                    self.logger.exception('subscriber %s failed on %s: %s', handler, event, ex)
@@ -0,0 +1,109 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+from Queue import Queue, Full
+from sslcaudit.core.ConnectionAuditEvent import CoalescedResults
+from sslcaudit.core.EventDispatcher import StopDispatch
+
+EVENT_WAIT = 'wait'
+EVENT_DROP = 'drop'
+EVENT_COALESCE = 'coalesce'
+EVENT_FORCE = 'force'
+EVENT_POLICIES = (EVENT_WAIT, EVENT_DROP, EVENT_COALESCE)
+
+DEFAULT_EVENT_QUEUE_SIZE = 10000
+
+class EventQueue(Queue):
+    '''
+    This class is a bounded queue of events, applying a policy depending on the type of the event when it is full:
+      * EVENT_WAIT blocks the caller until there is room in the queue, this is the default for all events,
+      * EVENT_DROP discards the event,
+      * EVENT_COALESCE folds the event into a CoalescedResults event, only keeping the count, so that the connection
+        the event refers to can be released. While such event is in the queue, subsequent coalesced events get added to
+        it, so the queue can only grow by one event over its size,
+      * EVENT_FORCE queues the event anyway, this is meant for control events, like the one stopping the dispatcher.
+    The policies are given as a dictionary mapping event classes to policies, subclasses inherit the policy of their
+    parent class unless they have one of their own. The counts of dropped and coalesced events, by class name, are
+    available via get_stats().
+    '''
+
+    def __init__(self, maxsize=DEFAULT_EVENT_QUEUE_SIZE, policies=None):
+        Queue.__init__(self, maxsize)
+        self.policies = {StopDispatch: EVENT_FORCE}
+        if policies is not None:
+            self.policies.update(policies)
+
+        self.coalesced = None  # CoalescedResults event currently waiting in the queue, if any
+
+        # these counters are protected by the mutex of the queue
+        self.ndropped = {}
+        self.ncoalesced = {}
+        self.max_depth = 0
+
+    def get_policy(self, item):
+        for cls in type(item).__mro__:
+            if cls in self.policies:
+                return self.policies[cls]
+        return EVENT_WAIT
+
+    def put(self, item, block=True, timeout=None):
+        policy = self.get_policy(item)
+        if policy == EVENT_WAIT:
+            Queue.put(self, item, block, timeout)
+            return
+
+        with self.not_full:
+            if policy == EVENT_FORCE or not self.is_full():
+                self.enqueue(item)
+            elif policy == EVENT_DROP:
+                count(self.ndropped, item)
+            elif policy == EVENT_COALESCE:
+                count(self.ncoalesced, item)
+                if self.coalesced is None:
+                    self.coalesced = CoalescedResults()
+                    self.enqueue(self.coalesced)
+                self.coalesced.add(item)
+            else:
+                raise ValueError('unexpected event policy: %s' % policy)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def is_full(self):
+        # this method has to be invoked with the mutex held
+        return 0 < self.maxsize <= self._qsize()
+
+    def enqueue(self, item):
+        # this method has to be invoked with the mutex held
+        self._put(item)
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+
+    def _put(self, item):
+        Queue._put(self, item)
+        if self._qsize() > self.max_depth:
+            self.max_depth = self._qsize()
+
+    def _get(self):
+        item = Queue._get(self)
+        if item is self.coalesced:
+            # the events coming next start a new one
+            self.coalesced = None
+        return item
+
+    def get_stats(self):
+        with self.mutex:
+            return {
+                'depth': self._qsize(),
+                'max_depth': self.max_depth,
+                'dropped': dict(self.ndropped),
+                'coalesced': dict(self.ncoalesced)
+            }
+
+
+def count(counters, item):
+    name = type(item).__name__
+    counters[name] = counters.get(name, 0) + 1
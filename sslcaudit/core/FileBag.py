@@ -7,23 +7,163 @@
 import os
 from tempfile import NamedTemporaryFile
 import errno
+import hashlib
+import itertools
+import logging
+import re
+import shutil
+import time
 import tempfile
+import threading
+import zlib
+from Queue import Queue, Empty
+from sslcaudit.core.LazyValue import LazyValue
+from sslcaudit.core.SegmentArchive import SegmentArchive, DEFAULT_SEGMENT_SIZE
 
 DEFAULT_BASENAME = 'sslcaudit'
 MAX_REV = 1000000
+REV_FILE_SUFFIX = '.rev'
+
+DEFAULT_WRITER_QUEUE_SIZE = 1024
+MAX_WRITER_BATCH = 64
+
+ARCHIVE_DIRNAME = 'requests'
+
+DEFAULT_COMPRESS_THRESHOLD = 256
+
+# with compression enabled, the stored data starts with one of these tags
+TAG_RAW = 'R'
+TAG_ZLIB = 'Z'
+
+logger = logging.getLogger('FileBag')
+
+def list_file_bags(basename):
+    '''
+    Returns the list of (revision, path) tuples of the existing file bags with given base name, ordered by revision.
+    '''
+    dirname = os.path.dirname(basename) or '.'
+    pattern = re.compile('^%s\\.(\\d+)$' % re.escape(os.path.basename(basename)))
+    bags = []
+    for name in os.listdir(dirname):
+        match = pattern.match(name)
+        if match is not None and os.path.isdir(os.path.join(dirname, name)):
+            bags.append((int(match.group(1)), os.path.join(os.path.dirname(basename), name)))
+    bags.sort()
+    return bags
+
+def read_next_rev(basename):
+    '''
+    Returns the revision number to try first for a new file bag with given base name. It comes from the file keeping
+    the high-water mark next to the bags, if there is no such file, the existing bags get listed.
+    '''
+    try:
+        with open(basename + REV_FILE_SUFFIX) as f:
+            return int(f.read())
+    except (IOError, ValueError):
+        pass
+
+    try:
+        bags = list_file_bags(basename)
+    except OSError:
+        # the directory is not there, creating the bag will fail with a proper error
+        return 0
+    if len(bags) > 0:
+        return bags[-1][0] + 1
+    else:
+        return 0
+
+def write_next_rev(basename, rev):
+    # write to a temporary file and rename it, so that a concurrent reader sees either the old or the new value
+    rev_file = basename + REV_FILE_SUFFIX
+    tmp_file = '%s.%d.tmp' % (rev_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as f:
+            f.write('%d\n' % rev)
+        os.rename(tmp_file, rev_file)
+    except (IOError, OSError):
+        # the high-water mark is only an optimization
+        pass
+
+def get_dir_size(path):
+    size = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return size
+
+def prune_file_bags(basename, max_age=None, max_size=None, keep=0, dry_run=False):
+    '''
+    Removes old file bags with given base name and returns the list of paths removed. The bags last modified more
+    than max_age seconds ago get removed, then the oldest bags get removed until the total size of the others is
+    not above max_size bytes. The keep newest bags are never removed. If dry_run is set, nothing actually gets removed.
+    '''
+    now = time.time()
+    bags = [(os.path.getmtime(path), path) for (_, path) in list_file_bags(basename)]
+    bags.sort()
+    if keep > 0:
+        candidates = bags[:-keep]
+    else:
+        candidates = bags
+
+    removed = []
+    for (mtime, path) in candidates:
+        if max_age is not None and now - mtime > max_age:
+            removed.append(path)
+
+    if max_size is not None:
+        sizes = dict((path, get_dir_size(path)) for (_, path) in bags)
+        total_size = sum(size for (path, size) in sizes.items() if path not in removed)
+        for (mtime, path) in candidates:
+            if total_size <= max_size:
+                break
+            if path not in removed:
+                removed.append(path)
+                total_size -= sizes[path]
+
+    if not dry_run:
+        for path in removed:
+            shutil.rmtree(path, ignore_errors=True)
+    return removed
+
 
 class FileBag(object):
     '''
-    This class
+    This class allocates a fresh directory for the files of a single run (captured client requests, generated
+    certificates and keys, logs) and creates the files in it.
+    If dedup is set, the data passed to store() is looked up by its SHA1 hash first, and a piece of data stored
+    before is not saved again, the reference to the existing copy is returned instead.
+    If compress_level is set, the data passed to store() and store_file() gets compressed with zlib at that level,
+    unless it is shorter than compress_threshold bytes or does not shrink. load() decompresses it.
     '''
-    def __init__(self, basename, use_tempdir=False):
+    # False if the bag cannot be shared by the processes forked after it has been created
+    fork_safe = True
+    def __init__(self, basename, use_tempdir=False, dedup=False, compress_level=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        self.compress_level = compress_level
+        self.compress_threshold = compress_threshold
+        self.stats_lock = threading.Lock()  # this lock has to be acquired before updating compression counters
+        self.ncompressed = 0
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+
+        self.dedup = dedup
+        self.blobs = {}  # SHA1 digest -> LazyValue of the reference, the data gets saved by the first caller storing it
+        self.dedup_lock = threading.Lock()  # this lock has to be acquired before using blobs and counters
+        self.nstored = 0
+        self.nduplicates = 0
+        self.saved_bytes = 0
+
         if basename == None:
             basename = DEFAULT_BASENAME
 
         if use_tempdir:
             basename = os.path.join(tempfile.mkdtemp(prefix=DEFAULT_BASENAME), basename)
 
-        for rev in range(0, MAX_REV):
+        # start right after the last revision created, rather than trying all the revisions taken so far
+        for rev in xrange(read_next_rev(basename), MAX_REV):
             # create a path based on the base name and revision number
             path = '%s.%d' % (basename, rev)
 
@@ -38,6 +178,7 @@ class FileBag(object):
 
             # created
             self.base_dir = path
+            write_next_rev(basename, rev + 1)
             return
 
         # was unable to create any directory
@@ -76,8 +217,303 @@ class FileBag(object):
                 return (f1, f2)
 
     def store(self, data):
+        '''
+        Stores the data and returns a reference to it, to be passed to load().
+        '''
+        if not self.dedup:
+            return self.save(self.encode(data))
+
+        digest = hashlib.sha1(data).digest()
+        with self.dedup_lock:
+            self.nstored += 1
+            ref = self.blobs.get(digest)
+            if ref is None:
+                ref = LazyValue(self.encode_and_save, data)
+                self.blobs[digest] = ref
+            else:
+                self.nduplicates += 1
+                self.saved_bytes += len(data)
+
+        try:
+            return ref.get()
+        except:
+            with self.dedup_lock:
+                if self.blobs.get(digest) is ref:
+                    del self.blobs[digest]
+            raise
+
+    def encode_and_save(self, data):
+        return self.save(self.encode(data))
+
+    def save(self, data):
+        '''
+        Saves the data, without looking for a copy of it, and returns a reference to it.
+        '''
         f = self.mk_file()
         f.write(data)
         f.close()
         return f.name
 
+    def load(self, ref):
+        '''
+        Returns the data stored under given reference, by store() or store_file().
+        '''
+        return self.decode(self.read(ref))
+
+    def read(self, ref):
+        with open(ref, 'rb') as f:
+            return f.read()
+
+    def store_file(self, filename, data):
+        '''
+        Stores the data in a file with given name, compressed as the data passed to store(), and returns the name of
+        the file. This is meant for the files accompanying the ones created with mk_file() and friends.
+        '''
+        with open(filename, 'wb') as f:
+            f.write(self.encode(data))
+        return filename
+
+    def encode(self, data):
+        if self.compress_level is None:
+            return data
+
+        if len(data) >= self.compress_threshold:
+            compressed = zlib.compress(data, self.compress_level)
+            if len(compressed) < len(data):
+                encoded = TAG_ZLIB + compressed
+            else:
+                encoded = TAG_RAW + data
+        else:
+            encoded = TAG_RAW + data
+
+        with self.stats_lock:
+            if encoded[0] == TAG_ZLIB:
+                self.ncompressed += 1
+            self.raw_bytes += len(data)
+            self.encoded_bytes += len(encoded)
+        return encoded
+
+    def decode(self, data):
+        if self.compress_level is None:
+            return data
+
+        tag = data[:1]
+        if tag == TAG_ZLIB:
+            return zlib.decompress(data[1:])
+        elif tag == TAG_RAW:
+            return data[1:]
+        else:
+            raise ValueError('unexpected tag of stored data: %r' % tag)
+
+    def store_two(self, suffix1, data1, suffix2, data2, prefix=tempfile.template):
+        '''
+        Stores two pieces of data in a pair of files named the same way but for the suffixes (see mk_two_files())
+        and returns the names of the files. The files are complete when this method returns.
+        '''
+        (f1, f2) = self.mk_two_files(suffix1, suffix2, prefix)
+        f1.write(data1)
+        f1.close()
+        f2.write(data2)
+        f2.close()
+        return (f1.name, f2.name)
+
+    def flush(self):
+        '''
+        Returns once all the data stored so far is on disk.
+        '''
+        pass
+
+    def close(self):
+        self.flush()
+        self.log_storage_stats()
+
+    def get_compress_stats(self):
+        with self.stats_lock:
+            return {
+                'compressed': self.ncompressed,
+                'raw_bytes': self.raw_bytes,
+                'encoded_bytes': self.encoded_bytes
+            }
+
+    def get_dedup_stats(self):
+        with self.dedup_lock:
+            return {
+                'stored': self.nstored,
+                'unique': len(self.blobs),
+                'duplicates': self.nduplicates,
+                'saved_bytes': self.saved_bytes
+            }
+
+    def log_storage_stats(self):
+        if self.dedup:
+            logger.info('stored %(stored)d pieces of data, %(unique)d unique, %(duplicates)d duplicates not saved '
+                + '(%(saved_bytes)d bytes)', self.get_dedup_stats())
+        if self.compress_level is not None:
+            logger.info('compressed %(compressed)d pieces of data, %(raw_bytes)d bytes saved as %(encoded_bytes)d',
+                self.get_compress_stats())
+
+
+class AsyncFileBag(FileBag):
+    '''
+    This class is a FileBag writing the data passed to store() behind the back of the caller. store() picks a name
+    for the file and returns it right away, a writer thread creates the file later. The writes are done in batches
+    of up to MAX_WRITER_BATCH files, and if fsync is set, the files of a batch get synced to disk together, followed
+    by the directory. At most queue_size writes can be pending, store() blocks when there are more.
+    The files are not there until flush() returns, so the names returned by store() are only good for reporting in
+    the meantime. The data which has to be read back right away, like certificates and keys loaded by OpenSSL, is
+    written synchronously (see store_two()).
+    Once the bag is closed, the writer thread is gone and store() writes the data synchronously.
+    The writer thread does not survive fork(), so this class cannot be used by worker processes.
+    '''
+    logger = logging.getLogger('AsyncFileBag')
+    fork_safe = False
+
+    def __init__(self, basename, use_tempdir=False, queue_size=DEFAULT_WRITER_QUEUE_SIZE, fsync=True, dedup=False,
+                 compress_level=None, compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        FileBag.__init__(self, basename, use_tempdir, dedup, compress_level, compress_threshold)
+        self.fsync = fsync
+
+        self.queue = Queue(queue_size)
+        self.seq = itertools.count()
+        self.seq_lock = threading.Lock()  # this lock has to be acquired before using seq or closed
+        self.closed = False
+
+        self.nwritten = 0
+        self.nfailed = 0
+        self.nbatches = 0
+
+        self.writer = threading.Thread(target=self.run, name='FileBagWriter')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def save(self, data):
+        with self.seq_lock:
+            name = os.path.join(self.base_dir, 'req-%08d' % next(self.seq))
+            if not self.closed:
+                # close() waits for the lock, so the writer is still there to pick the data up
+                self.queue.put((name, data))
+                return name
+
+        # the writer is gone
+        self.write_batch([(name, data)])
+        return name
+
+    def run(self):
+        '''
+        This method is a target of the writer thread.
+        '''
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < MAX_WRITER_BATCH:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            stop = None in batch
+            try:
+                self.write_batch([item for item in batch if item is not None])
+            except Exception as ex:
+                # the writer has to keep going, flush() waits for it
+                self.logger.error('failed to write a batch of %d files: %s', len(batch), ex)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                break
+
+    def write_batch(self, batch):
+        files = []
+        for (name, data) in batch:
+            try:
+                f = open(name, 'wb')
+                f.write(data)
+                f.flush()
+                files.append(f)
+            except (IOError, OSError) as ex:
+                self.logger.error('failed to write %s: %s', name, ex)
+                self.nfailed += 1
+
+        for f in files:
+            try:
+                if self.fsync:
+                    os.fsync(f.fileno())
+                f.close()
+                self.nwritten += 1
+            except (IOError, OSError) as ex:
+                self.logger.error('failed to write %s: %s', f.name, ex)
+                self.nfailed += 1
+
+        if self.fsync and len(files) > 0:
+            # make the new directory entries durable as well
+            try:
+                dir_fd = os.open(self.base_dir, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError as ex:
+                self.logger.error('failed to sync directory %s: %s', self.base_dir, ex)
+        self.nbatches += 1
+
+    def read(self, ref):
+        self.flush()
+        return FileBag.read(self, ref)
+
+    def flush(self):
+        if self.writer.is_alive():
+            self.queue.join()
+
+    def close(self):
+        '''
+        Writes out all pending data and stops the writer thread.
+        '''
+        with self.seq_lock:
+            self.closed = True
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        self.log_storage_stats()
+
+    def get_stats(self):
+        return {
+            'pending': self.queue.qsize(),
+            'written': self.nwritten,
+            'failed': self.nfailed,
+            'batches': self.nbatches
+        }
+
+
+
+class SegmentFileBag(FileBag):
+    '''
+    This class is a FileBag appending the data passed to store() to a SegmentArchive in ARCHIVE_DIRNAME subdirectory,
+    instead of creating a file for each piece. The references returned by store() are ARCHIVE_PATH#RECORD_ID
+    strings. The other files (certificates, keys, logs) are created as usual.
+    The archive is not safe to be appended to by several processes.
+    '''
+    fork_safe = False
+
+    def __init__(self, basename, use_tempdir=False, segment_size=DEFAULT_SEGMENT_SIZE, dedup=False,
+                 compress_level=None, compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        FileBag.__init__(self, basename, use_tempdir, dedup, compress_level, compress_threshold)
+        self.archive = SegmentArchive(os.path.join(self.base_dir, ARCHIVE_DIRNAME), segment_size)
+
+    def save(self, data):
+        return '%s#%d' % (self.archive.path, self.archive.append(data))
+
+    def read(self, ref):
+        (path, sep, record_id) = ref.rpartition('#')
+        if path != self.archive.path:
+            return FileBag.read(self, ref)
+        return self.archive.read(int(record_id))
+
+    def flush(self):
+        self.archive.flush()
+
+    def close(self):
+        self.archive.close()
+        self.log_storage_stats()
+
+    def get_stats(self):
+        return self.archive.get_stats()
@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from M2Crypto import RSA, util
+
+RSA_EXPONENT = 65537
+DEFAULT_NPROCESSES = 2
+
+def gen_rsa_key(bits):
+    return RSA.gen_key(bits, RSA_EXPONENT, util.no_passphrase_callback)
+
+def gen_rsa_key_pem(bits):
+    '''
+    This function runs in the worker processes of KeyPool. M2Crypto objects can not be pickled, so the keys travel
+    back to the parent process in PEM format. Returns None if the key could not be generated, the pool only invokes
+    its callback for successful calls.
+    '''
+    try:
+        return gen_rsa_key(bits).as_pem(cipher=None)
+    except Exception as ex:
+        KeyPool.logger.error('failed to generate %d-bit RSA key: %s', bits, ex)
+        return None
+
+
+class KeyPool(object):
+    '''
+    This class keeps RSA keys pre-generated by a pool of background processes, separately for each key size. The
+    key sizes get registered by the first get_key() call or explicitly, via prefill(). Once the number of spare keys
+    of some size (counting the ones being generated) drops below low_watermark, the pool gets refilled up to
+    high_watermark keys. If there is no spare key, get_key() generates one synchronously and counts a miss. The keys
+    failing to get generated in background are counted and not waited for anymore.
+    The background processes do not survive a fork, in a forked child the pool generates all keys synchronously.
+    '''
+    logger = logging.getLogger('KeyPool')
+
+    def __init__(self, high_watermark, low_watermark=None, nprocesses=DEFAULT_NPROCESSES):
+        if high_watermark < 1:
+            raise ValueError('key pool size must be positive, got %d' % high_watermark)
+        if low_watermark is None:
+            low_watermark = (high_watermark + 1) / 2
+
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+
+        self.lock = threading.Lock()  # this lock has to be acquired before using keys, npending, and the counters
+        self.keys = {}  # bits -> deque of PEM strings
+        self.npending = {}  # bits -> number of keys being generated
+        self.nhits = 0
+        self.nmisses = 0
+        self.ngenerated = 0
+        self.nfailed = 0
+
+        self.pid = os.getpid()
+        self.pool = multiprocessing.Pool(nprocesses)
+        self.should_stop = False
+
+    def prefill(self, bits):
+        '''
+        Registers the key size and starts generating the keys of that size in background.
+        '''
+        with self.lock:
+            self.refill(bits)
+
+    def get_key(self, bits):
+        '''
+        Returns RSA key of given size.
+        '''
+        pem = None
+        if os.getpid() == self.pid:
+            with self.lock:
+                if self.keys.has_key(bits) and len(self.keys[bits]) > 0:
+                    pem = self.keys[bits].popleft()
+                    self.nhits += 1
+                else:
+                    self.nmisses += 1
+                self.refill(bits)
+        else:
+            # the keys inherited from the parent process might end up in its other children too
+            with self.lock:
+                self.nmisses += 1
+
+        if pem is not None:
+            return RSA.load_key_string(pem, util.no_passphrase_callback)
+        else:
+            return gen_rsa_key(bits)
+
+    def refill(self, bits):
+        # this method has to be invoked with the lock held
+        if self.should_stop:
+            return
+
+        if not self.keys.has_key(bits):
+            self.keys[bits] = deque()
+            self.npending[bits] = 0
+
+        nspare = len(self.keys[bits]) + self.npending[bits]
+        if nspare >= self.low_watermark:
+            return
+
+        for _ in range(self.high_watermark - nspare):
+            self.npending[bits] += 1
+            self.pool.apply_async(gen_rsa_key_pem, (bits,), callback=lambda pem: self.on_key_ready(bits, pem))
+
+    def on_key_ready(self, bits, pem):
+        # invoked by the result handler thread of the multiprocessing pool
+        with self.lock:
+            self.npending[bits] -= 1
+            if pem is None:
+                # the next get_key() refills the pool
+                self.nfailed += 1
+                return
+            self.keys[bits].append(pem)
+            self.ngenerated += 1
+
+    def stop(self):
+        with self.lock:
+            self.should_stop = True
+        self.pool.terminate()
+        self.logger.info('key pool stopped, %s', self.get_stats())
+
+    def get_stats(self):
+        '''
+        Returns a dictionary with hit/miss counters and the number of spare keys of each size.
+        '''
+        with self.lock:
+            return {
+                'hits': self.nhits,
+                'misses': self.nmisses,
+                'generated': self.ngenerated,
+                'failed': self.nfailed,
+                'spare': dict((bits, len(keys)) for (bits, keys) in self.keys.items()),
+                'pending': dict(self.npending)
+            }
+
+    def __str__(self):
+        return 'KeyPool(%d..%d keys per size)' % (self.low_watermark, self.high_watermark)
+
+
+default_key_pool = None
+
+def init_default_key_pool(high_watermark, nprocesses=DEFAULT_NPROCESSES):
+    '''
+    Creates the key pool used by CertFactory objects created without explicitly given pool.
+    '''
+    global default_key_pool
+    default_key_pool = KeyPool(high_watermark, nprocesses=nprocesses)
+    return default_key_pool
+
+def get_default_key_pool():
+    return default_key_pool
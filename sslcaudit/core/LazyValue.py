@@ -0,0 +1,57 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import threading
+
+class LazyValue(object):
+    '''
+    This class holds a value which gets computed by fn(*args) the first time get() is invoked. Callers arriving while
+    the computation is in progress wait for it instead of starting their own. If fn() throws an exception, nothing
+    gets cached, the exception is passed to the caller and the next get() tries again.
+    '''
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+        self.value = None
+        self.ready = False
+        self.lock = threading.Lock()  # this lock has to be acquired before computing the value
+
+    def get(self):
+        if not self.ready:
+            with self.lock:
+                if not self.ready:
+                    self.value = self.fn(*self.args)
+                    self.ready = True
+                    # the arguments are not needed anymore
+                    self.fn = None
+                    self.args = None
+        return self.value
+
+    def is_ready(self):
+        return self.ready
+
+    def __str__(self):
+        if self.ready:
+            return 'LazyValue(%s)' % self.value
+        else:
+            return 'LazyValue(%s, pending)' % self.fn
+
+
+def force(value):
+    '''
+    Returns the value held by LazyValue object, or the object itself if it is not a LazyValue.
+    '''
+    if isinstance(value, LazyValue):
+        return value.get()
+    else:
+        return value
+
+def is_forced(value):
+    '''
+    Returns False if the value is a LazyValue which has not been computed yet, True otherwise.
+    '''
+    return not isinstance(value, LazyValue) or value.is_ready()
@@ -0,0 +1,44 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import logging
+from sslcaudit.core.ThreadingTCPServer import ReusingTCPServer
+
+class PooledTCPServer(ReusingTCPServer):
+    '''
+    This class extends TCPServer to hand accepted connections over to a WorkerPool instead of spawning a thread per
+    connection. Connections rejected by the pool (see its overflow policy) are closed right away, the ones still
+    queued when the pool gets stopped are closed then.
+    '''
+    logger = logging.getLogger('PooledTCPServer')
+
+    # the stock backlog of 5 is too short for bursts of redirected clients
+    request_queue_size = 128
+
+    def __init__(self, listen_on, worker_pool, reuse_port=False, listen_sock=None):
+        self.worker_pool = worker_pool
+        ReusingTCPServer.__init__(self, listen_on, reuse_port, listen_sock)
+
+    def process_request(self, request, client_address):
+        if not self.worker_pool.submit(self.process_request_worker, request, client_address,
+                on_discard=lambda: self.shutdown_request(request)):
+            self.logger.debug('worker pool overflow, dropping connection from %s', client_address)
+            self.shutdown_request(request)
+
+    def process_request_worker(self, request, client_address):
+        '''
+        This method does the same as ThreadingMixIn.process_request_thread(), but runs in a pool worker.
+        '''
+        try:
+            self.finish_request(request, client_address)
+        except:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        ReusingTCPServer.server_close(self)
+        self.worker_pool.stop()
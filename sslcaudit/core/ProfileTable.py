@@ -0,0 +1,31 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+from sslcaudit.modules.base.BaseProfileFactory import BaseDynamicProfile
+
+class ProfileTable(object):
+    '''
+    This class is an immutable, indexed list of profiles, built once from the profile factories and shared by all
+    sessions. Sessions refer to the profiles by their index in the table and never modify it. The indices of dynamic
+    profiles, which need a per-session instance, are worked out upfront.
+    '''
+
+    def __init__(self, profiles):
+        self.profiles = tuple(profiles)
+        self.dynamic_indices = tuple(index for (index, profile) in enumerate(self.profiles)
+            if isinstance(profile, BaseDynamicProfile))
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def __getitem__(self, index):
+        return self.profiles[index]
+
+    def __iter__(self):
+        return iter(self.profiles)
+
+    def __str__(self):
+        return 'ProfileTable(%d profiles, %d dynamic)' % (len(self.profiles), len(self.dynamic_indices))
@@ -0,0 +1,139 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import logging
+import threading
+from collections import OrderedDict
+from time import time
+from sslcaudit.core.WorkerPool import WorkerPool, OVERFLOW_DROP
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_NFETCHERS = 4
+DEFAULT_RETRY_INTERVAL = 60.0
+
+STATE_PENDING = 'pending'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+class ReplicaEntry(object):
+    '''
+    This class holds the state of the replica of a single destination.
+    '''
+
+    def __init__(self):
+        self.state = STATE_PENDING
+        self.fingerprint = None
+        self.replica = None
+        self.failed_time = None
+
+
+class ReplicaCache(object):
+    '''
+    This class keeps replicas of the certificates of the servers the clients connect to, by destination. On the first
+    lookup of a destination, fetch(destination) is submitted to a small pool of fetcher threads and get() returns None
+    right away, so that the connection can be handled with some fallback instead of waiting for the real server. The
+    lookups arriving while the fetch is in progress do not start their own. Once the certificate is there, forge(cert)
+    makes its replica, which is shared by all destinations presenting a certificate with the same fingerprint (as
+    returned by fingerprint(cert)). If the fetch fails, get() keeps returning None for the destination for
+    retry_interval seconds, then tries again.
+    Both destinations and replicas are kept in LRU order, at most max_entries of each.
+    '''
+    logger = logging.getLogger('ReplicaCache')
+
+    def __init__(self, fetch, forge, fingerprint, max_entries=DEFAULT_MAX_ENTRIES, nfetchers=DEFAULT_NFETCHERS,
+                 retry_interval=DEFAULT_RETRY_INTERVAL):
+        self.fetch = fetch
+        self.forge = forge
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.retry_interval = retry_interval
+
+        self.entries = OrderedDict()  # destination -> ReplicaEntry, least recently used first
+        self.replicas = OrderedDict()  # fingerprint -> replica, least recently used first
+        self.lock = threading.Lock()  # this lock has to be acquired before using the dictionaries and the counters
+
+        self.nfetched = 0
+        self.nforged = 0
+        self.nfailed = 0
+
+        self.fetchers = WorkerPool(nfetchers, queue_size=max_entries, overflow_policy=OVERFLOW_DROP,
+            name='ReplicaFetcher')
+
+    def get(self, destination):
+        '''
+        Returns the replica for given destination, or None if it is not available (yet).
+        '''
+        with self.lock:
+            entry = self.entries.pop(destination, None)
+            if entry is not None and entry.state == STATE_FAILED and time() - entry.failed_time >= self.retry_interval:
+                entry = None
+            if entry is None:
+                entry = ReplicaEntry()
+                start_fetch = True
+            else:
+                start_fetch = False
+            self.entries[destination] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if start_fetch and not self.fetchers.submit(self.fetch_replica, destination, entry):
+            self.logger.warn('too many certificate fetches in progress, will fetch certificate of %s later',
+                destination)
+            with self.lock:
+                if self.entries.get(destination) is entry:
+                    del self.entries[destination]
+
+        return entry.replica
+
+    def fetch_replica(self, destination, entry):
+        # this method runs in a fetcher thread
+        try:
+            cert = self.fetch(destination)
+            fingerprint = self.fingerprint(cert)
+
+            with self.lock:
+                self.nfetched += 1
+                replica = self.replicas.pop(fingerprint, None)
+            if replica is None:
+                # forging is the expensive part, it is done without holding the lock
+                replica = self.forge(cert)
+                with self.lock:
+                    self.nforged += 1
+
+            with self.lock:
+                self.replicas[fingerprint] = replica
+                while len(self.replicas) > self.max_entries:
+                    self.replicas.popitem(last=False)
+                entry.fingerprint = fingerprint
+                entry.replica = replica
+                entry.state = STATE_READY
+            self.logger.debug('replicated certificate of %s, fingerprint %s', destination, fingerprint)
+        except Exception as ex:
+            self.logger.warn('failed to replicate certificate of %s: %s', destination, ex)
+            with self.lock:
+                self.nfailed += 1
+                entry.failed_time = time()
+                entry.state = STATE_FAILED
+
+    def stop(self):
+        self.fetchers.stop()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'destinations': len(self.entries),
+                'replicas': len(self.replicas),
+                'fetched': self.nfetched,
+                'forged': self.nforged,
+                'failed': self.nfailed
+            }
+
+    def __str__(self):
+        return 'ReplicaCache(%(destinations)d destinations, %(replicas)d replicas, fetched %(fetched)d, ' \
+            'forged %(forged)d, failed %(failed)d)' % self.get_stats()
@@ -0,0 +1,141 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import mmap
+import os
+import struct
+import threading
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+INDEX_FILENAME = 'index'
+SEGMENT_FILENAME = 'segment-%06d'
+
+# segment number, offset, length
+INDEX_ENTRY = struct.Struct('<IQI')
+
+class SegmentArchive(object):
+    '''
+    This class stores records in a few large append-only files (segments) instead of a file per record. The records
+    get appended to the current segment until it grows over segment_size, then a new segment is started. The index
+    file holds an entry of INDEX_ENTRY.size bytes per record, with the segment, offset and length of the record; the
+    id of a record is the number of its entry in the index. The index is kept in memory too.
+    Opening an existing archive loads its index, new records get appended after the existing ones. The record data
+    is flushed before its index entry gets written, still the operating system may put the index on disk first, so the
+    entries pointing past the end of their segments get dropped on open, along with the ones after them. The records
+    are read via memory mappings of the segments.
+    '''
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+
+        if not os.path.exists(path):
+            os.mkdir(path)
+
+        self.lock = threading.Lock()  # this lock has to be acquired before appending or mapping the segments
+        self.index = []
+        self.maps = {}  # segment number -> (mmap, mapped length)
+
+        self.index_file = open(os.path.join(path, INDEX_FILENAME), 'ab+')
+        self.index_file.seek(0)
+        index_data = self.index_file.read()
+        # an incomplete entry at the end is what is left of a crash in the middle of append()
+        segment_sizes = {}
+        for pos in xrange(0, len(index_data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            entry = INDEX_ENTRY.unpack_from(index_data, pos)
+            (segment, offset, length) = entry
+            if segment not in segment_sizes:
+                segment_sizes[segment] = self.get_segment_size(segment)
+            if offset + length > segment_sizes[segment]:
+                # the data of this record has not made it to disk
+                break
+            self.index.append(entry)
+        self.index_file.truncate(len(self.index) * INDEX_ENTRY.size)
+
+        if len(self.index) > 0:
+            self.open_segment(self.index[-1][0])
+        else:
+            self.open_segment(0)
+
+    def open_segment(self, segment):
+        # this method has to be invoked with the lock held, or from the constructor
+        self.segment = segment
+        self.segment_file = open(self.mk_segment_filename(segment), 'ab')
+        self.segment_file.seek(0, os.SEEK_END)
+        self.segment_offset = self.segment_file.tell()
+
+    def mk_segment_filename(self, segment):
+        return os.path.join(self.path, SEGMENT_FILENAME % segment)
+
+    def get_segment_size(self, segment):
+        try:
+            return os.path.getsize(self.mk_segment_filename(segment))
+        except OSError:
+            return 0
+
+    def append(self, data):
+        '''
+        Appends the record and returns its id.
+        '''
+        with self.lock:
+            if self.segment_offset > 0 and self.segment_offset + len(data) > self.segment_size:
+                self.segment_file.close()
+                self.open_segment(self.segment + 1)
+
+            self.segment_file.write(data)
+            # the index entry must not get ahead of the data
+            self.segment_file.flush()
+            entry = (self.segment, self.segment_offset, len(data))
+            self.segment_offset += len(data)
+
+            self.index_file.write(INDEX_ENTRY.pack(*entry))
+            self.index.append(entry)
+            return len(self.index) - 1
+
+    def read(self, record_id):
+        '''
+        Returns the data of given record.
+        '''
+        (segment, offset, length) = self.index[record_id]
+        if length == 0:
+            return ''
+
+        with self.lock:
+            (segment_map, mapped_length) = self.maps.get(segment, (None, 0))
+            if offset + length > mapped_length:
+                # the record is newer than the mapping, map the segment again
+                if segment == self.segment:
+                    self.segment_file.flush()
+                if segment_map is not None:
+                    segment_map.close()
+                with open(self.mk_segment_filename(segment), 'rb') as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = (segment_map, len(segment_map))
+            return segment_map[offset:offset + length]
+
+    def flush(self):
+        with self.lock:
+            self.segment_file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        with self.lock:
+            self.segment_file.close()
+            self.index_file.close()
+            for (segment_map, _) in self.maps.values():
+                segment_map.close()
+            self.maps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_stats(self):
+        return {
+            'records': len(self.index),
+            'segments': self.segment + 1,
+            'bytes': sum(entry[2] for entry in self.index)
+        }
@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import threading
+from collections import OrderedDict
+from time import time
+from sslcaudit.core.LazyValue import LazyValue
+
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_NSTRIPES = 16
+
+class SessionStripe(object):
+    '''
+    This class holds a part of the sessions of SessionTable, with its own lock.
+    '''
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # session id -> (LazyValue of handler, last seen time), least recently seen first
+        self.lock = threading.Lock()  # this lock has to be acquired before using sessions attribute and the counters
+
+        self.ncreated = 0
+        self.nevicted = 0
+        self.nexpired = 0
+
+
+class SessionTable(object):
+    '''
+    This class keeps session handlers by session id. It holds at most max_sessions of them, dropping the least
+    recently used ones to make room for new sessions. If ttl is set, the sessions not seen for ttl seconds get dropped
+    too, either when a connection of a session from the same stripe (see below) arrives or when expire() gets invoked.
+    The dropped session handlers are passed to on_evict() callable, outside of the locks of the table. Zero
+    max_sessions means no limit.
+    The sessions are spread over nstripes stripes by session id, each with its own lock and its share of max_sessions,
+    so that the connections of unrelated clients rarely wait for each other. The lock is only held to find the entry
+    of the session, new handlers get created after it is released, by the first connection of the session, the others
+    wait for it.
+    '''
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, ttl=None, on_evict=None, nstripes=DEFAULT_NSTRIPES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.on_evict = on_evict
+
+        if max_sessions > 0:
+            nstripes = min(nstripes, max_sessions)
+            stripe_max_sessions = (max_sessions + nstripes - 1) / nstripes
+        else:
+            stripe_max_sessions = 0
+        self.stripes = [SessionStripe(stripe_max_sessions) for _ in range(nstripes)]
+
+    def get(self, session_id, mk_handler):
+        '''
+        Returns the handler of given session, creating it with mk_handler() if there is none.
+        '''
+        stripe = self.stripes[hash(session_id) % len(self.stripes)]
+        now = time()
+        with stripe.lock:
+            evicted = self.collect_expired(stripe, now)
+
+            entry = stripe.sessions.pop(session_id, None)
+            if entry is None:
+                handler = LazyValue(mk_handler)
+                stripe.ncreated += 1
+            else:
+                handler = entry[0]
+            stripe.sessions[session_id] = (handler, now)
+
+            while stripe.max_sessions > 0 and len(stripe.sessions) > stripe.max_sessions:
+                (_, (old_handler, _)) = stripe.sessions.popitem(last=False)
+                evicted.append(old_handler)
+                stripe.nevicted += 1
+
+        self.notify(evicted)
+        return handler.get()
+
+    def expire(self):
+        '''
+        Drops the sessions idle for longer than ttl seconds.
+        '''
+        now = time()
+        for stripe in self.stripes:
+            with stripe.lock:
+                evicted = self.collect_expired(stripe, now)
+            self.notify(evicted)
+
+    def collect_expired(self, stripe, now):
+        # this method has to be invoked with the lock of the stripe held
+        expired = []
+        if self.ttl is None:
+            return expired
+
+        while len(stripe.sessions) > 0:
+            (session_id, (handler, last_seen)) = next(stripe.sessions.iteritems())
+            if now - last_seen < self.ttl:
+                break
+            del stripe.sessions[session_id]
+            expired.append(handler)
+            stripe.nexpired += 1
+        return expired
+
+    def notify(self, evicted):
+        if self.on_evict is None:
+            return
+        for handler in evicted:
+            # a handler which has never been created has nothing to report
+            if handler.is_ready():
+                self.on_evict(handler.get())
+
+    def __len__(self):
+        return sum(len(stripe.sessions) for stripe in self.stripes)
+
+    def get_stats(self):
+        stats = {'sessions': 0, 'created': 0, 'evicted': 0, 'expired': 0}
+        for stripe in self.stripes:
+            with stripe.lock:
+                stats['sessions'] += len(stripe.sessions)
+                stats['created'] += stripe.ncreated
+                stats['evicted'] += stripe.nevicted
+                stats['expired'] += stripe.nexpired
+        return stats
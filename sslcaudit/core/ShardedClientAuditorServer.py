@@ -0,0 +1,246 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import cPickle
+import ctypes
+import itertools
+import logging
+import multiprocessing
+import signal
+import socket
+import struct
+from threading import Thread
+from Queue import Queue
+from sslcaudit.core.ClientAuditorServer import ClientAuditorServer
+from sslcaudit.core.ClientConnection import ClientConnection
+from sslcaudit.core.ClientServerSessionHandler import ClientServerSessionHandler
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult
+from sslcaudit.core.ProfileTable import ProfileTable
+from sslcaudit.core.SessionTable import SessionTable, DEFAULT_MAX_SESSIONS
+from sslcaudit.core.ThreadingTCPServer import ReusingTCPServer
+
+# messages sent by the workers to the parent process
+MSG_SESSION_START = 'start'
+MSG_RESULT = 'result'
+
+# not exported by socket module, see socket(7)
+SO_ATTACH_REUSEPORT_CBPF = 51
+
+# classic BPF instructions (struct sock_filter) of the program choosing the listening socket for a connection
+SOCK_FILTER = struct.Struct('HBBI')
+BPF_LD_W_ABS = 0x20
+BPF_ALU_MOD_K = 0x94
+BPF_RET_A = 0x16
+# the loads at the offsets starting here address the IP header of the packet
+SKF_NET_OFF = -0x100000
+IP_SRC_OFFSET = 12
+
+logger = logging.getLogger('ShardedClientAuditorServer')
+
+
+def route_by_client_address(sock, nsocks):
+    '''
+    Makes the kernel hand all the connections from the same client IP address to the same socket of the SO_REUSEPORT
+    group sock belongs to: the one with the number (client address modulo nsocks) in the order they started listening.
+    '''
+    program = [
+        (BPF_LD_W_ABS, 0, 0, (SKF_NET_OFF + IP_SRC_OFFSET) & 0xffffffff),
+        (BPF_ALU_MOD_K, 0, 0, nsocks),
+        (BPF_RET_A, 0, 0, 0)
+    ]
+    filters = ctypes.create_string_buffer(''.join(SOCK_FILTER.pack(*insn) for insn in program))
+    # struct sock_fprog, the kernel copies the instructions
+    fprog = struct.pack('HP', len(program), ctypes.addressof(filters))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+
+
+class ShardClientServerSessionHandler(ClientServerSessionHandler):
+    '''
+    This class is a ClientServerSessionHandler living in a worker process. Instead of producing events itself, it
+    forwards the results to the parent process, which does the bookkeeping for the whole session.
+    '''
+
+    def report_start(self):
+        self.res_queue.put((MSG_SESSION_START, self.session_id))
+
+    def record_result(self, conn, profile, profile_index, excess, res):
+        self.logger.debug('handling connection %s (excess=%s) using %s (%d/%d) resulted in %s',
+            conn, str(excess), profile, profile_index, len(self.profiles), res)
+
+        # the queue pickles the message in a background thread and only logs the failures, so check it right here
+        result = res.result
+        try:
+            cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        except Exception as ex:
+            self.logger.debug('result %s cannot be pickled (%s), passing it as a string', result, ex)
+            result = str(result)
+
+        self.res_queue.put((MSG_RESULT, self.session_id, conn.client_address, conn.sockname, conn.orig_dst,
+                            profile_index, excess, result, conn.start_time, conn.end_time))
+
+
+class ShardClientAuditorServer(ClientAuditorServer):
+    '''
+    This class is a ClientAuditorServer running in a worker process of ShardedClientAuditorServer. It accepts
+    connections from the listening socket the parent process has created for it and creates
+    ShardClientServerSessionHandler for new sessions.
+    '''
+
+    def __init__(self, listen_on, profile_factories, post_test_action, shard_queue, file_bag, listen_sock,
+                 worker_pool=None, engine=None, max_sessions=DEFAULT_MAX_SESSIONS, session_ttl=None):
+        ClientAuditorServer.__init__(self, listen_on, profile_factories, post_test_action, shard_queue, file_bag,
+            worker_pool, engine, listen_sock, max_sessions, session_ttl)
+
+    def on_session_evicted(self, handler):
+        # the parent process keeps track of the whole session and reports its end
+        pass
+
+    def mk_session_handler(self, session_id):
+        profiles = self.mk_session_profiles()
+        return ShardClientServerSessionHandler(session_id, profiles, self.post_test_action, self.res_queue,
+            self.file_bag)
+
+
+class ShardedClientAuditorServer(Thread):
+    '''
+    This class spreads the work of ClientAuditorServer over several processes, to get past the GIL when handshakes
+    keep the CPU busy. This class creates a listening socket per worker, all bound to the same port with SO_REUSEPORT
+    set, and makes the kernel route each client to a fixed one of them by its IP address (see
+    route_by_client_address()). As sessions are told apart by client address too, each session is handled by a single
+    worker, which keeps track of the profiles used the usual way. Each worker runs its own ShardClientAuditorServer,
+    created by mk_worker_server(shard_queue, listen_sock) callable after the fork (threads do not survive it, so worker
+    pools and engines have to be created there).
+    The workers send their results back to this process, where this class (running as a thread) turns them into the
+    usual stream of events in res_queue, the same one ClientAuditorServer would produce.
+    '''
+
+    def __init__(self, listen_on, profile_factories, post_test_action, res_queue, file_bag, nprocesses,
+                 mk_worker_server, max_sessions=DEFAULT_MAX_SESSIONS, session_ttl=None):
+        Thread.__init__(self, target=self.run, name='ShardedClientAuditorServer')
+        self.daemon = True
+
+        self.listen_on = listen_on
+        self.profile_factories = profile_factories
+        # the workers build their tables from the same factories, so the indices match
+        self.profile_table = ProfileTable(itertools.chain.from_iterable(profile_factories))
+        self.post_test_action = post_test_action
+        self.file_bag = file_bag
+        self.nprocesses = nprocesses
+        self.mk_worker_server = mk_worker_server
+
+        # create a local result queue unless one is already provided
+        if res_queue == None:
+            self.res_queue = Queue()
+        else:
+            self.res_queue = res_queue
+
+        # all the sockets have to be listening before the first connection arrives, otherwise the kernel would route
+        # it to some other socket than the later connections from the same client
+        self.tcp_servers = []
+        try:
+            for _ in range(self.nprocesses):
+                self.tcp_servers.append(ReusingTCPServer(self.listen_on, reuse_port=True))
+            try:
+                route_by_client_address(self.tcp_servers[0].socket, self.nprocesses)
+            except socket.error as ex:
+                raise RuntimeError('failed to route connections to %s by client address, exception: %s'
+                                   % (self.listen_on, ex))
+        except:
+            self.close_tcp_servers()
+            raise
+
+        self.client_server_sessions = SessionTable(max_sessions, session_ttl, self.on_session_evicted)
+        self.shard_queue = multiprocessing.Queue()
+        self.workers = []
+
+    def start(self):
+        for worker_id in range(self.nprocesses):
+            worker = multiprocessing.Process(target=self.run_worker, args=(worker_id,),
+                name='ClientAuditorWorker-%d' % worker_id)
+            worker.daemon = True
+            self.workers.append(worker)
+            worker.start()
+        # the workers have got their copies, a socket gets closed once its worker is gone
+        self.close_tcp_servers()
+        logger.info('listen_on: %s, %d worker processes', str(self.listen_on), self.nprocesses)
+        Thread.start(self)
+
+    def run_worker(self, worker_id):
+        # the parent takes care of Ctrl-C and terminates the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        listen_sock = self.tcp_servers[worker_id].socket
+        for (tcp_server_id, tcp_server) in enumerate(self.tcp_servers):
+            if tcp_server_id != worker_id:
+                tcp_server.server_close()
+        server = self.mk_worker_server(self.shard_queue, listen_sock)
+        server.run()
+
+    def close_tcp_servers(self):
+        for tcp_server in self.tcp_servers:
+            tcp_server.server_close()
+
+    def run(self):
+        '''
+        Receives the messages from the workers and turns them into events.
+        '''
+        while True:
+            msg = self.shard_queue.get()
+            if msg is None:
+                break
+
+            try:
+                self.handle_worker_msg(msg)
+            except Exception as ex:
+                logger.error('failed to handle message %s from a worker: %s', msg, ex)
+
+    def handle_worker_msg(self, msg):
+        session_id = msg[1]
+        session_handler = self.get_session_handler(session_id)
+        if msg[0] == MSG_RESULT:
+            (_, _, client_address, sockname, orig_dst, profile_index, excess, result, start_time, end_time) = msg
+            conn = ClientConnection(None, client_address, sockname, orig_dst)
+            conn.start_time = start_time
+            conn.end_time = end_time
+            profile = session_handler.profiles[profile_index]
+            res = ConnectionAuditResult(conn, profile, result)
+            session_handler.record_result(conn, profile, profile_index, excess, res)
+
+    def get_session_handler(self, session_id):
+        return self.client_server_sessions.get(session_id, lambda: self.mk_session_handler(session_id))
+
+    def mk_session_handler(self, session_id):
+        logger.debug('new session [id %s]', session_id)
+        return ClientServerSessionHandler(session_id, self.profile_table, self.post_test_action, self.res_queue,
+            self.file_bag)
+
+    def on_session_evicted(self, handler):
+        handler.evict()
+
+    def expire_sessions(self):
+        self.client_server_sessions.expire()
+
+    def stop(self):
+        ''' this method can only be invoked if the server is already running '''
+        self.server_close()
+        self.shard_queue.put(None)
+
+    def server_close(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.workers:
+            worker.join()
+        self.close_tcp_servers()
+
+    def get_stats(self):
+        '''
+        Returns the number of worker processes still alive and session table statistics.
+        '''
+        return {
+            'nprocesses': self.nprocesses,
+            'alive': len([worker for worker in self.workers if worker.is_alive()]),
+            'sessions': self.client_server_sessions.get_stats()
+        }
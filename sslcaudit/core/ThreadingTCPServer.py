@@ -7,16 +7,28 @@
 from SocketServer import TCPServer, ThreadingMixIn
 import socket
 
-class ThreadingTCPServer(ThreadingMixIn, TCPServer):
+# not exported by socket module of older Pythons
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+class ReusingTCPServer(TCPServer):
     '''
-    This class extends TCPServer to enforce address reuse, enforce daemon threads, and allow threading.
+    This class extends TCPServer to enforce address reuse. It handles requests in the thread accepting them, subclasses
+    decide how to dispatch them. With reuse_port set, several processes can listen on the same port, the kernel
+    spreads incoming connections between them. If listen_sock is given, the server accepts connections from that
+    socket, which has to be bound and listening already, instead of creating its own.
     '''
 
-    def __init__(self, listen_on):
+    def __init__(self, listen_on, reuse_port=False, listen_sock=None):
         TCPServer.__init__(self, listen_on, None, bind_and_activate=False)
-        self.daemon_threads = True
         # make sure SO_REUSE_ADDR socket option is set
         self.allow_reuse_address = True
+        self.reuse_port = reuse_port
+
+        if listen_sock is not None:
+            self.socket.close()
+            self.socket = listen_sock
+            self.server_address = listen_sock.getsockname()
+            return
 
         try:
             self.server_bind()
@@ -24,3 +36,18 @@ class ThreadingTCPServer(ThreadingMixIn, TCPServer):
             raise RuntimeError('failed to bind to %s, exception: %s' % (listen_on, ex))
 
         self.server_activate()
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        TCPServer.server_bind(self)
+
+
+class ThreadingTCPServer(ThreadingMixIn, ReusingTCPServer):
+    '''
+    This class extends TCPServer to enforce address reuse, enforce daemon threads, and allow threading.
+    '''
+
+    def __init__(self, listen_on, reuse_port=False, listen_sock=None):
+        ReusingTCPServer.__init__(self, listen_on, reuse_port, listen_sock)
+        self.daemon_threads = True
@@ -32,3 +32,21 @@ def parse_hostport(hostport):
     except socket.error:
         raise ValueError('invalid HOST:PORT specification (unknown service): %s' % hostport)
 
+
+def parse_hostport_file(filename):
+    '''
+    This function reads a list of HOST:PORT specifications from a file, one per line, and converts them with
+    parse_hostport(). Empty lines and lines starting with # are skipped. Raises ValueError pointing at the offending
+    line if some specification is invalid.
+    '''
+    hostports = []
+    with open(filename) as f:
+        for (lineno, line) in enumerate(f, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            try:
+                hostports.append(parse_hostport(line))
+            except ValueError as ex:
+                raise ValueError('%s, line %d: %s' % (filename, lineno, ex))
+    return hostports
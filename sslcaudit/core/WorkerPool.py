@@ -0,0 +1,196 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import logging
+import threading
+from threading import Thread
+from Queue import Queue, Empty, Full
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_WAIT = 'wait'
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_WAIT)
+
+DEFAULT_QUEUE_SIZE = 1024
+DEFAULT_OVERFLOW_TIMEOUT = 5.0
+
+class WorkerPool(object):
+    '''
+    This class runs a fixed number of worker threads fed from a bounded job queue. When the queue is full, the
+    behaviour depends on overflow policy: with OVERFLOW_DROP the job is rejected right away, with OVERFLOW_WAIT the
+    caller blocks until there is space in the queue or overflow_timeout seconds pass, after which the job is
+    rejected as well. submit() returns False for rejected jobs, it is up to the caller to clean up after them.
+    The jobs still queued when the pool gets stopped are not run, their on_discard hooks (see submit()) are invoked
+    instead.
+    '''
+    logger = logging.getLogger('WorkerPool')
+
+    def __init__(self, nworkers, queue_size=DEFAULT_QUEUE_SIZE, overflow_policy=OVERFLOW_WAIT,
+                 overflow_timeout=DEFAULT_OVERFLOW_TIMEOUT, name='WorkerPool'):
+        if nworkers < 1:
+            raise ValueError('number of workers must be positive, got %d' % nworkers)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('unexpected overflow policy: %s' % overflow_policy)
+
+        self.nworkers = nworkers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.overflow_timeout = overflow_timeout
+        self.name = name
+
+        self.queue = Queue(queue_size)
+        self.should_stop = False
+
+        self.lock = threading.Lock()  # this lock has to be acquired before updating the counters below
+        self.nbusy = 0
+        self.nsubmitted = 0
+        self.ndropped = 0
+        self.ncompleted = 0
+        self.nfailed = 0
+        self.ndiscarded = 0
+        self.max_queue_depth = 0
+
+        self.threads = []
+        for worker_id in range(self.nworkers):
+            thread = Thread(target=self.run, name='%s-%d' % (self.name, worker_id))
+            thread.daemon = True
+            self.threads.append(thread)
+            thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        '''
+        Queues fn(*args) for execution by one of the workers. Returns True if the job got queued and False if it was
+        rejected because of overflow or because the pool is stopped. If on_discard keyword argument is given, it gets
+        invoked without arguments in case the pool is stopped before the job starts.
+        '''
+        on_discard = kwargs.pop('on_discard', None)
+        if len(kwargs) > 0:
+            raise TypeError('unexpected keyword arguments: %s' % ', '.join(kwargs))
+
+        if self.should_stop:
+            return False
+
+        job = (fn, args, on_discard)
+        try:
+            if self.overflow_policy == OVERFLOW_DROP:
+                self.queue.put_nowait(job)
+            else:
+                self.queue.put(job, True, self.overflow_timeout)
+        except Full:
+            with self.lock:
+                self.ndropped += 1
+            return False
+
+        with self.lock:
+            self.nsubmitted += 1
+            depth = self.queue.qsize()
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+
+        if self.should_stop:
+            # stop() has already emptied the queue, the job would stay there forever
+            self.discard_queued()
+        return True
+
+    def run(self):
+        '''
+        This method is a target of the worker threads.
+        '''
+        while not self.should_stop:
+            job = self.queue.get()
+            if job is None:
+                # stop() wakes idle workers up with None
+                break
+
+            (fn, args, _) = job
+            with self.lock:
+                self.nbusy += 1
+            try:
+                fn(*args)
+                failed = False
+            except Exception as ex:
+                self.logger.error('job %s has thrown an exception: %s', fn, ex)
+                failed = True
+            with self.lock:
+                self.nbusy -= 1
+                if failed:
+                    self.nfailed += 1
+                else:
+                    self.ncompleted += 1
+
+    def stop(self):
+        '''
+        Tells the workers to quit after finishing their current jobs. Queued but not yet started jobs are discarded.
+        '''
+        self.should_stop = True
+        self.discard_queued()
+        for _ in self.threads:
+            try:
+                self.queue.put_nowait(None)
+            except Full:
+                # all workers are busy, they will notice should_stop flag when done
+                break
+        self.logger.info('%s stopped, %s', self.name, self.format_stats())
+
+    def discard_queued(self):
+        '''
+        Takes the jobs which have not started yet out of the queue and invokes their on_discard hooks.
+        '''
+        jobs = []
+        nwakeups = 0
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except Empty:
+                break
+            if job is None:
+                nwakeups += 1
+            else:
+                jobs.append(job)
+
+        # the idle workers still have to be woken up
+        for _ in range(nwakeups):
+            try:
+                self.queue.put_nowait(None)
+            except Full:
+                break
+
+        with self.lock:
+            self.ndiscarded += len(jobs)
+        for (fn, args, on_discard) in jobs:
+            if on_discard is None:
+                continue
+            try:
+                on_discard()
+            except Exception as ex:
+                self.logger.error('discard hook of job %s has thrown an exception: %s', fn, ex)
+
+    def get_stats(self):
+        '''
+        Returns a dictionary with the current queue depth, worker utilization and job counters.
+        '''
+        with self.lock:
+            return {
+                'nworkers': self.nworkers,
+                'nbusy': self.nbusy,
+                'utilization': float(self.nbusy) / self.nworkers,
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue_size,
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.nsubmitted,
+                'dropped': self.ndropped,
+                'completed': self.ncompleted,
+                'failed': self.nfailed,
+                'discarded': self.ndiscarded
+            }
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return ('workers %(nbusy)d/%(nworkers)d busy, queue %(queue_depth)d/%(queue_size)d (max %(max_queue_depth)d), '
+                + 'submitted %(submitted)d, dropped %(dropped)d, completed %(completed)d, failed %(failed)d, '
+                + 'discarded %(discarded)d') % stats
+
+    def __str__(self):
+        return '%s(%s)' % (self.name, self.format_stats())
@@ -8,3 +8,6 @@ CFG_PTA_REPEAT = 'repeat'
 #CFG_PTA_PASSTHROUGH = 'passthrough'
 CFG_PTA_DROP = 'drop'
 CFG_PTA_EXIT = 'exit'
+
+CFG_ENGINE_THREADS = 'threads'
+CFG_ENGINE_EPOLL = 'epoll'
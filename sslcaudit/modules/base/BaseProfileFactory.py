@@ -25,6 +25,41 @@ class BaseProfile(object):
         raise NotImplemented('subclasses must override this method')
 
 
+class BaseDynamicProfile(BaseProfile):
+    '''
+    Base object for profiles standing for a sequence of concrete profiles, chosen at runtime depending on the results
+    of the connections handled so far. The profile added by a factory serves as a template: each session works with
+    its own instance, obtained with mk_session_instance(). ClientServerSessionHandler takes the profiles to use from
+    next_profile() and feeds the results back via add_result(), until is_done() returns True.
+    '''
+
+    def mk_session_instance(self):
+        raise NotImplementedError('subclasses must override this method')
+
+    def next_profile(self):
+        '''
+        Returns the next concrete profile to use, or None if there is none right now (either the sequence is over or
+        it has to wait for the results of connections in progress).
+        '''
+        raise NotImplementedError('subclasses must override this method')
+
+    def add_result(self, profile, res):
+        raise NotImplementedError('subclasses must override this method')
+
+    def is_done(self):
+        raise NotImplementedError('subclasses must override this method')
+
+    def get_summary(self):
+        '''
+        Returns the overall result of the sequence, reported once it is done, or None if there is nothing to report.
+        '''
+        return None
+
+    def get_handler(self):
+        # concrete profiles handle the connections, never the dynamic profile itself
+        raise NotImplementedError('dynamic profiles do not handle connections')
+
+
 class BaseProfileFactory(object):
     '''
     This class contains a list of profiles (subclasses of BaseProfile class). Each module is
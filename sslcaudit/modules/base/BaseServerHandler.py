@@ -22,3 +22,12 @@ class BaseServerHandler(object):
         state of the object itself and be thread-safe.
         '''
         raise NotImplementedError('subclasses must override this method')
+
+    def mk_task(self, conn, profile, file_bag):
+        '''
+        This method will be invoked by ConnectionEngine instead of handle() when sslcaudit runs in event-driven mode.
+        It is expected to return a ConnectionTask treating given connection using given profile without blocking.
+        Subclasses not overriding this method keep working in event-driven mode: their handle() method gets invoked
+        from a small pool of worker threads.
+        '''
+        return None
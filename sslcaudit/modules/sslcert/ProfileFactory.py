@@ -5,13 +5,18 @@
 # ----------------------------------------------------------------------
 import os
 
+import logging
 import socket
+import time
 from M2Crypto import X509
 import M2Crypto
 from sslcaudit.core import Utils
 
 from sslcaudit.core.ConfigError import ConfigError
-from sslcaudit.core.CertFactory import CertFactory
+from sslcaudit.core.CertCache import get_default_cert_cache
+from sslcaudit.core.CertFactory import CertFactory, DEFAULT_BITS, SELFSIGNED
+from sslcaudit.core.LazyValue import LazyValue, force, is_forced
+from sslcaudit.core.ReplicaCache import ReplicaCache
 from sslcaudit.modules.base.BaseProfileFactory import BaseProfileFactory, BaseProfile, BaseProfileSpec
 from sslcaudit.modules.sslcert.SSLServerHandler import SSLServerHandler
 
@@ -24,6 +29,8 @@ DEFAULT_PROTO = 'sslv23'
 
 sslcert_server_handler = SSLServerHandler(DEFAULT_PROTO)
 
+logger = logging.getLogger('sslcert.ProfileFactory')
+
 class SSLProfileSpec_SelfSigned(BaseProfileSpec):
     def __init__(self, cn):
         self.cn = cn
@@ -55,10 +62,33 @@ class SSLProfileSpec_UserSupplied(BaseProfileSpec):
     def __str__(self):
         return "user-supplied(%s)" % (self.cn)
 
+class SSLProfileSpec_Replica(BaseProfileSpec):
+    def __init__(self, ca_cn):
+        self.ca_cn = ca_cn
+
+    def __str__(self):
+        if self.ca_cn is None:
+            return "replica(orig-dst)"
+        return "replica(orig-dst, %s)" % (self.ca_cn)
+
 class SSLServerCertProfile(BaseProfile):
+    '''
+    The certificate and the key of this profile can be given as a LazyValue, in that case they only get generated
+    when the profile is used to handle a connection for the first time.
+    '''
     def __init__(self, profile_spec, certnkey):
         self.profile_spec = profile_spec
-        self.certnkey = certnkey
+        self.lazy_certnkey = certnkey
+
+    @property
+    def certnkey(self):
+        return force(self.lazy_certnkey)
+
+    def get_certnkey(self, conn):
+        '''
+        Returns the certificate and the key to present to given connection.
+        '''
+        return self.certnkey
 
     def get_spec(self):
         return self.profile_spec
@@ -67,14 +97,51 @@ class SSLServerCertProfile(BaseProfile):
         return sslcert_server_handler
 
     def __str__(self):
+        if not is_forced(self.lazy_certnkey):
+            # do not generate the certificate just to print its name
+            return "%s" % self.profile_spec
         return "%s[%s]" % (self.profile_spec, os.path.basename(self.certnkey.cert_filename))
 
+class SSLServerReplicaProfile(SSLServerCertProfile):
+    '''
+    This profile presents a replica of the certificate of the server the client was actually connecting to (see
+    ClientConnection.orig_dst), signed the ca_index-th way of the factory. The replicas are taken from ReplicaCache,
+    which fetches the certificate of each destination in background. Until the replica is ready, and for connections
+    with no known original destination, the fallback certificate gets presented instead.
+    '''
+    def __init__(self, profile_spec, replica_cache, ca_index, fallback_certnkey):
+        SSLServerCertProfile.__init__(self, profile_spec, fallback_certnkey)
+        self.replica_cache = replica_cache
+        self.ca_index = ca_index
+
+    def get_certnkey(self, conn):
+        if conn is None or conn.orig_dst is None:
+            return self.certnkey
+
+        replicas = self.replica_cache.get(conn.orig_dst)
+        if replicas is None:
+            logger.debug('replica for %s is not ready, using fallback certificate', conn)
+            return self.certnkey
+        return replicas[self.ca_index]
+
+    def __str__(self):
+        return "%s" % self.profile_spec
+
+def mk_req_cache_id(cn):
+    return 'cn=%s,bits=%d' % (cn, DEFAULT_BITS)
+
+def mk_ca_cache_id(ca_certnkey):
+    if ca_certnkey is None:
+        return SELFSIGNED
+    return 'ca=%s' % ca_certnkey.cert.get_fingerprint('sha1')
+
 class ProfileFactory(BaseProfileFactory):
     def __init__(self, file_bag, options, protocol=DEFAULT_PROTO):
         BaseProfileFactory.__init__(self, file_bag, options)
 
         self.protocol = protocol
         self.cert_factory = CertFactory(self.file_bag)
+        self.cert_cache = get_default_cert_cache()
 
         self.init_options()
 
@@ -82,15 +149,20 @@ class ProfileFactory(BaseProfileFactory):
         self.add_profiles()
 
     def init_options(self):
+        self.server_x509_certs = []
+
         # handle --server= option
         if self.options.server is not None:
             # fetch X.509 certificate from user-specified server
             try:
-                self.server_x509_cert = self.cert_factory.grab_server_x509_cert(self.options.server, protocol=self.protocol)
-            except socket.error as ex:
+                self.server_x509_certs.append(self.cert_factory.grab_server_x509_cert(self.options.server,
+                    protocol=self.protocol, timeout=self.options.server_timeout, retries=self.options.server_retries))
+            except (socket.error, M2Crypto.SSL.SSLError) as ex:
                 raise RuntimeError('failed to fetch certificate from server %s, exception: %s' % (self.options.server, ex))
-        else:
-            self.server_x509_cert = None
+
+        # handle --servers-file= option
+        if len(self.options.servers) > 0:
+            self.grab_server_x509_certs(self.options.servers)
 
         # handle --user-cert and --user-key options
         self.user_certnkey = self.load_certnkey(
@@ -102,25 +174,56 @@ class ProfileFactory(BaseProfileFactory):
             '--user-ca-cert', self.options.user_ca_cert_file,
             '--user-ca-key', self.options.user_ca_key_file)
 
+    def grab_server_x509_certs(self, servers):
+        '''
+        This method fetches the certificates of given servers in parallel. The servers which fail to respond are
+        skipped with a warning, the servers presenting the same certificate as some other server are skipped quietly.
+        '''
+        start_time = time.time()
+        fingerprints = set(cert.get_fingerprint('sha1') for cert in self.server_x509_certs)
+        nfailed = 0
+        for (server, cert, ex) in self.cert_factory.grab_server_x509_certs(servers, protocol=self.protocol,
+                timeout=self.options.server_timeout, retries=self.options.server_retries):
+            if cert is None:
+                logger.warn('failed to fetch certificate from server %s:%d, exception: %s', server[0], server[1], ex)
+                nfailed += 1
+                continue
+
+            fingerprint = cert.get_fingerprint('sha1')
+            if fingerprint not in fingerprints:
+                fingerprints.add(fingerprint)
+                self.server_x509_certs.append(cert)
+
+        logger.info('fetched certificates from %d of %d servers in %.1fs, %d distinct',
+            len(servers) - nfailed, len(servers), time.time() - start_time, len(fingerprints))
+        if nfailed == len(servers):
+            raise RuntimeError('failed to fetch certificate from any of %d servers' % len(servers))
+
     def __str__(self):
         return 'SSLCert (%d profiles)' % (len(self.profiles))
 
     # ----------------------------------------------------------------------------------------------
 
     def init_cert_requests(self):
+        '''
+        This method builds the list of (CN, request cache id, certificate request) tuples. The requests are
+        LazyValues, the keys do not get generated until some profile needs them. Cache ids describe the content of the
+        requests, see CertCache.
+        '''
         self.certreq_n_keyss = []
 
         if not self.options.no_default_cn:
-            req1 = self.cert_factory.mk_certreq_n_keys(cn=DEFAULT_CN)
-            self.certreq_n_keyss.append(req1)
+            req1 = LazyValue(self.cert_factory.mk_certreq_n_keys, DEFAULT_CN)
+            self.certreq_n_keyss.append((DEFAULT_CN, mk_req_cache_id(DEFAULT_CN), req1))
 
         if self.options.user_cn is not None:
-            req2 = self.cert_factory.mk_certreq_n_keys(cn=self.options.user_cn)
-            self.certreq_n_keyss.append(req2)
+            req2 = LazyValue(self.cert_factory.mk_certreq_n_keys, self.options.user_cn)
+            self.certreq_n_keyss.append((self.options.user_cn, mk_req_cache_id(self.options.user_cn), req2))
 
-        if self.server_x509_cert is not None:
-            cert_req3 = self.cert_factory.mk_replica_certreq_n_keys(self.server_x509_cert)
-            self.certreq_n_keyss.append(cert_req3)
+        for server_x509_cert in self.server_x509_certs:
+            cert_req3 = LazyValue(self.cert_factory.mk_replica_certreq_n_keys, server_x509_cert)
+            req3_cache_id = 'replica=%s' % server_x509_cert.get_fingerprint('sha1')
+            self.certreq_n_keyss.append((server_x509_cert.get_subject().CN, req3_cache_id, cert_req3))
 
     def add_profiles(self):
         if self.user_certnkey is not None:
@@ -137,6 +240,9 @@ class ProfileFactory(BaseProfileFactory):
             if not self.options.no_ca_cert_signed2:
                 self.add_im_basic_constraints_profiles()
 
+        if self.options.server_use_orig_dest:
+            self.add_replica_profiles()
+
     def add_raw_user_certnkey_profile(self):
         spec = SSLProfileSpec_UserSupplied(self.user_certnkey.cert.get_subject().CN)
         self.add_profile(SSLServerCertProfile(spec, self.user_certnkey))
@@ -146,31 +252,89 @@ class ProfileFactory(BaseProfileFactory):
         This method initializes auditors testing for basicConstraints violations
         '''
 
-        for cert_req in self.certreq_n_keyss:
-            self.add_im_basic_constraints_profile(cert_req, basicConstraint_CA=None)
-            self.add_im_basic_constraints_profile(cert_req, basicConstraint_CA=False)
-            self.add_im_basic_constraints_profile(cert_req, basicConstraint_CA=True)
+        for (cn, req_cache_id, cert_req) in self.certreq_n_keyss:
+            self.add_im_basic_constraints_profile(cn, req_cache_id, cert_req, basicConstraint_CA=None)
+            self.add_im_basic_constraints_profile(cn, req_cache_id, cert_req, basicConstraint_CA=False)
+            self.add_im_basic_constraints_profile(cn, req_cache_id, cert_req, basicConstraint_CA=True)
 
         # XXX if no user-cn and defalt-cn is disabled the test will be not performed silently
 
     # ----------------------------------------------------------------------------------------------
 
     def add_signed_profiles(self, ca_certnkey):
-        for certreq_n_keys in self.certreq_n_keyss:
-            cn = certreq_n_keys[0].get_subject().CN
+        for (cn, req_cache_id, certreq_n_keys) in self.certreq_n_keyss:
             if ca_certnkey == None:
                 cert_spec = SSLProfileSpec_SelfSigned(cn)
             else:
                 ca_cn = ca_certnkey.cert.get_subject().CN
                 cert_spec = SSLProfileSpec_Signed(cn, ca_cn)
 
-            self.add_signed_profile(cert_spec, certreq_n_keys, ca_certnkey)
+            self.add_signed_profile(cert_spec, certreq_n_keys, ca_certnkey,
+                req_cache_id + '|' + mk_ca_cache_id(ca_certnkey))
 
-    def add_signed_profile(self, cert_spec, certreq_n_keys, ca_certnkey):
-        certnkey = self.cert_factory.sign_cert_req(certreq_n_keys=certreq_n_keys, ca_certnkey=ca_certnkey)
+    def add_signed_profile(self, cert_spec, certreq_n_keys, ca_certnkey, cache_id):
+        certnkey = LazyValue(self.lazy_sign_cert_req, certreq_n_keys, ca_certnkey, cache_id)
         self.add_profile(SSLServerCertProfile(cert_spec, certnkey))
 
-    def add_im_basic_constraints_profile(self, cert_req, basicConstraint_CA):
+    def lazy_sign_cert_req(self, certreq_n_keys, ca_certnkey, cache_id):
+        '''
+        Does the same as CertFactory.sign_cert_req(), but accepts LazyValues and forces them. If the certificate
+        cache is enabled, the certificate is looked up there first, by given cache id.
+        '''
+        sign = lambda: self.cert_factory.sign_cert_req(force(certreq_n_keys), force(ca_certnkey))
+        if self.cert_cache is None:
+            return sign()
+        else:
+            return self.cert_cache.get(cache_id, sign)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def add_replica_profiles(self):
+        '''
+        This method adds profiles replicating the certificate of the original destination of each connection, one
+        per configured way to sign them. The certificates get fetched and replicated on the fly, the first time a
+        destination is seen. Meanwhile the self-signed certificate for the default CN is used.
+        '''
+        self.replica_cas = []
+        if not self.options.no_self_signed:
+            self.replica_cas.append(None)
+        if self.user_certnkey is not None:
+            self.replica_cas.append(self.user_certnkey)
+        if self.user_ca_certnkey is not None:
+            self.replica_cas.append(self.user_ca_certnkey)
+        if len(self.replica_cas) == 0:
+            raise ConfigError('--replicate-dst requires self-signed certificates or a user-supplied certificate or CA')
+
+        self.replica_cache = ReplicaCache(self.fetch_server_cert, self.forge_replicas,
+            lambda cert: cert.get_fingerprint('sha1'))
+
+        fallback_req = LazyValue(self.cert_factory.mk_certreq_n_keys, DEFAULT_CN)
+        fallback_certnkey = LazyValue(self.lazy_sign_cert_req, fallback_req, None,
+            mk_req_cache_id(DEFAULT_CN) + '|' + SELFSIGNED)
+
+        for (ca_index, ca_certnkey) in enumerate(self.replica_cas):
+            if ca_certnkey is None:
+                spec = SSLProfileSpec_Replica(None)
+            else:
+                spec = SSLProfileSpec_Replica(ca_certnkey.cert.get_subject().CN)
+            self.add_profile(SSLServerReplicaProfile(spec, self.replica_cache, ca_index, fallback_certnkey))
+
+    def fetch_server_cert(self, server):
+        return self.cert_factory.grab_server_x509_cert(server, protocol=self.protocol,
+            timeout=self.options.server_timeout, retries=self.options.server_retries)
+
+    def forge_replicas(self, server_cert):
+        '''
+        Returns a tuple of replicas of given server certificate, signed the ways listed in replica_cas. The key gets
+        generated once and shared by all of them.
+        '''
+        certreq_n_keys = LazyValue(self.cert_factory.mk_replica_certreq_n_keys, server_cert)
+        req_cache_id = 'replica=%s' % server_cert.get_fingerprint('sha1')
+        return tuple(
+            self.lazy_sign_cert_req(certreq_n_keys, ca_certnkey, req_cache_id + '|' + mk_ca_cache_id(ca_certnkey))
+            for ca_certnkey in self.replica_cas)
+
+    def add_im_basic_constraints_profile(self, cn, req_cache_id, cert_req, basicConstraint_CA):
         ca_certnkey = self.user_ca_certnkey
 
         # create an intermediate authority, signed by user-supplied CA, possibly with proper constraints
@@ -187,16 +351,19 @@ class ProfileFactory(BaseProfileFactory):
         else:
             v3_exts=[]
             im_ca_cn = IM_CA_NONE_CN
+            ext_value = None
 
         # create the intermediate CA
-        im_ca_cert_req = self.cert_factory.mk_certreq_n_keys(cn=im_ca_cn, v3_exts=v3_exts)
-        im_ca_certnkey = self.cert_factory.sign_cert_req(im_ca_cert_req, ca_certnkey=ca_certnkey)
+        im_ca_cert_req = LazyValue(self.cert_factory.mk_certreq_n_keys, im_ca_cn, v3_exts)
+        im_ca_cache_id = '%s,basicConstraints=%s|ca=%s' % (mk_req_cache_id(im_ca_cn), ext_value,
+            ca_certnkey.cert.get_fingerprint('sha1'))
+        im_ca_certnkey = LazyValue(self.lazy_sign_cert_req, im_ca_cert_req, ca_certnkey, im_ca_cache_id)
 
         # create server certificate, signed by that authority
-        certnkey = self.cert_factory.sign_cert_req(cert_req, ca_certnkey=im_ca_certnkey)
+        certnkey = LazyValue(self.lazy_sign_cert_req, cert_req, im_ca_certnkey,
+            '%s|imca=(%s)' % (req_cache_id, im_ca_cache_id))
 
         # create auditor using that certificate
-        cn = certnkey.cert.get_subject().CN
         ca_cn = ca_certnkey.cert.get_subject().CN
         spec = SSLProfileSpec_IMCA_Signed(cn, im_ca_cn, ca_cn)
         self.add_profile(SSLServerCertProfile(spec, certnkey))
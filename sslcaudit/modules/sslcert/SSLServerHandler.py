@@ -9,6 +9,8 @@ import M2Crypto, logging
 from time import time
 from M2Crypto.SSL.timeout import timeout
 from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult
+from sslcaudit.core.ConnectionEngine import ConnectionTask
+from sslcaudit.core.ContextCache import ContextCache
 from sslcaudit.modules.base.BaseServerHandler import BaseServerHandler
 from sslcaudit.modules.sslproto import resolve_ssl_code
 from sslcaudit.modules.sslproto import set_ephemeral_params
@@ -22,6 +24,8 @@ UNEXPECTED_EOF = 'unexpected eof'
 ALERT_UNKNOWN_CA = 'tlsv1 alert unknown ca'
 ALERT_CERT_UNKNOWN = 'sslv3 alert certificate unknown'
 
+SSL_RECEIVED_SHUTDOWN = 2
+
 class Connected(object):
     def __eq__(self, other):
         return self.__class__ == other.__class__
@@ -93,11 +97,25 @@ class SSLServerHandler(BaseServerHandler):
         BaseServerHandler.__init__(self)
 
         self.proto = proto
-
-    def handle(self, conn, profile, file_bag):
+        self.context_cache = ContextCache()
+
+    def mk_context(self, profile, conn):
+        '''
+        Returns SSL context for given profile and connection. Contexts are built once and shared by all connections
+        using the same certificate and key.
+        '''
+        certnkey = profile.get_certnkey(conn)
+        key = (self.proto, certnkey.cert_filename, certnkey.key_filename)
+        return self.context_cache.get(key, lambda: self.build_context(certnkey))
+
+    def build_context(self, certnkey):
         ctx = M2Crypto.SSL.Context(self.proto, weak_crypto=True)
-        ctx.load_cert_chain(certchainfile=profile.certnkey.cert_filename, keyfile=profile.certnkey.key_filename)
+        ctx.load_cert_chain(certchainfile=certnkey.cert_filename, keyfile=certnkey.key_filename)
         set_ephemeral_params(ctx)
+        return ctx
+
+    def handle(self, conn, profile, file_bag):
+        ctx = self.mk_context(profile, conn)
 
         self.logger.debug('trying to accept SSL connection %s with profile %s', conn, profile)
         try:
@@ -146,5 +164,81 @@ class SSLServerHandler(BaseServerHandler):
 
         return ConnectionAuditResult(conn, profile, res)
 
+    def mk_task(self, conn, profile, file_bag):
+        return SSLServerTask(self, conn, profile, file_bag)
+
     def __repr__(self):
         return "SSLServerHandler%s" % self.__dict__
+
+
+class SSLServerTask(ConnectionTask):
+    '''
+    This class does the same as SSLServerHandler.handle(), but without blocking, to be driven by ConnectionEngine.
+    First it waits for SSL handshake to complete, then for the client to send something, both limited by
+    sock_read_timeout of the handler.
+    '''
+    STATE_HANDSHAKE = 'handshake'
+    STATE_READ = 'read'
+
+    def __init__(self, handler, conn, profile, file_bag):
+        ConnectionTask.__init__(self, conn, profile)
+        self.handler = handler
+        self.file_bag = file_bag
+
+    def start(self):
+        ctx = self.handler.mk_context(self.profile, self.conn)
+
+        self.handler.logger.debug('trying to accept SSL connection %s with profile %s', self.conn, self.profile)
+        self.ssl_conn = M2Crypto.SSL.Connection(ctx=ctx, sock=self.conn.sock)
+        self.ssl_conn.setblocking(0)
+        self.ssl_conn.setup_ssl()
+        self.ssl_conn.set_accept_state()
+
+        self.state = self.STATE_HANDSHAKE
+        self.set_timeout(self.handler.sock_read_timeout)
+        return self.on_readable()
+
+    def on_readable(self):
+        if self.state == self.STATE_HANDSHAKE:
+            if self.ssl_conn.accept_ssl() != 1:
+                # need more data from the client
+                return None
+
+            self.handler.logger.debug('SSL connection accepted, version %s, cipher %s',
+                self.ssl_conn.get_version(), self.ssl_conn.get_cipher())
+            if self.ssl_conn.get_version() == 'SSLv2' and self.ssl_conn.get_cipher() is None:
+                ## workaround for #46
+                raise Exception(UNEXPECTED_EOF)
+
+            # try to read something from the client
+            self.state = self.STATE_READ
+            self.start_time = time()
+            self.set_timeout(self.handler.sock_read_timeout)
+
+        client_req = self.ssl_conn.read(size=MAX_SIZE)
+        dt = time() - self.start_time
+        if client_req is None:
+            if self.ssl_conn.get_shutdown() & SSL_RECEIVED_SHUTDOWN:
+                # the client has closed SSL session
+                return ConnectionAuditResult(self.conn, self.profile, ConnectedGotEOFBeforeTimeout(dt))
+            # need more data from the client
+            return None
+
+        if len(client_req) == 0:
+            res = ConnectedGotEOFBeforeTimeout(dt)
+        else:
+            res = ConnectedGotRequest(client_req, dt, self.file_bag)
+        return ConnectionAuditResult(self.conn, self.profile, res)
+
+    def on_timeout(self):
+        if self.state == self.STATE_HANDSHAKE:
+            # the handshake is still in progress, as blocking accept_ssl() timing out returns -1, not 0 (EOF)
+            res = resolve_ssl_code(self.ssl_conn.ssl_get_error(-1))
+            self.handler.logger.debug('SSL handshake failed: %s', res)
+        else:
+            res = ConnectedReadTimeout(time() - self.start_time)
+        return ConnectionAuditResult(self.conn, self.profile, res)
+
+    def on_error(self, ex):
+        self.handler.logger.debug('SSL accept failed: %s', ex)
+        return ConnectionAuditResult(self.conn, self.profile, str(ex))
@@ -0,0 +1,379 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import struct
+
+CONTENT_TYPE_HANDSHAKE = 0x16
+HANDSHAKE_TYPE_CLIENT_HELLO = 0x01
+SSLV2_MSG_CLIENT_HELLO = 0x01
+
+RECORD_HEADER_SIZE = 5
+HANDSHAKE_HEADER_SIZE = 4
+
+EXT_SERVER_NAME = 0x0000
+EXT_SUPPORTED_VERSIONS = 0x002b
+
+VERSION_NAMES = {
+    0x0002: 'SSLv2',
+    0x0300: 'SSLv3',
+    0x0301: 'TLSv1',
+    0x0302: 'TLSv1.1',
+    0x0303: 'TLSv1.2',
+    0x0304: 'TLSv1.3',
+}
+
+# cipher suite ids, mostly with OpenSSL names, the way they appear in suites.SUITES
+SUITE_NAMES = {
+    0x0000: 'NULL-NULL',
+    0x0001: 'NULL-MD5',
+    0x0002: 'NULL-SHA',
+    0x0003: 'EXP-RC4-MD5',
+    0x0004: 'RC4-MD5',
+    0x0005: 'RC4-SHA',
+    0x0006: 'EXP-RC2-CBC-MD5',
+    0x0007: 'IDEA-CBC-SHA',
+    0x0008: 'EXP-DES-CBC-SHA',
+    0x0009: 'DES-CBC-SHA',
+    0x000a: 'DES-CBC3-SHA',
+    0x0011: 'EXP-EDH-DSS-DES-CBC-SHA',
+    0x0012: 'EDH-DSS-DES-CBC-SHA',
+    0x0013: 'EDH-DSS-DES-CBC3-SHA',
+    0x0014: 'EXP-EDH-RSA-DES-CBC-SHA',
+    0x0015: 'EDH-RSA-DES-CBC-SHA',
+    0x0016: 'EDH-RSA-DES-CBC3-SHA',
+    0x0017: 'EXP-ADH-RC4-MD5',
+    0x0018: 'ADH-RC4-MD5',
+    0x0019: 'EXP-ADH-DES-CBC-SHA',
+    0x001a: 'ADH-DES-CBC-SHA',
+    0x001b: 'ADH-DES-CBC3-SHA',
+    0x002f: 'AES128-SHA',
+    0x0032: 'DHE-DSS-AES128-SHA',
+    0x0033: 'DHE-RSA-AES128-SHA',
+    0x0034: 'ADH-AES128-SHA',
+    0x0035: 'AES256-SHA',
+    0x0038: 'DHE-DSS-AES256-SHA',
+    0x0039: 'DHE-RSA-AES256-SHA',
+    0x003a: 'ADH-AES256-SHA',
+    0x003b: 'NULL-SHA256',
+    0x003c: 'AES128-SHA256',
+    0x003d: 'AES256-SHA256',
+    0x0040: 'DHE-DSS-AES128-SHA256',
+    0x0041: 'CAMELLIA128-SHA',
+    0x0044: 'DHE-DSS-CAMELLIA128-SHA',
+    0x0045: 'DHE-RSA-CAMELLIA128-SHA',
+    0x0046: 'ADH-CAMELLIA128-SHA',
+    0x0067: 'DHE-RSA-AES128-SHA256',
+    0x006a: 'DHE-DSS-AES256-SHA256',
+    0x006b: 'DHE-RSA-AES256-SHA256',
+    0x006c: 'ADH-AES128-SHA256',
+    0x006d: 'ADH-AES256-SHA256',
+    0x0084: 'CAMELLIA256-SHA',
+    0x0087: 'DHE-DSS-CAMELLIA256-SHA',
+    0x0088: 'DHE-RSA-CAMELLIA256-SHA',
+    0x0089: 'ADH-CAMELLIA256-SHA',
+    0x0096: 'SEED-SHA',
+    0x0099: 'DHE-DSS-SEED-SHA',
+    0x009a: 'DHE-RSA-SEED-SHA',
+    0x009b: 'ADH-SEED-SHA',
+    0x009c: 'AES128-GCM-SHA256',
+    0x009d: 'AES256-GCM-SHA384',
+    0x009e: 'DHE-RSA-AES128-GCM-SHA256',
+    0x009f: 'DHE-RSA-AES256-GCM-SHA384',
+    0x00a2: 'DHE-DSS-AES128-GCM-SHA256',
+    0x00a3: 'DHE-DSS-AES256-GCM-SHA384',
+    0x00a6: 'ADH-AES128-GCM-SHA256',
+    0x00a7: 'ADH-AES256-GCM-SHA384',
+    0x00ff: 'TLS_EMPTY_RENEGOTIATION_INFO_SCSV',
+    0x1301: 'TLS_AES_128_GCM_SHA256',
+    0x1302: 'TLS_AES_256_GCM_SHA384',
+    0x1303: 'TLS_CHACHA20_POLY1305_SHA256',
+    0x5600: 'TLS_FALLBACK_SCSV',
+    0xc002: 'ECDH-ECDSA-RC4-SHA',
+    0xc003: 'ECDH-ECDSA-DES-CBC3-SHA',
+    0xc004: 'ECDH-ECDSA-AES128-SHA',
+    0xc005: 'ECDH-ECDSA-AES256-SHA',
+    0xc007: 'ECDHE-ECDSA-RC4-SHA',
+    0xc008: 'ECDHE-ECDSA-DES-CBC3-SHA',
+    0xc009: 'ECDHE-ECDSA-AES128-SHA',
+    0xc00a: 'ECDHE-ECDSA-AES256-SHA',
+    0xc00c: 'ECDH-RSA-RC4-SHA',
+    0xc00d: 'ECDH-RSA-DES-CBC3-SHA',
+    0xc00e: 'ECDH-RSA-AES128-SHA',
+    0xc00f: 'ECDH-RSA-AES256-SHA',
+    0xc011: 'ECDHE-RSA-RC4-SHA',
+    0xc012: 'ECDHE-RSA-DES-CBC3-SHA',
+    0xc013: 'ECDHE-RSA-AES128-SHA',
+    0xc014: 'ECDHE-RSA-AES256-SHA',
+    0xc016: 'AECDH-RC4-SHA',
+    0xc017: 'AECDH-DES-CBC3-SHA',
+    0xc018: 'AECDH-AES128-SHA',
+    0xc019: 'AECDH-AES256-SHA',
+    0xc023: 'ECDHE-ECDSA-AES128-SHA256',
+    0xc024: 'ECDHE-ECDSA-AES256-SHA384',
+    0xc025: 'ECDH-ECDSA-AES128-SHA256',
+    0xc026: 'ECDH-ECDSA-AES256-SHA384',
+    0xc027: 'ECDHE-RSA-AES128-SHA256',
+    0xc028: 'ECDHE-RSA-AES256-SHA384',
+    0xc029: 'ECDH-RSA-AES128-SHA256',
+    0xc02a: 'ECDH-RSA-AES256-SHA384',
+    0xc02b: 'ECDHE-ECDSA-AES128-GCM-SHA256',
+    0xc02c: 'ECDHE-ECDSA-AES256-GCM-SHA384',
+    0xc02d: 'ECDH-ECDSA-AES128-GCM-SHA256',
+    0xc02e: 'ECDH-ECDSA-AES256-GCM-SHA384',
+    0xc02f: 'ECDHE-RSA-AES128-GCM-SHA256',
+    0xc030: 'ECDHE-RSA-AES256-GCM-SHA384',
+    0xc031: 'ECDH-RSA-AES128-GCM-SHA256',
+    0xc032: 'ECDH-RSA-AES256-GCM-SHA384',
+    0xcca8: 'ECDHE-RSA-CHACHA20-POLY1305',
+    0xcca9: 'ECDHE-ECDSA-CHACHA20-POLY1305',
+    0xccaa: 'DHE-RSA-CHACHA20-POLY1305',
+}
+
+# SSLv2 cipher kinds, 3 octets each
+SSLV2_SUITE_NAMES = {
+    0x010080: 'RC4-MD5',
+    0x020080: 'EXP-RC4-MD5',
+    0x030080: 'RC2-CBC-MD5',
+    0x040080: 'EXP-RC2-CBC-MD5',
+    0x050080: 'IDEA-CBC-MD5',
+    0x060040: 'DES-CBC-MD5',
+    0x0700c0: 'DES-CBC3-MD5',
+}
+
+EXTENSION_NAMES = {
+    0x0000: 'server_name',
+    0x0005: 'status_request',
+    0x000a: 'supported_groups',
+    0x000b: 'ec_point_formats',
+    0x000d: 'signature_algorithms',
+    0x000f: 'heartbeat',
+    0x0010: 'application_layer_protocol_negotiation',
+    0x0012: 'signed_certificate_timestamp',
+    0x0015: 'padding',
+    0x0016: 'encrypt_then_mac',
+    0x0017: 'extended_master_secret',
+    0x0023: 'session_ticket',
+    0x002b: 'supported_versions',
+    0x002d: 'psk_key_exchange_modes',
+    0x0033: 'key_share',
+    0x3374: 'next_protocol_negotiation',
+    0xff01: 'renegotiation_info',
+}
+
+
+class ClientHelloError(ValueError):
+    '''
+    This exception is thrown if the data does not look like a ClientHello message.
+    '''
+    pass
+
+
+class IncompleteClientHello(ClientHelloError):
+    '''
+    This exception is thrown if the data looks like the beginning of a ClientHello message, but is truncated.
+    '''
+    pass
+
+
+def version_name(version):
+    return VERSION_NAMES.get(version, '0x%04x' % version)
+
+def suite_name(suite):
+    if suite > 0xffff:
+        return SSLV2_SUITE_NAMES.get(suite, '0x%06x' % suite)
+    return SUITE_NAMES.get(suite, '0x%04x' % suite)
+
+def extension_name(ext_type):
+    return EXTENSION_NAMES.get(ext_type, '0x%04x' % ext_type)
+
+
+class ClientHello(object):
+    '''
+    This class holds the content of a ClientHello message: the protocol versions offered by the client, cipher
+    suites (as numeric ids, SSLv2 cipher kinds are 3 octets long), compression methods, and extensions (as a list of
+    (type, data) tuples).
+    '''
+
+    def __init__(self, sslv2=False):
+        self.sslv2 = sslv2
+        self.record_version = None
+        self.version = None
+        self.cipher_suites = []
+        self.compression_methods = []
+        self.extensions = []
+        self.server_name = None
+        self.supported_versions = []
+
+    def get_versions(self):
+        '''
+        Returns the list of protocol versions the client is ready to use, highest first.
+        '''
+        if len(self.supported_versions) > 0:
+            return self.supported_versions
+        return [self.version]
+
+    def get_suite_names(self):
+        return [suite_name(suite) for suite in self.cipher_suites]
+
+    def get_extension_names(self):
+        return [extension_name(ext_type) for (ext_type, _) in self.extensions]
+
+    def __str__(self):
+        return 'ClientHello(%s, %d suites, %d extensions)' % (', '.join(map(version_name, self.get_versions())),
+            len(self.cipher_suites), len(self.extensions))
+
+
+def parse_client_hello(data):
+    '''
+    Parses ClientHello message at the beginning of the given string, as sent by the client at the beginning of the
+    connection (either in SSLv3/TLS record format, or in SSLv2 format). Returns ClientHello object. Throws
+    IncompleteClientHello if more data is needed, ClientHelloError if the data is not a ClientHello.
+    '''
+    if len(data) < 1:
+        raise IncompleteClientHello('no data')
+
+    if ord(data[0]) & 0x80:
+        return parse_sslv2_client_hello(data)
+    elif ord(data[0]) == CONTENT_TYPE_HANDSHAKE:
+        return parse_tls_client_hello(data)
+    else:
+        raise ClientHelloError('unexpected record type 0x%02x' % ord(data[0]))
+
+
+def parse_sslv2_client_hello(data):
+    if len(data) < 2:
+        raise IncompleteClientHello('truncated SSLv2 record header')
+    msg_len = ((ord(data[0]) & 0x7f) << 8) | ord(data[1])
+    msg = data[2:2 + msg_len]
+    if len(msg) < msg_len:
+        raise IncompleteClientHello('truncated SSLv2 record')
+
+    if msg_len < 9 or ord(msg[0]) != SSLV2_MSG_CLIENT_HELLO:
+        raise ClientHelloError('not an SSLv2 ClientHello')
+
+    hello = ClientHello(sslv2=True)
+    (hello.version, specs_len, session_id_len, challenge_len) = struct.unpack('>HHHH', msg[1:9])
+    hello.record_version = 0x0002
+    if specs_len % 3 != 0 or 9 + specs_len + session_id_len + challenge_len > msg_len:
+        raise ClientHelloError('malformed SSLv2 ClientHello')
+
+    for offset in range(9, 9 + specs_len, 3):
+        (b0, b1, b2) = struct.unpack('>BBB', msg[offset:offset + 3])
+        if b0 == 0:
+            # SSLv3/TLS cipher suite offered in SSLv2 format
+            hello.cipher_suites.append((b1 << 8) | b2)
+        else:
+            hello.cipher_suites.append((b0 << 16) | (b1 << 8) | b2)
+
+    return hello
+
+
+def parse_tls_client_hello(data):
+    # the message may be fragmented over several records, put it back together
+    record_version = None
+    handshake = ''
+    offset = 0
+    while True:
+        if len(handshake) >= HANDSHAKE_HEADER_SIZE:
+            msg_len = struct.unpack('>I', '\x00' + handshake[1:4])[0]
+            if len(handshake) >= HANDSHAKE_HEADER_SIZE + msg_len:
+                break
+
+        header = data[offset:offset + RECORD_HEADER_SIZE]
+        if len(header) < RECORD_HEADER_SIZE:
+            raise IncompleteClientHello('truncated record header')
+        (content_type, version, length) = struct.unpack('>BHH', header)
+        if content_type != CONTENT_TYPE_HANDSHAKE:
+            raise ClientHelloError('unexpected record type 0x%02x' % content_type)
+        if record_version is None:
+            record_version = version
+
+        fragment = data[offset + RECORD_HEADER_SIZE:offset + RECORD_HEADER_SIZE + length]
+        if len(fragment) < length:
+            raise IncompleteClientHello('truncated record')
+        handshake += fragment
+        offset += RECORD_HEADER_SIZE + length
+
+    if ord(handshake[0]) != HANDSHAKE_TYPE_CLIENT_HELLO:
+        raise ClientHelloError('unexpected handshake message type 0x%02x' % ord(handshake[0]))
+
+    hello = ClientHello()
+    hello.record_version = record_version
+    parse_client_hello_body(hello, handshake[HANDSHAKE_HEADER_SIZE:HANDSHAKE_HEADER_SIZE + msg_len])
+    return hello
+
+
+def parse_client_hello_body(hello, body):
+    reader = Reader(body)
+    hello.version = reader.read_uint(2)
+    reader.skip(32)  # random
+    reader.read_vector(1)  # session id
+
+    suites = reader.read_vector(2)
+    if len(suites) % 2 != 0:
+        raise ClientHelloError('odd length of cipher suite list')
+    hello.cipher_suites = list(struct.unpack('>%dH' % (len(suites) / 2), suites))
+    hello.compression_methods = [ord(c) for c in reader.read_vector(1)]
+
+    if reader.at_end():
+        # extensions are optional
+        return
+
+    extensions = Reader(reader.read_vector(2))
+    while not extensions.at_end():
+        ext_type = extensions.read_uint(2)
+        ext_data = extensions.read_vector(2)
+        hello.extensions.append((ext_type, ext_data))
+
+        if ext_type == EXT_SERVER_NAME:
+            hello.server_name = parse_server_name(ext_data)
+        elif ext_type == EXT_SUPPORTED_VERSIONS:
+            versions = Reader(ext_data).read_vector(1)
+            if len(versions) % 2 != 0:
+                raise ClientHelloError('odd length of supported versions list')
+            hello.supported_versions = list(struct.unpack('>%dH' % (len(versions) / 2), versions))
+
+
+def parse_server_name(ext_data):
+    names = Reader(Reader(ext_data).read_vector(2))
+    while not names.at_end():
+        name_type = names.read_uint(1)
+        name = names.read_vector(2)
+        if name_type == 0:
+            return name
+    return None
+
+
+class Reader(object):
+    '''
+    This class reads TLS-encoded integers and vectors from a string, throwing ClientHelloError on overruns.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, size):
+        if self.offset + size > len(self.data):
+            raise ClientHelloError('malformed ClientHello, field overruns the message')
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def skip(self, size):
+        self.read(size)
+
+    def read_uint(self, size):
+        value = 0
+        for c in self.read(size):
+            value = (value << 8) | ord(c)
+        return value
+
+    def read_vector(self, len_size):
+        return self.read(self.read_uint(len_size))
+
+    def at_end(self):
+        return self.offset >= len(self.data)
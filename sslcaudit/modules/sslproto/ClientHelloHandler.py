@@ -0,0 +1,133 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import M2Crypto, logging, socket
+from time import time, sleep
+from M2Crypto.SSL.timeout import timeout
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult
+from sslcaudit.core.ContextCache import ContextCache
+from sslcaudit.modules.base.BaseServerHandler import BaseServerHandler
+from sslcaudit.modules.sslproto import set_ephemeral_params
+from sslcaudit.modules.sslproto.ClientHello import parse_client_hello, ClientHelloError, IncompleteClientHello, \
+    version_name
+
+DEFAULT_HELLO_TIMEOUT = 3.0
+
+# large enough for a ClientHello split over several records
+PEEK_SIZE = 65536
+
+# how long to wait before peeking again if no new data has arrived
+PEEK_INTERVAL = 0.05
+
+HANDSHAKE_PROTO = 'sslv23'
+HANDSHAKE_CIPHERS = 'ALL:eNULL'
+
+class ClientHelloReport(object):
+    '''
+    This class describes the ClientHello message sent by the client: offered protocol versions, cipher suites and
+    extensions (by name, the unknown ones in hex), requested server name, and the outcome of the handshake which
+    followed.
+    '''
+
+    def __init__(self, hello, handshake_res):
+        self.versions = [version_name(version) for version in hello.get_versions()]
+        self.suites = hello.get_suite_names()
+        self.extensions = hello.get_extension_names()
+        self.server_name = hello.server_name
+        self.sslv2 = hello.sslv2
+        self.handshake_res = handshake_res
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__
+
+    def __hash__(self):
+        return hash(self.__class__)
+
+    def __str__(self):
+        return 'offered %s, suites %s, extensions %s, handshake: %s' % (
+            '/'.join(self.versions), ':'.join(self.suites), ','.join(self.extensions), self.handshake_res)
+
+
+class ClientHelloHandler(BaseServerHandler):
+    '''
+    This class learns which protocol versions and cipher suites the client supports from a single connection. Its
+    handle() method peeks at the ClientHello message without taking it off the socket, parses it, then lets OpenSSL
+    proceed with the handshake using the most permissive settings, so that the client does not see the connection
+    torn down halfway.
+    '''
+    logger = logging.getLogger('sslproto.ClientHelloHandler')
+
+    hello_timeout = DEFAULT_HELLO_TIMEOUT
+    sock_read_timeout = DEFAULT_HELLO_TIMEOUT
+
+    def __init__(self):
+        BaseServerHandler.__init__(self)
+        self.context_cache = ContextCache()
+
+    def handle(self, conn, profile, file_bag):
+        try:
+            hello = self.peek_client_hello(conn.sock)
+        except (ClientHelloError, socket.error) as ex:
+            self.logger.debug('failed to get ClientHello from %s: %s', conn, ex)
+            return ConnectionAuditResult(conn, profile, str(ex))
+
+        self.logger.debug('got %s from %s', hello, conn)
+        handshake_res = self.complete_handshake(conn, profile)
+        return ConnectionAuditResult(conn, profile, ClientHelloReport(hello, handshake_res))
+
+    def peek_client_hello(self, sock):
+        deadline = time() + self.hello_timeout
+        prev_len = None
+        try:
+            while True:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise ClientHelloError('timeout waiting for ClientHello')
+                sock.settimeout(remaining)
+
+                data = sock.recv(PEEK_SIZE, socket.MSG_PEEK)
+                if len(data) == 0:
+                    raise ClientHelloError('unexpected eof')
+
+                try:
+                    return parse_client_hello(data)
+                except IncompleteClientHello:
+                    # recv() with MSG_PEEK returns right away as long as there is anything to read
+                    if len(data) == prev_len:
+                        sleep(PEEK_INTERVAL)
+                    prev_len = len(data)
+        finally:
+            # OpenSSL expects a blocking socket
+            sock.settimeout(None)
+
+    def complete_handshake(self, conn, profile):
+        '''
+        Returns the negotiated protocol and cipher, or the reason of the handshake failure.
+        '''
+        try:
+            ssl_conn = M2Crypto.SSL.Connection(ctx=self.mk_context(profile), sock=conn.sock)
+            ssl_conn.set_socket_read_timeout(timeout(self.sock_read_timeout))
+            ssl_conn.setup_ssl()
+            if ssl_conn.accept_ssl() != 1:
+                return 'failed'
+            return '%s %s' % (ssl_conn.get_version(), ssl_conn.get_cipher())
+        except Exception as ex:
+            return str(ex)
+
+    def mk_context(self, profile):
+        certnkey = profile.certnkey
+        key = (certnkey.cert_filename, certnkey.key_filename)
+        return self.context_cache.get(key, lambda: self.build_context(certnkey))
+
+    def build_context(self, certnkey):
+        ctx = M2Crypto.SSL.Context(HANDSHAKE_PROTO, weak_crypto=True)
+        ctx.load_cert_chain(certchainfile=certnkey.cert_filename, keyfile=certnkey.key_filename)
+        set_ephemeral_params(ctx)
+        ctx.set_cipher_list(HANDSHAKE_CIPHERS)
+        return ctx
+
+    def __repr__(self):
+        return "sslproto.ClientHelloHandler%s" % self.__dict__
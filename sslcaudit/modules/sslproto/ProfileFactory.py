@@ -4,16 +4,24 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 import logging
-from sslcaudit.core.CertFactory import CertFactory
+import M2Crypto
+from sslcaudit.core.CertCache import get_default_cert_cache
+from sslcaudit.core.CertFactory import CertFactory, DEFAULT_BITS, SELFSIGNED
 from sslcaudit.core.ConfigError import ConfigError
+from sslcaudit.core.LazyValue import LazyValue, force
 from sslcaudit.modules import sslproto
 
-from sslcaudit.modules.base.BaseProfileFactory import BaseProfileFactory, BaseProfile, BaseProfileSpec
-from sslcaudit.modules.sslproto.ServerHandler import ServerHandler
+from sslcaudit.modules.base.BaseProfileFactory import BaseProfileFactory, BaseProfile, BaseProfileSpec, BaseDynamicProfile
+from sslcaudit.modules.sslproto.ServerHandler import ServerHandler, Connected, CiphersAccepted
+from sslcaudit.modules.sslproto.ClientHelloHandler import ClientHelloHandler
 from sslcaudit.modules.sslproto import DEFAULT_CIPHER_SUITES, suites
 
 SSLPROTO_CN = 'sslproto'
+CLIENT_HELLO_CIPHERS = 'HELLO'
+BISECT_CIPHERS = 'BISECT'
+
 sslproto_server_handler = ServerHandler()
+client_hello_handler = ClientHelloHandler()
 
 class SSLServerProtoSpec(BaseProfileSpec):
     def __init__(self, proto, cipher):
@@ -26,7 +34,11 @@ class SSLServerProtoSpec(BaseProfileSpec):
 class SSLServerProtoProfile(BaseProfile):
     def __init__(self, profile_spec, certnkey):
         self.profile_spec = profile_spec
-        self.certnkey = certnkey
+        self.lazy_certnkey = certnkey
+
+    @property
+    def certnkey(self):
+        return force(self.lazy_certnkey)
 
     def get_spec(self):
         return self.profile_spec
@@ -37,6 +49,86 @@ class SSLServerProtoProfile(BaseProfile):
     def __str__(self):
         return "%s" % (self.profile_spec)
 
+class ClientHelloSpec(BaseProfileSpec):
+    def __str__(self):
+        return "sslproto(client hello)"
+
+class ClientHelloProfile(SSLServerProtoProfile):
+    '''
+    This profile captures ClientHello and reports all protocol versions and cipher suites offered by the client.
+    '''
+    def __init__(self, certnkey):
+        SSLServerProtoProfile.__init__(self, ClientHelloSpec(), certnkey)
+
+    def get_handler(self):
+        return client_hello_handler
+
+class CipherBisectionSpec(BaseProfileSpec):
+    def __init__(self, proto):
+        self.proto = proto
+
+    def __str__(self):
+        return "sslproto(%s, bisect)" % self.proto
+
+class CipherBisectionProfile(BaseDynamicProfile):
+    '''
+    This profile finds out which of given ciphers the client accepts, without spending a connection on each of them.
+    It offers a group of ciphers at once. If the handshake fails, the client accepts none of them. If it succeeds, the
+    negotiated cipher is accepted and the rest of the group gets offered again. If the negotiated cipher cannot be
+    told, the group is split in two halves, each offered separately.
+    '''
+    def __init__(self, proto, ciphers, certnkey):
+        self.profile_spec = CipherBisectionSpec(proto)
+        self.ciphers = ciphers
+        self.lazy_certnkey = certnkey
+
+        self.groups = []  # groups of ciphers to offer yet
+        if len(ciphers) > 0:
+            self.groups.append(list(ciphers))
+        self.pending = {}  # profile -> group of ciphers it offers, for connections in progress
+        self.accepted = []
+
+    def get_spec(self):
+        return self.profile_spec
+
+    def mk_session_instance(self):
+        return CipherBisectionProfile(self.profile_spec.proto, self.ciphers, self.lazy_certnkey)
+
+    def next_profile(self):
+        if len(self.groups) == 0:
+            return None
+        group = self.groups.pop(0)
+        profile = SSLServerProtoProfile(SSLServerProtoSpec(self.profile_spec.proto, ':'.join(group)), self.lazy_certnkey)
+        self.pending[profile] = group
+        return profile
+
+    def add_result(self, profile, res):
+        group = self.pending.pop(profile)
+        if not isinstance(res.result, Connected):
+            # none of the ciphers in the group is acceptable
+            return
+
+        if res.result.cipher in group:
+            self.accepted.append(res.result.cipher)
+            rest = [cipher for cipher in group if cipher != res.result.cipher]
+            if len(rest) > 0:
+                self.groups.append(rest)
+        elif len(group) == 1:
+            self.accepted.append(group[0])
+        else:
+            half = len(group) / 2
+            self.groups.append(group[:half])
+            self.groups.append(group[half:])
+
+    def is_done(self):
+        return len(self.groups) == 0 and len(self.pending) == 0
+
+    def get_summary(self):
+        return CiphersAccepted(self.accepted)
+
+    def __str__(self):
+        return "%s" % (self.profile_spec)
+
 
 class ProfileFactory(BaseProfileFactory):
     logger = logging.getLogger('sslproto.ProfileFactory')
@@ -44,15 +136,32 @@ class ProfileFactory(BaseProfileFactory):
     def __init__(self, file_bag, options):
         BaseProfileFactory.__init__(self, file_bag, options)
 
-        # produce a self-signed server certificate
+        # produce a self-signed server certificate, shared by all profiles, once the first of them gets used
         cert_factory = CertFactory(self.file_bag)
-        certreq_n_keys = cert_factory.mk_certreq_n_keys(SSLPROTO_CN)
-        certnkey = cert_factory.sign_cert_req(certreq_n_keys, None)
+        mk_certnkey = lambda: cert_factory.sign_cert_req(cert_factory.mk_certreq_n_keys(SSLPROTO_CN), None)
+        cert_cache = get_default_cert_cache()
+        if cert_cache is None:
+            certnkey = LazyValue(mk_certnkey)
+        else:
+            cache_id = 'cn=%s,bits=%d|%s' % (SSLPROTO_CN, DEFAULT_BITS, SELFSIGNED)
+            certnkey = LazyValue(cert_cache.get, cache_id, mk_certnkey)
 
         self.init_protocols(options.protocols)
 
+        if options.ciphers == CLIENT_HELLO_CIPHERS:
+            # a single connection tells everything
+            self.add_profile(ClientHelloProfile(certnkey))
+            return
+
+        if options.ciphers == BISECT_CIPHERS:
+            # cipher groups to offer depend on the outcome of previous connections
+            for proto in self.protocols:
+                ciphers = self.filter_ciphers(proto, suites.SUITES[proto])
+                self.add_profile(CipherBisectionProfile(proto, ciphers, certnkey))
+            return
+
         for proto in self.protocols:
-            ciphers = self.get_ciphers(proto, options.ciphers)
+            ciphers = self.filter_ciphers(proto, self.get_ciphers(proto, options.ciphers))
             for cipher in ciphers:
                 profile = SSLServerProtoProfile(SSLServerProtoSpec(proto, cipher), certnkey)
                 self.add_profile(profile)
@@ -93,6 +202,20 @@ class ProfileFactory(BaseProfileFactory):
             ','.join(self.protocols),
             len(self.profiles))
 
+    def filter_ciphers(self, proto, ciphers):
+        '''
+        Returns the list of ciphers without the ones OpenSSL does not accept for given protocol. Otherwise they would
+        fail every connection, after the handshake has already begun.
+        '''
+        ctx = M2Crypto.SSL.Context(protocol=proto, weak_crypto=True)
+        accepted_ciphers = []
+        for cipher in ciphers:
+            if ctx.set_cipher_list(cipher) == 1:
+                accepted_ciphers.append(cipher)
+            else:
+                self.logger.warn('skipping cipher %s, not supported by OpenSSL for protocol %s', cipher, proto)
+        return accepted_ciphers
+
     def get_ciphers(self, proto, user_specified_ciphers_str):
         """ This method returns a list of ciphers to try for given protocol. The list of ciphers comes from the
         built-in list of suites (default), a built-in long list of ciphers (per protocol, if user specified
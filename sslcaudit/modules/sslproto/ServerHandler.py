@@ -8,6 +8,8 @@ import M2Crypto, logging
 from time import time
 from M2Crypto.SSL.timeout import timeout
 from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult
+from sslcaudit.core.ConnectionEngine import ConnectionTask
+from sslcaudit.core.ContextCache import ContextCache
 from sslcaudit.modules.base.BaseServerHandler import BaseServerHandler
 from sslcaudit.modules.sslproto import resolve_ssl_code
 from sslcaudit.modules.sslproto import set_ephemeral_params
@@ -24,6 +26,10 @@ ALERT_UNKNOWN_CA = 'tlsv1 alert unknown ca'
 ALERT_CERT_UNKNOWN = 'sslv3 alert certificate unknown'
 
 class Connected(object):
+    def __init__(self, cipher=None):
+        # name of the negotiated cipher, does not take part in comparisons
+        self.cipher = cipher
+
     def __eq__(self, other):
         return self.__class__ == other.__class__
 
@@ -31,7 +37,35 @@ class Connected(object):
         return hash(self.__class__)
 
     def __str__(self):
-        return 'Connected()'
+        if self.cipher is None:
+            return 'Connected()'
+        else:
+            return 'Connected(%s)' % self.cipher
+
+
+class CiphersAccepted(object):
+    '''
+    This class holds the list of ciphers the client has turned out to accept.
+    '''
+    def __init__(self, ciphers):
+        self.ciphers = ciphers
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__ and sorted(self.ciphers) == sorted(other.ciphers)
+
+    def __hash__(self):
+        return hash(self.__class__)
+
+    def __str__(self):
+        return 'accepted %d ciphers: %s' % (len(self.ciphers), ':'.join(self.ciphers))
+
+
+def get_cipher_name(ssl_conn):
+    cipher = ssl_conn.get_cipher()
+    if cipher is None:
+        return None
+    else:
+        return cipher.name()
 
 
 class ServerHandler(BaseServerHandler):
@@ -45,27 +79,43 @@ class ServerHandler(BaseServerHandler):
 
     def __init__(self):
         BaseServerHandler.__init__(self)
-
-    def handle(self, conn, profile, file_bag):
+        self.context_cache = ContextCache()
+
+    def mk_context(self, profile):
+        '''
+        Returns SSL context for given profile. Contexts are built on first use and shared by all connections handled
+        with the same protocol, cipher list, certificate and key.
+        '''
+        spec = profile.profile_spec
+        certnkey = profile.certnkey
+        key = (spec.proto, spec.cipher, certnkey.cert_filename, certnkey.key_filename)
+        return self.context_cache.get(key, lambda: self.build_context(spec, certnkey))
+
+    def build_context(self, spec, certnkey):
         # create a context, explicitly specify the flavour of the protocol
-        ctx = M2Crypto.SSL.Context(protocol=profile.profile_spec.proto, weak_crypto=True)
-        ctx.load_cert_chain(certchainfile=profile.certnkey.cert_filename, keyfile=profile.certnkey.key_filename)
+        ctx = M2Crypto.SSL.Context(protocol=spec.proto, weak_crypto=True)
+        ctx.load_cert_chain(certchainfile=certnkey.cert_filename, keyfile=certnkey.key_filename)
         set_ephemeral_params(ctx)
 
         # set restrict all protocols except the one prescribed by the profile
         options = m2.SSL_OP_ALL
-        if profile.profile_spec.proto == 'sslv2':
+        if spec.proto == 'sslv2':
             options |= m2.SSL_OP_NO_SSLv3 | m2.SSL_OP_NO_TLSv1
-        elif profile.profile_spec.proto == 'sslv3':
+        elif spec.proto == 'sslv3':
             options |= m2.SSL_OP_NO_SSLv2 | m2.SSL_OP_NO_TLSv1
-        elif profile.profile_spec.proto == 'tlsv1':
+        elif spec.proto == 'tlsv1':
             options |= m2.SSL_OP_NO_SSLv2 | m2.SSL_OP_NO_SSLv3
         else:
-            raise ValueError('unsupported protocol: %s' % profile.profile_spec.proto)
+            raise ValueError('unsupported protocol: %s' % spec.proto)
         ctx.set_options(options)
 
         # set allowed ciphers
-        ctx.set_cipher_list(profile.profile_spec.cipher)
+        ctx.set_cipher_list(spec.cipher)
+
+        return ctx
+
+    def handle(self, conn, profile, file_bag):
+        ctx = self.mk_context(profile)
 
         self.logger.debug('trying to accept SSL connection %s with profile %s', conn, profile)
         try:
@@ -80,7 +130,7 @@ class ServerHandler(BaseServerHandler):
                 if ssl_conn.get_version() == 'SSLv2' and ssl_conn.get_cipher() is None:
                     # workaround for #46
                     raise Exception(UNEXPECTED_EOF)
-                return ConnectionAuditResult(conn, profile, Connected())
+                return ConnectionAuditResult(conn, profile, Connected(get_cipher_name(ssl_conn)))
             else:
                 res = ssl_conn.ssl_get_error(ssl_conn_res)
                 res = resolve_ssl_code(res)
@@ -93,5 +143,52 @@ class ServerHandler(BaseServerHandler):
 
         return ConnectionAuditResult(conn, profile, res)
 
+    def mk_task(self, conn, profile, file_bag):
+        return ServerTask(self, conn, profile)
+
     def __repr__(self):
         return "sslproto.ServerHandler%s" % self.__dict__
+
+
+class ServerTask(ConnectionTask):
+    '''
+    This class does the same as ServerHandler.handle(), but without blocking, to be driven by ConnectionEngine.
+    '''
+
+    def __init__(self, handler, conn, profile):
+        ConnectionTask.__init__(self, conn, profile)
+        self.handler = handler
+
+    def start(self):
+        ctx = self.handler.mk_context(self.profile)
+
+        self.handler.logger.debug('trying to accept SSL connection %s with profile %s', self.conn, self.profile)
+        self.ssl_conn = M2Crypto.SSL.Connection(ctx=ctx, sock=self.conn.sock)
+        self.ssl_conn.setblocking(0)
+        self.ssl_conn.setup_ssl()
+        self.ssl_conn.set_accept_state()
+
+        self.set_timeout(self.handler.sock_read_timeout)
+        return self.on_readable()
+
+    def on_readable(self):
+        if self.ssl_conn.accept_ssl() != 1:
+            # need more data from the client
+            return None
+
+        self.handler.logger.debug('SSL connection accepted, version %s cipher %s',
+            self.ssl_conn.get_version(), self.ssl_conn.get_cipher())
+        if self.ssl_conn.get_version() == 'SSLv2' and self.ssl_conn.get_cipher() is None:
+            # workaround for #46
+            raise Exception(UNEXPECTED_EOF)
+        return ConnectionAuditResult(self.conn, self.profile, Connected(get_cipher_name(self.ssl_conn)))
+
+    def on_timeout(self):
+        # the handshake is still in progress, as blocking accept_ssl() timing out returns -1, not 0 (EOF)
+        res = resolve_ssl_code(self.ssl_conn.ssl_get_error(-1))
+        self.handler.logger.debug('SSL handshake failed: %s', res)
+        return ConnectionAuditResult(self.conn, self.profile, res)
+
+    def on_error(self, ex):
+        self.handler.logger.debug('SSL accept failed: %s', ex)
+        return ConnectionAuditResult(self.conn, self.profile, str(ex))
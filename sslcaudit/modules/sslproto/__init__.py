@@ -17,7 +17,8 @@ IS_SSLv2_SUPPORTED = hasattr(M2Crypto.m2, "sslv2_method") and M2Crypto.m2.ssl_ct
 
 _ = os.path.dirname(os.path.abspath(__file__))
 EPHEMERAL_RSA_KEY = M2Crypto.RSA.load_key(os.path.join(_, "../../files/rsa512.pem"))  # ctx.set_tmp_rsa(EPHEMERAL_RSA_KEY)
-EPHEMERAL_DH_PARAMS = os.path.join(_, "../../files/dh2048.pem")  # ctx.set_tmp_dh(EPHEMERAL_DH_PARAMS)
+EPHEMERAL_DH_PARAMS = os.path.join(_, "../../files/dh2048.pem")
+EPHEMERAL_DH = M2Crypto.DH.load_params(EPHEMERAL_DH_PARAMS)  # loaded once, see set_ephemeral_params()
 
 supported_protocols = None
 error_reported = False
@@ -52,7 +53,8 @@ def set_ephemeral_params(ctx):
     Sets ephemeral params for given context needed by SSL server instances (e.g. EXPORT ciphers)
     """
     ctx.set_tmp_rsa(EPHEMERAL_RSA_KEY)
-    ctx.set_tmp_dh(EPHEMERAL_DH_PARAMS)
+    # unlike this, ctx.set_tmp_dh() would read and parse the file every time
+    M2Crypto.m2.ssl_ctx_set_tmp_dh(ctx.ctx, EPHEMERAL_DH._ptr())
 
 
 def get_ciphers(proto):
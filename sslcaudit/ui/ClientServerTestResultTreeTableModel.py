@@ -118,7 +118,12 @@ class ClientServerTestResultTreeTableModel(QtCore.QAbstractItemModel):
                     connProfileItem.result = result
                     # XXX need to call self.dataChanged() here?
                     return
-            logger.error('got "new_conn_result" event, but cannot find a row for it')
+
+            # profiles chosen at runtime by dynamic profiles have no row yet
+            n = clientTreeItem.childCount()
+            self.beginInsertRows(self.createIndex(clientTreeItem.row(), 0, clientTreeItem), n, n)
+            clientTreeItem.appendChild(ConnectionProfileTreeItem(clientTreeItem, profile, result))
+            self.endInsertRows()
         else:
             logger.error('received "new_conn_result" event for session id "%s" but there is no subtree for it' % (session_id))
 
@@ -4,9 +4,9 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
-import logging
+import logging, sys
 from sslcaudit.core.BaseClientAuditController import BaseClientAuditController, HOST_ADDR_ANY
-from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult, CoalescedResults
 
 logger = logging.getLogger('SSLCAuditCLI')
 
@@ -20,7 +20,8 @@ OUTPUT_FIELD_SEPARATOR = ' '
 class SSLCAuditCLI(object):
     def __init__(self, options, file_bag):
         self.options = options
-        self.controller = BaseClientAuditController(self.options, file_bag, event_handler=self.event_handler)
+        self.controller = BaseClientAuditController(self.options, file_bag)
+        self.controller.subscribe_batch(self.print_results)
 
     def run(self):
         # print config info to the console before running the controller
@@ -47,16 +48,26 @@ class SSLCAuditCLI(object):
     def stop(self):
         self.controller.stop()
 
-    def event_handler(self, res):
-        if isinstance(res, ConnectionAuditResult):
-            # dump:
-            # * client address and port,
-            # * server profile
-            # * result
-            # all in one line, in fixed width columns
-            fields = []
-            client_address = '%s:%d' % (res.conn.client_address)
-            fields.append('%-16s' % client_address)
-            fields.append('%-80s' % (res.profile))
-            fields.append(str(res.result))
-            print OUTPUT_FIELD_SEPARATOR.join(fields)
+    def print_results(self, events):
+        for event in events:
+            if isinstance(event, CoalescedResults):
+                logger.warn('event queue overflow, %d results not reported', event.count)
+
+        # write out the whole batch at once
+        lines = [self.format_result(res) for res in events if isinstance(res, ConnectionAuditResult)]
+        if len(lines) > 0:
+            sys.stdout.write(''.join(lines))
+            sys.stdout.flush()
+
+    def format_result(self, res):
+        # dump:
+        # * client address and port,
+        # * server profile
+        # * result
+        # all in one line, in fixed width columns
+        fields = []
+        client_address = '%s:%d' % (res.conn.client_address)
+        fields.append('%-16s' % client_address)
+        fields.append('%-80s' % (res.profile))
+        fields.append(str(res.result))
+        return OUTPUT_FIELD_SEPARATOR.join(fields) + '\n'
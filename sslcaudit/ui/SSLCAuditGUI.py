@@ -14,7 +14,8 @@ from PyQt4.QtCore import *
 from sslcaudit.core.BaseClientAuditController import BaseClientAuditController
 from sslcaudit.ui import SSLCAuditGUIGenerated
 from sslcaudit.modules.sslcert.ProfileFactory import DEFAULT_CN
-from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult, SessionStartEvent, ControllerEvent, SessionEndResult
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult, SessionStartEvent, ControllerEvent, SessionEndResult, \
+  CoalescedResults
 from sslcaudit.ui.ClientServerTestResultTreeTableModel import ClientServerTestResultTreeTableModel
 
 logger = logging.getLogger('SSLCAuditGUI')
@@ -199,6 +200,8 @@ class SSLCAuditGUIWindow(QMainWindow):
       self.cstr_ttm.new_conn_result(event.conn.get_session_id(), event.profile, event.result)
     elif isinstance(event, SessionEndResult):
       self.cstr_ttm.client_done(event.session_id, event.results)
+    elif isinstance(event, CoalescedResults):
+      logger.warn('event queue overflow, %d results not reported', event.count)
     else:
       raise ValueError('unexpected event: %s' % event)
 
@@ -6,9 +6,15 @@
 
 from exceptions import ValueError
 from optparse import OptionParser
-from sslcaudit.core import Utils, CFG_PTA_REPEAT, CFG_PTA_DROP, CFG_PTA_EXIT
+from sslcaudit.core import Utils, CFG_PTA_REPEAT, CFG_PTA_DROP, CFG_PTA_EXIT, CFG_ENGINE_THREADS, CFG_ENGINE_EPOLL
 from sslcaudit.core.BaseClientAuditController import PROG_NAME, PROG_VERSION
+from sslcaudit.core.CertCache import DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES
+from sslcaudit.core.CertFactory import DEFAULT_GRAB_TIMEOUT, DEFAULT_GRAB_RETRIES
 from sslcaudit.core.ConfigError import ConfigError
+from sslcaudit.core.EventQueue import EVENT_POLICIES, EVENT_WAIT, DEFAULT_EVENT_QUEUE_SIZE
+from sslcaudit.core.FileBag import DEFAULT_COMPRESS_THRESHOLD
+from sslcaudit.core.SessionTable import DEFAULT_MAX_SESSIONS
+from sslcaudit.core.WorkerPool import OVERFLOW_POLICIES, OVERFLOW_WAIT, DEFAULT_QUEUE_SIZE, DEFAULT_OVERFLOW_TIMEOUT
 from sslcaudit.ui.SSLCAuditCLI import DEFAULT_LISTEN_ON, DEFAULT_MODULES
 
 __author__ = 'abb'
@@ -39,13 +45,84 @@ def parse_options(argv):
         help="Post-test action: '%s', '%s', '%s' (default)." % (CFG_PTA_REPEAT, CFG_PTA_DROP, CFG_PTA_EXIT))
     parser.add_option("-N", dest="test_name",
         help="Set the name of the test. If specified will appear in the leftmost column in the output.")
+    parser.add_option("--async-filebag", dest="async_file_bag", action="store_true", default=False,
+        help="Save captured client requests in background, in batches synced to disk together, instead of making "
+        + "connections wait for the disk.")
+    parser.add_option("--filebag-archive", dest="file_bag_archive", action="store_true", default=False,
+        help="Append captured client requests to a few large segment files with an index, instead of saving each "
+        + "one in a file of its own.")
+    parser.add_option("--filebag-dedup", dest="file_bag_dedup", action="store_true", default=False,
+        help="Save each distinct captured client request once, the results of the connections sending the same "
+        + "request point at the same copy.")
+    parser.add_option("--filebag-compress", type='int', dest="file_bag_compress_level",
+        help="Compress captured client requests and certificate dumps with zlib at given level, 1 (fastest) to 9 "
+        + "(best). By default nothing gets compressed.")
+    parser.add_option("--filebag-compress-threshold", type='int', dest="file_bag_compress_threshold",
+        default=DEFAULT_COMPRESS_THRESHOLD,
+        help="Do not compress pieces of data shorter than that many bytes. Default is %d." % DEFAULT_COMPRESS_THRESHOLD)
     parser.add_option('-T', type='int', dest='self_test', default=0,
         help='Launch self-test. 1 - plain TCP client, 2 - CN verifying client, 3 - curl (requires --user-ca-cert/key).')
 
+    parser.add_option("--engine", dest="engine", default=CFG_ENGINE_THREADS,
+        help="How to wait for client connections: '%s' blocks a thread per connection (default), '%s' multiplexes "
+             % (CFG_ENGINE_THREADS, CFG_ENGINE_EPOLL) + "them over a few event loops.")
+    parser.add_option("--event-loops", type='int', dest="nevent_loops", default=1,
+        help="Number of event loop threads in '%s' mode. Default is 1." % CFG_ENGINE_EPOLL)
+    parser.add_option("--workers", type='int', dest="nworkers", default=0,
+        help="Handle connections with a pool of that many worker threads. Default is 0, which means a new thread is "
+             + "started for each connection. In '%s' mode the pool runs modules lacking non-blocking handlers."
+             % CFG_ENGINE_EPOLL)
+    parser.add_option("--accept-queue", type='int', dest="accept_queue_size", default=DEFAULT_QUEUE_SIZE,
+        help="Maximum number of accepted connections waiting for a free worker. Default is %d." % DEFAULT_QUEUE_SIZE)
+    parser.add_option("--overflow", dest="overflow_policy", default=OVERFLOW_WAIT,
+        help="What to do with a new connection if the accept queue is full: '%s' it right away or '%s' "
+             % OVERFLOW_POLICIES + "for a free slot up to --overflow-timeout seconds (default).")
+    parser.add_option("--overflow-timeout", type='float', dest="overflow_timeout", default=DEFAULT_OVERFLOW_TIMEOUT,
+        help="How long to wait for a free slot in the accept queue. Default is %.1fs." % DEFAULT_OVERFLOW_TIMEOUT)
+    parser.add_option("--processes", type='int', dest="nprocesses", default=1,
+        help="Number of processes listening on the same port (with SO_REUSEPORT), each applying --engine and "
+             + "--workers settings on its own. Each client IP address is handled by one of them. Default is 1.")
+
+    parser.add_option("--event-queue", type='int', dest="event_queue_size", default=DEFAULT_EVENT_QUEUE_SIZE,
+        help="Maximum number of events waiting to be reported. Default is %d, 0 means no limit."
+             % DEFAULT_EVENT_QUEUE_SIZE)
+    parser.add_option("--result-overflow", dest="result_overflow_policy", default=EVENT_WAIT,
+        help="What to do with the result of a connection if the event queue is full: '%s' for room (default), "
+             % EVENT_POLICIES[0] + "'%s' it, or '%s' it into a count. Session start and end events always wait."
+             % EVENT_POLICIES[1:])
+    parser.add_option("--max-sessions", type='int', dest="max_sessions", default=DEFAULT_MAX_SESSIONS,
+        help="Maximum number of client sessions to keep track of, the least recently seen ones get dropped to make "
+             + "room for new ones. Default is %d, 0 means no limit." % DEFAULT_MAX_SESSIONS)
+    parser.add_option("--session-ttl", type='float', dest="session_ttl",
+        help="Drop client sessions idle for that many seconds. Dropped sessions report partial results, a client "
+             + "coming back starts over. By default sessions never expire.")
+    parser.add_option("--key-pool", type='int', dest="key_pool_size", default=0,
+        help="Keep that many RSA keys of each size pre-generated by background processes. Default is 0, which means "
+             + "keys are generated when needed.")
+
+    parser.add_option("--cert-cache-dir", dest="cert_cache_dir", default=DEFAULT_CACHE_DIR,
+        help="Where to keep generated certificates and keys for reuse in later runs. Default is %s." % DEFAULT_CACHE_DIR)
+    parser.add_option("--cert-cache-size", type='int', dest="cert_cache_size", default=DEFAULT_MAX_ENTRIES,
+        help="Maximum number of certificates in the cache, least recently used ones get removed. Default is %d."
+             % DEFAULT_MAX_ENTRIES)
+    parser.add_option("--no-cert-cache", dest="no_cert_cache", action="store_true", default=False,
+        help="Do not use certificate cache, generate all certificates from scratch.")
+
     parser.add_option("--user-cn", dest="user_cn",
         help="Set user-specified CN.")
     parser.add_option("--server", dest="server",
         help="Where to fetch the server certificate from, in HOST:PORT format.")
+    parser.add_option("--servers-file", dest="servers_file",
+        help="Fetch server certificates from each server listed in the file, one HOST:PORT per line, and replicate "
+        + "them all. The servers are contacted in parallel, the ones which fail to respond are skipped.")
+    parser.add_option("--server-timeout", type='float', dest="server_timeout", default=DEFAULT_GRAB_TIMEOUT,
+        help="How long to wait for a server, in seconds, when fetching its certificate. Applies to connecting and "
+        + "to each step of the handshake. Default is %.0f." % DEFAULT_GRAB_TIMEOUT)
+    parser.add_option("--server-retries", type='int', dest="server_retries", default=DEFAULT_GRAB_RETRIES,
+        help="How many times to retry fetching the certificate of a server. Default is %d." % DEFAULT_GRAB_RETRIES)
+    parser.add_option("--replicate-dst", action="store_true", default=False, dest="server_use_orig_dest",
+        help="In transparent proxy mode, also present replicas of the certificate of the server each client was "
+        + "connecting to. The certificates get fetched on the fly, the first time a destination is seen.")
     parser.add_option("--user-cert", dest="user_cert_file",
         help="Set path to file containing the user-supplied certificate.")
     parser.add_option("--user-key", dest="user_key_file",
@@ -72,7 +149,10 @@ def parse_options(argv):
     # but this will introduce an unwanted dependency here. not sure how to do it properly.
     parser.add_option("--ciphers", dest="ciphers",
         help="Comma-separated list of ciphers to try. OpenSSL-style cipher string specification is supported. "
-        "Default: HIGH:MEDIUM:LOW:EXPORT. Specify 'ITERATE' for built-in long list of ciphers, per protocol.")
+        "Default: HIGH:MEDIUM:LOW:EXPORT. Specify 'ITERATE' for built-in long list of ciphers, per protocol. "
+        "Specify 'HELLO' to list the protocols and ciphers offered by the client in its ClientHello instead, "
+        "in a single connection. Specify 'BISECT' to find out which ciphers of the built-in long list the client "
+        "accepts by offering them in groups, using fewer connections than ITERATE.")
 
     (options, args) = parser.parse_args(argv)
     if len(args) > 0:
@@ -91,10 +171,72 @@ def parse_options(argv):
         except ValueError as ex:
             raise ConfigError("invalid value for --server parameter, exception: %s" % ex)
 
+    # load the list of servers
+    if options.servers_file is not None:
+        try:
+            options.servers = Utils.parse_hostport_file(options.servers_file)
+        except (IOError, ValueError) as ex:
+            raise ConfigError("invalid value for --servers-file parameter, exception: %s" % ex)
+    else:
+        options.servers = []
+
+    if options.async_file_bag and options.file_bag_archive:
+        raise ConfigError('--async-filebag and --filebag-archive cannot be used together')
+
+    if options.file_bag_compress_level is not None and not 1 <= options.file_bag_compress_level <= 9:
+        raise ConfigError('invalid value for --filebag-compress parameter, must be between 1 and 9')
+
+    if options.file_bag_compress_threshold < 0:
+        raise ConfigError('invalid value for --filebag-compress-threshold parameter, must not be negative')
+
+    if options.server_timeout <= 0:
+        raise ConfigError('invalid value for --server-timeout parameter, must be positive')
+
+    if options.server_retries < 0:
+        raise ConfigError('invalid value for --server-retries parameter, must not be negative')
+
     if ((options.post_test_action != CFG_PTA_REPEAT) and
         (options.post_test_action != CFG_PTA_DROP) and
         (options.post_test_action != CFG_PTA_EXIT)):
         raise ConfigError('invalid value for post-test-action (-a) parameter, accepted values: %s, %s, and %s'
         % (CFG_PTA_REPEAT, CFG_PTA_DROP, CFG_PTA_EXIT))
 
+    if options.engine != CFG_ENGINE_THREADS and options.engine != CFG_ENGINE_EPOLL:
+        raise ConfigError('invalid value for --engine parameter, accepted values: %s and %s'
+        % (CFG_ENGINE_THREADS, CFG_ENGINE_EPOLL))
+
+    if options.nevent_loops < 1:
+        raise ConfigError('invalid value for --event-loops parameter, must be positive')
+
+    if options.nworkers < 0:
+        raise ConfigError('invalid value for --workers parameter, must not be negative')
+
+    if options.key_pool_size < 0:
+        raise ConfigError('invalid value for --key-pool parameter, must not be negative')
+
+    if options.cert_cache_size < 1:
+        raise ConfigError('invalid value for --cert-cache-size parameter, must be positive')
+
+    if options.nprocesses < 1:
+        raise ConfigError('invalid value for --processes parameter, must be positive')
+
+    if options.accept_queue_size < 1:
+        raise ConfigError('invalid value for --accept-queue parameter, must be positive')
+
+    if options.overflow_policy not in OVERFLOW_POLICIES:
+        raise ConfigError('invalid value for --overflow parameter, accepted values: %s' % ', '.join(OVERFLOW_POLICIES))
+
+    if options.max_sessions < 0:
+        raise ConfigError('invalid value for --max-sessions parameter, must not be negative')
+
+    if options.session_ttl is not None and options.session_ttl <= 0:
+        raise ConfigError('invalid value for --session-ttl parameter, must be positive')
+
+    if options.event_queue_size < 0:
+        raise ConfigError('invalid value for --event-queue parameter, must not be negative')
+
+    if options.result_overflow_policy not in EVENT_POLICIES:
+        raise ConfigError('invalid value for --result-overflow parameter, accepted values: %s'
+            % ', '.join(EVENT_POLICIES))
+
     return options
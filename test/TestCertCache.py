@@ -0,0 +1,54 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import os, tempfile
+import unittest
+from sslcaudit.core.CertCache import CertCache
+from sslcaudit.core.CertFactory import CertFactory, CERT_FILE_SUFFIX, SELFSIGNED
+from sslcaudit.core.FileBag import FileBag
+from sslcaudit.test.TestConfig import *
+
+class TestCertCache(unittest.TestCase):
+    def setUp(self):
+        self.file_bag = FileBag('testcertcache', use_tempdir=True)
+        self.cert_factory = CertFactory(self.file_bag)
+        self.cache_dir = tempfile.mkdtemp(prefix='testcertcache')
+
+    def mk_certnkey(self, cn):
+        return self.cert_factory.sign_cert_req(self.cert_factory.mk_certreq_n_keys(cn), None)
+
+    def test_hit(self):
+        cache = CertCache(self.file_bag, self.cache_dir, 10)
+        certnkey1 = cache.get('id1', lambda: self.mk_certnkey(TEST_USER_CN))
+        certnkey2 = cache.get('id1', lambda: self.fail('cached entry got regenerated'))
+
+        self.assertEqual(certnkey1.cert.as_pem(), certnkey2.cert.as_pem())
+        self.assertEqual((TEST_USER_CN, SELFSIGNED), certnkey2.name)
+        self.assertEqual({'hits': 1, 'misses': 1}, cache.get_stats())
+
+    def test_hit_survives_eviction(self):
+        cache = CertCache(self.file_bag, self.cache_dir, 10)
+        cache.get('id1', lambda: self.mk_certnkey(TEST_USER_CN))
+        certnkey = cache.get('id1', lambda: self.fail('cached entry got regenerated'))
+
+        # the files handed out belong to this run, another run evicting the entry does not affect them
+        self.assertEqual(self.file_bag.base_dir, os.path.dirname(certnkey.cert_filename))
+        self.assertEqual(self.file_bag.base_dir, os.path.dirname(certnkey.key_filename))
+        for name in os.listdir(self.cache_dir):
+            os.unlink(os.path.join(self.cache_dir, name))
+        self.assertTrue(os.path.exists(certnkey.cert_filename))
+        self.assertTrue(os.path.exists(certnkey.key_filename))
+
+    def test_eviction(self):
+        cache = CertCache(self.file_bag, self.cache_dir, 1)
+        cache.get('id1', lambda: self.mk_certnkey(TEST_USER_CN))
+        cache.get('id2', lambda: self.mk_certnkey(TEST_USER_CN))
+
+        cert_files = [name for name in os.listdir(self.cache_dir) if name.endswith(CERT_FILE_SUFFIX)]
+        self.assertEqual(1, len(cert_files))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,13 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
+import socket
 import tempfile
+import time
 
 import unittest
 from sslcaudit.core.CertFactory import *
+from sslcaudit.core.KeyPool import KeyPool
 from sslcaudit.core.FileBag import FileBag
 from sslcaudit.test.TestConfig import *
 
@@ -76,5 +79,42 @@ class TestCertFactory(unittest.TestCase):
         # check CN of server certificate
         self.assertEqual(server_cert.get_subject().CN, TEST_SERVER_CN)
 
+    def test__grab_server_x509_certs(self):
+        # a server accepting connections but never completing the handshake
+        silent_server = socket.socket()
+        silent_server.bind(('127.0.0.1', 0))
+        silent_server.listen(5)
+        try:
+            servers = [(TEST_SERVER_HOST, TEST_SERVER_PORT), silent_server.getsockname()]
+            start_time = time.time()
+            results = self.cert_factory.grab_server_x509_certs(servers, SSL_PROTO, timeout=1, retries=0)
+            self.assertTrue(time.time() - start_time < 5)
+        finally:
+            silent_server.close()
+
+        self.assertEqual(TEST_SERVER_CN, results[0][1].get_subject().CN)
+        self.assertEqual(None, results[1][1])
+        self.assertTrue(results[1][2] is not None)
+
+    def test__key_pool(self):
+        key_pool = KeyPool(2, nprocesses=1)
+        try:
+            key_pool.prefill(DEFAULT_BITS)
+            # wait for the background process to generate the keys
+            for _ in range(100):
+                if key_pool.get_stats()['spare'][DEFAULT_BITS] == 2:
+                    break
+                time.sleep(0.1)
+
+            cert_factory = CertFactory(self.file_bag, key_pool)
+            certreq = cert_factory.mk_certreq_n_keys(TEST_USER_CN)
+            self.assertEqual(DEFAULT_BITS, len(certreq[2]))
+
+            stats = key_pool.get_stats()
+            self.assertEqual(1, stats['hits'])
+            self.assertEqual(0, stats['misses'])
+        finally:
+            key_pool.stop()
+
 if __name__ == '__main__':
     unittest.main()
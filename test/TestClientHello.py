@@ -0,0 +1,71 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import struct
+import unittest
+from sslcaudit.modules.sslproto.ClientHello import parse_client_hello, ClientHelloError, IncompleteClientHello
+
+def mk_vector(len_size, data):
+    return struct.pack('>I', len(data))[4 - len_size:] + data
+
+def mk_client_hello_body(suites, extensions=None):
+    body = struct.pack('>H', 0x0303) + 'r' * 32 + mk_vector(1, '') \
+        + mk_vector(2, struct.pack('>%dH' % len(suites), *suites)) + mk_vector(1, '\x00')
+    if extensions is not None:
+        body += mk_vector(2, ''.join(struct.pack('>H', ext_type) + mk_vector(2, data) for (ext_type, data) in extensions))
+    return body
+
+def mk_records(handshake, fragment_size=16384):
+    return ''.join(struct.pack('>BHH', 0x16, 0x0301, len(handshake[i:i + fragment_size])) + handshake[i:i + fragment_size]
+                   for i in range(0, len(handshake), fragment_size))
+
+def mk_handshake(body):
+    return struct.pack('>B', 1) + struct.pack('>I', len(body))[1:] + body
+
+class TestClientHello(unittest.TestCase):
+    def test_tls(self):
+        sni = mk_vector(2, '\x00' + mk_vector(2, 'www.example.com'))
+        versions = mk_vector(1, struct.pack('>HH', 0x0304, 0x0303))
+        body = mk_client_hello_body([0xc02f, 0x002f, 0xabcd], [(0x0000, sni), (0x002b, versions), (0x0017, '')])
+        hello = parse_client_hello(mk_records(mk_handshake(body)))
+
+        self.assertFalse(hello.sslv2)
+        self.assertEqual(0x0303, hello.version)
+        self.assertEqual([0x0304, 0x0303], hello.get_versions())
+        self.assertEqual(['ECDHE-RSA-AES128-GCM-SHA256', 'AES128-SHA', '0xabcd'], hello.get_suite_names())
+        self.assertEqual(['server_name', 'supported_versions', 'extended_master_secret'], hello.get_extension_names())
+        self.assertEqual('www.example.com', hello.server_name)
+
+    def test_no_extensions(self):
+        hello = parse_client_hello(mk_records(mk_handshake(mk_client_hello_body([0x0005]))))
+        self.assertEqual([0x0303], hello.get_versions())
+        self.assertEqual([], hello.extensions)
+
+    def test_fragmented(self):
+        handshake = mk_handshake(mk_client_hello_body(range(1, 100)))
+        data = mk_records(handshake, fragment_size=50)
+        self.assertEqual(range(1, 100), parse_client_hello(data).cipher_suites)
+
+        # any prefix is just incomplete
+        for size in (0, 3, 5, 60, len(data) - 1):
+            self.assertRaises(IncompleteClientHello, parse_client_hello, data[:size])
+
+    def test_sslv2(self):
+        specs = '\x01\x00\x80' + '\x00\x00\x2f'
+        msg = struct.pack('>BHHHH', 1, 0x0301, len(specs), 0, 16) + specs + 'c' * 16
+        hello = parse_client_hello(struct.pack('>H', 0x8000 | len(msg)) + msg)
+
+        self.assertTrue(hello.sslv2)
+        self.assertEqual(['RC4-MD5', 'AES128-SHA'], hello.get_suite_names())
+
+    def test_garbage(self):
+        self.assertRaises(ClientHelloError, parse_client_hello, 'GET / HTTP/1.0\r\n\r\n')
+        # ServerHello instead of ClientHello
+        self.assertRaises(ClientHelloError, parse_client_hello,
+            mk_records('\x02' + mk_handshake(mk_client_hello_body([1]))[1:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import socket, threading
+import unittest
+from sslcaudit.core.ClientConnection import ClientConnection
+from sslcaudit.core.ConnectionEngine import ConnectionEngine, ConnectionTask
+from sslcaudit.modules.base.BaseServerHandler import BaseServerHandler
+
+TASK_TIMEOUT = 0.5
+
+class LineTask(ConnectionTask):
+    '''
+    Waits for the client to send a line, returns it or 'timeout'.
+    '''
+
+    def start(self):
+        self.data = ''
+        self.set_timeout(TASK_TIMEOUT)
+        return None
+
+    def on_readable(self):
+        chunk = self.conn.sock.recv(1024)
+        if len(chunk) == 0:
+            return 'eof'
+        self.data += chunk
+        if self.data.endswith('\n'):
+            return self.data.strip()
+        return None
+
+    def on_timeout(self):
+        return 'timeout'
+
+    def on_error(self, ex):
+        return str(ex)
+
+
+class FailingTask(LineTask):
+    '''
+    Fails on the first data, and so does its error handler.
+    '''
+
+    def on_readable(self):
+        raise IOError('failed to read')
+
+    def on_error(self, ex):
+        raise ValueError('failed to handle %s' % ex)
+
+
+class FailingHandler(BaseServerHandler):
+    def mk_task(self, conn, profile, file_bag):
+        return FailingTask(conn, profile)
+
+
+class LineHandler(BaseServerHandler):
+    def mk_task(self, conn, profile, file_bag):
+        return LineTask(conn, profile)
+
+
+class BlockingHandler(BaseServerHandler):
+    def handle(self, conn, profile, file_bag):
+        return 'blocking'
+
+
+class TestConnectionEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = ConnectionEngine(nloops=2)
+        self.engine.start()
+        self.results = []
+        self.done = threading.Event()
+
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+
+    def tearDown(self):
+        self.engine.stop()
+        self.listener.close()
+
+    def callback(self, res):
+        self.results.append(res)
+        self.done.set()
+
+    def submit(self, handler):
+        client = socket.create_connection(self.listener.getsockname())
+        (sock, client_address) = self.listener.accept()
+        self.assertTrue(self.engine.submit(handler, ClientConnection(sock, client_address), None, None, self.callback))
+        return (client, sock)
+
+    def test_stop_with_task_in_flight(self):
+        (client, sock) = self.submit(LineHandler())
+        self.engine.stop()
+
+        # the task waiting for its deadline is finished with None
+        self.done.wait(5)
+        self.assertEqual([None], self.results)
+
+        # no more tasks are accepted, neither right after stop() nor once the loops are gone
+        for loop in self.engine.loops:
+            loop.join(5)
+        client2 = socket.create_connection(self.listener.getsockname())
+        (sock2, client_address) = self.listener.accept()
+        self.assertFalse(self.engine.submit(LineHandler(), ClientConnection(sock2, client_address), None, None,
+            self.callback))
+        self.assertEqual([None], self.results)
+        for s in (client, sock, client2, sock2):
+            s.close()
+
+    def test_failing_error_handler(self):
+        (client1, sock1) = self.submit(FailingHandler())
+        client1.sendall('x')
+        self.done.wait(5)
+        self.assertEqual([None], self.results)
+
+        # the loop goes on
+        self.done.clear()
+        (client2, sock2) = self.submit(LineHandler())
+        client2.sendall('hello\n')
+        self.done.wait(5)
+        self.assertEqual([None, 'hello'], self.results)
+        for s in (client1, sock1, client2, sock2):
+            s.close()
+
+    def test_task_gets_data(self):
+        (client, sock) = self.submit(LineHandler())
+        client.sendall('hel')
+        client.sendall('lo\n')
+        self.done.wait(5)
+        self.assertEqual(self.results, ['hello'])
+
+    def test_task_times_out(self):
+        (client, sock) = self.submit(LineHandler())
+        self.done.wait(5)
+        self.assertEqual(self.results, ['timeout'])
+
+    def test_blocking_handler_shim(self):
+        (client, sock) = self.submit(BlockingHandler())
+        self.done.wait(5)
+        self.assertEqual(self.results, ['blocking'])
+
+    def test_ssl_handshake_stall(self):
+        # the SSL handler needs M2Crypto, unlike the rest of this test case
+        from sslcaudit.core.CertFactory import CertFactory
+        from sslcaudit.core.FileBag import FileBag
+        from sslcaudit.modules.sslcert.ProfileFactory import SSLServerCertProfile, SSLProfileSpec_UserSupplied
+        from sslcaudit.modules.sslcert.SSLServerHandler import SSLServerHandler
+        from sslcaudit.test.TestConfig import TEST_USER_CERT_FILE, TEST_USER_KEY_FILE, TEST_USER_CERT_CN
+
+        certnkey = CertFactory(FileBag('testconnectionengine', use_tempdir=True)).load_certnkey_files(
+            TEST_USER_CERT_FILE, TEST_USER_KEY_FILE)
+        profile = SSLServerCertProfile(SSLProfileSpec_UserSupplied(TEST_USER_CERT_CN), certnkey)
+        handler = SSLServerHandler('sslv23')
+        handler.sock_read_timeout = 1
+
+        # the client sends the beginning of a TLS record and stalls
+        partial_hello = '\x16\x03\x01\x00\x40\x01'
+
+        # the blocking handler
+        client = socket.create_connection(self.listener.getsockname())
+        (sock, client_address) = self.listener.accept()
+        client.sendall(partial_hello)
+        blocking_res = handler.handle(ClientConnection(sock, client_address), profile, None)
+
+        # the same client handled by the engine
+        (client, sock) = self.submit(handler)
+        client.sendall(partial_hello)
+        self.done.wait(5)
+
+        self.assertEqual('SSL_ERROR_WANT_READ', blocking_res.result)
+        self.assertEqual(blocking_res.result, self.results[0].result)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import unittest
+from sslcaudit.core.ContextCache import ContextCache
+
+class TestContextCache(unittest.TestCase):
+    def test_reuse(self):
+        cache = ContextCache()
+        ctx1 = cache.get('a', object)
+        ctx2 = cache.get('a', lambda: self.fail('cached context got rebuilt'))
+        self.assertTrue(ctx1 is ctx2)
+        self.assertFalse(ctx1 is cache.get('b', object))
+
+    def test_lru_eviction(self):
+        cache = ContextCache(max_entries=2)
+        ctx_a = cache.get('a', object)
+        cache.get('b', object)
+        # 'a' becomes the most recently used one, 'b' gets evicted by 'c'
+        cache.get('a', object)
+        cache.get('c', object)
+
+        self.assertEqual(2, len(cache))
+        self.assertTrue(ctx_a is cache.get('a', object))
+        self.assertEqual(['c', 'a'], cache.entries.keys())
+
+    def test_failure_not_cached(self):
+        cache = ContextCache()
+
+        def fail():
+            raise ValueError('bad cipher list')
+
+        self.assertRaises(ValueError, cache.get, 'a', fail)
+        self.assertEqual(0, len(cache))
+        self.assertEqual('ok', cache.get('a', lambda: 'ok'))
+
+if __name__ == '__main__':
+    unittest.main()
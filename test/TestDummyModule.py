@@ -54,7 +54,7 @@ class TestDummyModule(unittest.TestCase):
         self.hammer = TCPConnectionHammer(self.HAMMER_ATTEMPTS)
 
         # create main, the target of the test
-        main_args = ['-m', 'dummy', '-l', ("%s:%d" % (TEST_LISTENER_ADDR, port))]
+        main_args = ['-m', 'dummy', '-l', ("%s:%d" % (TEST_LISTENER_ADDR, port)), '--no-cert-cache']
         options = SSLCAuditUI.parse_options(main_args)
         file_bag = FileBag(basename='test-sslcaudit', use_tempdir=True)
         controller = BaseClientAuditController(options, file_bag, event_handler=main__handle_result)
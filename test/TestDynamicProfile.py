@@ -0,0 +1,166 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import unittest
+from Queue import Queue
+from threading import Thread
+from sslcaudit.core import CFG_PTA_EXIT, CFG_PTA_REPEAT
+from sslcaudit.core.ClientConnection import ClientConnection
+from sslcaudit.core.ClientServerSessionHandler import ClientServerSessionHandler, PROFILE_PENDING
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult, SessionStartEvent, SessionEndResult
+from sslcaudit.modules.base.BaseProfileFactory import BaseProfile, BaseDynamicProfile
+from sslcaudit.modules.base.BaseServerHandler import BaseServerHandler
+
+class EchoHandler(BaseServerHandler):
+    def handle(self, conn, profile, file_bag):
+        return ConnectionAuditResult(conn, profile, profile.value)
+
+echo_handler = EchoHandler()
+
+class ValueProfile(BaseProfile):
+    def __init__(self, value):
+        self.value = value
+
+    def get_handler(self):
+        return echo_handler
+
+class CountdownProfile(BaseDynamicProfile):
+    '''
+    Hands out one profile at a time, the next one only after the result of the previous one has arrived.
+    '''
+    def __init__(self, n):
+        self.n = n
+        self.left = n
+        self.pending = None
+        self.results = []
+
+    def mk_session_instance(self):
+        return CountdownProfile(self.n)
+
+    def next_profile(self):
+        if self.left == 0 or self.pending is not None:
+            return None
+        self.left -= 1
+        self.pending = ValueProfile(self.left)
+        return self.pending
+
+    def add_result(self, profile, res):
+        assert profile is self.pending
+        self.pending = None
+        self.results.append(res.result)
+
+    def is_done(self):
+        return self.left == 0 and self.pending is None
+
+    def get_summary(self):
+        return self.results
+
+
+def mk_conn(port):
+    return ClientConnection(None, ('10.0.0.1', port), ('127.0.0.1', 8443))
+
+class RecordingEngine(object):
+    '''
+    Stands in for ConnectionEngine, records the connections handed over to it.
+    '''
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, handler, conn, profile, file_bag, callback):
+        self.submitted.append((conn, profile, callback))
+        return True
+
+class TestDynamicProfile(unittest.TestCase):
+    def test_session(self):
+        template = CountdownProfile(2)
+        res_queue = Queue()
+        handler = ClientServerSessionHandler('s', [ValueProfile('a'), template, ValueProfile('b')], CFG_PTA_EXIT,
+            res_queue, None)
+
+        # the session works with its own instance of the dynamic profile
+        self.assertTrue(handler.profiles[1] is template)
+        self.assertFalse(handler.dynamic_profiles[1] is template)
+
+        # hold the second connection of the dynamic profile while the first one is in progress
+        (conn1, conn2) = (mk_conn(1), mk_conn(2))
+        self.assertEqual((0, False), handler.next_profile(conn1)[:2])
+        (profile_index, excess, profile) = handler.next_profile(conn2)
+        self.assertEqual((1, False, 1), (profile_index, excess, profile.value))
+        self.assertEqual(PROFILE_PENDING, handler.next_profile(mk_conn(3)))
+        handler.record_result(conn2, profile, profile_index, excess, ConnectionAuditResult(conn2, profile, 1))
+
+        handler.handle(mk_conn(4))
+        handler.handle(mk_conn(5))
+        handler.handle(mk_conn(6))
+        self.assertEqual(None, handler.next_profile(mk_conn(7)))
+        handler.record_result(conn1, handler.profiles[0], 0, False,
+            ConnectionAuditResult(conn1, handler.profiles[0], 'a'))
+
+        events = []
+        while not res_queue.empty():
+            events.append(res_queue.get())
+
+        self.assertTrue(isinstance(events[0], SessionStartEvent))
+        self.assertEqual([1, 0, [1, 0], 'b', 'a'], [res.result for res in events[1:-1]])
+        self.assertTrue(events[3].profile is template)
+        self.assertTrue(isinstance(events[-1], SessionEndResult))
+        self.assertEqual(5, len(events[-1].results))
+
+    def test_park(self):
+        handler = ClientServerSessionHandler('s', [CountdownProfile(2)], CFG_PTA_EXIT, Queue(), None)
+        conn1 = mk_conn(1)
+        (profile_index, excess, profile) = handler.next_profile(conn1)
+
+        # the second connection waits for the result of the first one instead of being dropped
+        waiter = Thread(target=handler.handle, args=(mk_conn(2),))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertTrue(waiter.is_alive())
+
+        handler.record_result(conn1, profile, profile_index, excess, ConnectionAuditResult(conn1, profile, 1))
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertTrue(handler.finished)
+        self.assertEqual(['1', '0', '[1, 0]'], [res.result for res in handler.result.results])
+
+    def test_park_timeout(self):
+        handler = ClientServerSessionHandler('s', [CountdownProfile(2)], CFG_PTA_EXIT, Queue(), None)
+        handler.park_timeout = 0.1
+        handler.next_profile(mk_conn(1))
+
+        handler.handle(mk_conn(2))
+        self.assertEqual([], handler.result.results)
+
+    def test_park_async(self):
+        handler = ClientServerSessionHandler('s', [CountdownProfile(2)], CFG_PTA_EXIT, Queue(), None)
+        engine = RecordingEngine()
+        done = []
+
+        self.assertTrue(handler.handle_async(mk_conn(1), engine, lambda: done.append(1)))
+        self.assertTrue(handler.handle_async(mk_conn(2), engine, lambda: done.append(2)))
+        self.assertTrue(handler.handle_async(mk_conn(3), engine, lambda: done.append(3)))
+        self.assertEqual(1, len(engine.submitted))
+
+        # the result of the first connection lets one of the parked ones go, the other one waits for the next result
+        (conn, profile, callback) = engine.submitted[0]
+        callback(ConnectionAuditResult(conn, profile, 1))
+        self.assertEqual(2, len(engine.submitted))
+        self.assertEqual([1], done)
+
+        # once the dynamic profile is done, the last one gets dropped
+        (conn, profile, callback) = engine.submitted[1]
+        callback(ConnectionAuditResult(conn, profile, 0))
+        self.assertEqual(2, len(engine.submitted))
+        self.assertEqual([1, 3, 2], done)
+        self.assertTrue(handler.finished)
+
+    def test_repeat_nothing_used(self):
+        # a dynamic profile with nothing to offer, in PTA_REPEAT mode there are no used profiles to go over
+        handler = ClientServerSessionHandler('s', [CountdownProfile(0)], CFG_PTA_REPEAT, Queue(), None)
+        self.assertEqual(None, handler.next_profile(mk_conn(1)))
+
+if __name__ == '__main__':
+    unittest.main()
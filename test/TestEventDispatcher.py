@@ -0,0 +1,65 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import unittest, time
+from Queue import Queue
+from threading import Thread
+from sslcaudit.core.EventDispatcher import EventDispatcher
+
+class TestEventDispatcher(unittest.TestCase):
+    def test_batches(self):
+        queue = Queue()
+        dispatcher = EventDispatcher(queue, max_batch=3)
+        batches = []
+        events = []
+        dispatcher.subscribe_batch(batches.append)
+        dispatcher.subscribe(events.append)
+
+        for i in range(5):
+            queue.put(i)
+        self.assertEqual(([0, 1, 2], False), dispatcher.next_batch())
+        dispatcher.dispatch([0, 1, 2])
+        dispatcher.dispatch(dispatcher.next_batch()[0])
+        self.assertEqual(0, queue.qsize())
+
+        self.assertEqual([[0, 1, 2], [3, 4]], batches)
+        self.assertEqual(range(5), events)
+
+    def test_failing_subscriber(self):
+        dispatcher = EventDispatcher(Queue())
+        events = []
+
+        def fail(event):
+            raise ValueError('broken subscriber')
+
+        dispatcher.subscribe(fail)
+        dispatcher.subscribe(events.append)
+        dispatcher.dispatch(['a', 'b'])
+        self.assertEqual(['a', 'b'], events)
+
+    def test_stop(self):
+        queue = Queue()
+        dispatcher = EventDispatcher(queue)
+        events = []
+        dispatcher.subscribe(events.append)
+
+        thread = Thread(target=dispatcher.run)
+        thread.start()
+        queue.put('a')
+
+        start_time = time.time()
+        dispatcher.stop()
+        queue.put('b')
+        thread.join(1.0)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(time.time() - start_time < 0.5)
+
+        # the events queued before the stop get delivered, the ones queued after it do not
+        self.assertEqual(['a'], events)
+        self.assertEqual('b', queue.get_nowait())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import unittest
+from Queue import Full
+from sslcaudit.core.ClientConnection import ClientConnection
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult, SessionEndResult, CoalescedResults
+from sslcaudit.core.EventDispatcher import StopDispatch
+from sslcaudit.core.EventQueue import EventQueue, EVENT_DROP, EVENT_COALESCE
+
+def mk_result(client_ip):
+    return ConnectionAuditResult(ClientConnection(None, (client_ip, 1234), ('127.0.0.1', 8443)), None, 'res')
+
+class TestEventQueue(unittest.TestCase):
+    def test_drop(self):
+        queue = EventQueue(2, {ConnectionAuditResult: EVENT_DROP})
+        for i in range(4):
+            queue.put(mk_result('10.0.0.1'))
+
+        self.assertEqual(2, queue.qsize())
+        self.assertEqual({'ConnectionAuditResult': 2}, queue.get_stats()['dropped'])
+
+        # other events still wait for room
+        self.assertRaises(Full, queue.put, SessionEndResult('s'), True, 0.01)
+
+    def test_coalesce(self):
+        queue = EventQueue(1, {ConnectionAuditResult: EVENT_COALESCE})
+        first = mk_result('10.0.0.1')
+        queue.put(first)
+        queue.put(mk_result('10.0.0.1'))
+        queue.put(mk_result('10.0.0.2'))
+        queue.put(mk_result('10.0.0.2'))
+
+        # the queue grows by a single coalesced event
+        self.assertEqual(2, queue.qsize())
+        self.assertTrue(queue.get() is first)
+        coalesced = queue.get()
+        self.assertTrue(isinstance(coalesced, CoalescedResults))
+        self.assertEqual(3, coalesced.count)
+        self.assertEqual({'10.0.0.1': 1, '10.0.0.2': 2}, coalesced.counts)
+
+        # once the coalesced event is taken off the queue, the next overflow starts another one
+        queue.put(mk_result('10.0.0.1'))
+        queue.put(mk_result('10.0.0.1'))
+        queue.get()
+        self.assertFalse(queue.get() is coalesced)
+        self.assertEqual({'ConnectionAuditResult': 4}, queue.get_stats()['coalesced'])
+
+    def test_stop_always_queued(self):
+        queue = EventQueue(1)
+        queue.put(SessionEndResult('s'))
+        queue.put(StopDispatch())
+        self.assertEqual(2, queue.qsize())
+        self.assertEqual(2, queue.get_stats()['max_depth'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,8 +4,8 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
-import unittest, tempfile
-from sslcaudit.core.FileBag import FileBag
+import errno, os, time, unittest, tempfile
+from sslcaudit.core.FileBag import FileBag, AsyncFileBag, SegmentFileBag, REV_FILE_SUFFIX, prune_file_bags
 
 class TestFileBag(unittest.TestCase):
     def setUp(self):
@@ -25,5 +25,142 @@ class TestFileBag(unittest.TestCase):
         f2.write('blah2')
         f2.close()
 
+    def test__store_two(self):
+        (name1, name2) = self.file_bag.store_two('.bar1', 'blah1', '.bar2', 'blah2')
+        self.assertEqual(name1[:-len('.bar1')], name2[:-len('.bar2')])
+        self.assertEqual('blah1', open(name1).read())
+        self.assertEqual('blah2', open(name2).read())
+
+    def test__async_store(self):
+        file_bag = AsyncFileBag('testfilebag', use_tempdir=True, queue_size=4)
+        names = [file_bag.store('blah%d' % i) for i in range(100)]
+        self.assertEqual(100, len(set(names)))
+
+        file_bag.flush()
+        for (i, name) in enumerate(names):
+            self.assertEqual('blah%d' % i, open(name).read())
+        self.assertEqual(100, file_bag.get_stats()['written'])
+
+        # the data stored before close() gets written too
+        name = file_bag.store('last')
+        file_bag.close()
+        self.assertEqual('last', open(name).read())
+        self.assertFalse(file_bag.writer.is_alive())
+
+    def test__async_fsync_failure(self):
+        file_bag = AsyncFileBag('testfilebag', use_tempdir=True)
+
+        def failing_fsync(fd):
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+        orig_fsync = os.fsync
+        os.fsync = failing_fsync
+        try:
+            file_bag.store('blah')
+            file_bag.flush()
+        finally:
+            os.fsync = orig_fsync
+
+        # the writer survives the failures
+        self.assertTrue(file_bag.writer.is_alive())
+        self.assertEqual(1, file_bag.get_stats()['failed'])
+        ref = file_bag.store('blah')
+        self.assertEqual('blah', file_bag.load(ref))
+        file_bag.close()
+
+    def test__async_store_after_close(self):
+        file_bag = AsyncFileBag('testfilebag', use_tempdir=True)
+        ref1 = file_bag.store('blah1')
+        file_bag.close()
+
+        # the data stored once the writer is gone gets written right away
+        ref2 = file_bag.store('blah2')
+        self.assertTrue(os.path.exists(ref2))
+        self.assertEqual('blah1', file_bag.load(ref1))
+        self.assertEqual('blah2', file_bag.load(ref2))
+        file_bag.flush()
+
+    def test__segment_store(self):
+        file_bag = SegmentFileBag('testfilebag', use_tempdir=True)
+        refs = [file_bag.store('blah%d' % i) for i in range(10)]
+        for (i, ref) in enumerate(refs):
+            self.assertEqual('blah%d' % i, file_bag.load(ref))
+
+        # plain files created in the bag are still readable the usual way
+        f = file_bag.mk_file()
+        f.write('blah')
+        f.close()
+        self.assertEqual('blah', file_bag.load(f.name))
+        file_bag.close()
+
+    def test__dedup(self):
+        for file_bag in (FileBag('testfilebag', use_tempdir=True, dedup=True),
+                         SegmentFileBag('testfilebag', use_tempdir=True, dedup=True)):
+            refs = [file_bag.store('GET / HTTP/1.0\r\n\r\n') for _ in range(10)]
+            other_ref = file_bag.store('GET /other HTTP/1.0\r\n\r\n')
+
+            self.assertEqual(1, len(set(refs)))
+            self.assertNotEqual(refs[0], other_ref)
+            self.assertEqual('GET / HTTP/1.0\r\n\r\n', file_bag.load(refs[0]))
+            self.assertEqual({'stored': 11, 'unique': 2, 'duplicates': 9, 'saved_bytes': 9 * 18},
+                file_bag.get_dedup_stats())
+            file_bag.close()
+
+    def test__compress(self):
+        file_bag = FileBag('testfilebag', use_tempdir=True, compress_level=1, compress_threshold=16)
+        long_ref = file_bag.store('GET / HTTP/1.0\r\n' * 100)
+        short_ref = file_bag.store('GET /')
+        self.assertEqual('GET / HTTP/1.0\r\n' * 100, file_bag.load(long_ref))
+        self.assertEqual('GET /', file_bag.load(short_ref))
+
+        # only the long piece gets compressed
+        self.assertTrue(os.path.getsize(long_ref) < 100)
+        self.assertEqual(len('GET /') + 1, os.path.getsize(short_ref))
+        self.assertEqual(1, file_bag.get_compress_stats()['compressed'])
+
+        name = file_bag.store_file(file_bag.mk_filename(suffix='.txt'), 'blah' * 100)
+        self.assertEqual('blah' * 100, file_bag.load(name))
+
+        # compression works the same way in the archive
+        file_bag = SegmentFileBag('testfilebag', use_tempdir=True, compress_level=9)
+        ref = file_bag.store('blah' * 1000)
+        self.assertEqual('blah' * 1000, file_bag.load(ref))
+        file_bag.close()
+
+    def test__rev_allocation(self):
+        basename = os.path.join(tempfile.mkdtemp(prefix='testfilebag'), 'bag')
+        self.assertEqual(basename + '.0', FileBag(basename).base_dir)
+        self.assertEqual(basename + '.1', FileBag(basename).base_dir)
+        self.assertEqual('2\n', open(basename + REV_FILE_SUFFIX).read())
+
+        # without the high-water mark, the existing bags get listed to find the last one
+        os.mkdir(basename + '.7')
+        os.unlink(basename + REV_FILE_SUFFIX)
+        self.assertEqual(basename + '.8', FileBag(basename).base_dir)
+
+        # the high-water mark being behind is not a problem either
+        with open(basename + REV_FILE_SUFFIX, 'w') as f:
+            f.write('8\n')
+        self.assertEqual(basename + '.9', FileBag(basename).base_dir)
+
+    def test__prune(self):
+        basename = os.path.join(tempfile.mkdtemp(prefix='testfilebag'), 'bag')
+        paths = []
+        for age_days in (30, 20, 10, 0):
+            file_bag = FileBag(basename)
+            file_bag.store('x' * 1000)
+            mtime = time.time() - age_days * 86400
+            os.utime(file_bag.base_dir, (mtime, mtime))
+            paths.append(file_bag.base_dir)
+
+        self.assertEqual(paths[:2], prune_file_bags(basename, max_age=15 * 86400, dry_run=True))
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        self.assertEqual(paths[:3], prune_file_bags(basename, max_size=1500))
+        self.assertEqual([paths[3]], [path for path in paths if os.path.exists(path)])
+
+        # the newest ones are kept in any case
+        self.assertEqual([], prune_file_bags(basename, max_age=0, keep=1))
+
 if __name__ == '__main__':
     unittest.main()
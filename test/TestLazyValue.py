@@ -0,0 +1,56 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import threading, time
+import unittest
+from sslcaudit.core.LazyValue import LazyValue, force, is_forced
+
+class TestLazyValue(unittest.TestCase):
+    def test_computed_once(self):
+        calls = []
+
+        def compute(x):
+            calls.append(x)
+            # give other threads a chance to pile up
+            time.sleep(0.2)
+            return x * 2
+
+        value = LazyValue(compute, 21)
+        self.assertFalse(is_forced(value))
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(value.get())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * 5)
+        self.assertTrue(is_forced(value))
+        self.assertEqual(force(value), 42)
+
+    def test_retry_after_exception(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            if len(calls) == 1:
+                raise RuntimeError('first attempt fails')
+            return 'ok'
+
+        value = LazyValue(compute)
+        self.assertRaises(RuntimeError, value.get)
+        self.assertFalse(value.is_ready())
+        self.assertEqual(value.get(), 'ok')
+        self.assertEqual(len(calls), 2)
+
+    def test_force_plain_value(self):
+        self.assertEqual(force('plain'), 'plain')
+        self.assertTrue(is_forced('plain'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -119,7 +119,7 @@ class TestModule(unittest.TestCase):
                 pass # ignore other events
 
         # create options for the controller
-        main_args = ['-l', '%s:%d' % (TEST_LISTENER_ADDR, port)]
+        main_args = ['-l', '%s:%d' % (TEST_LISTENER_ADDR, port), '--no-cert-cache']
         main_args.extend(args)
         options = SSLCAuditUI.parse_options(main_args)
 
@@ -0,0 +1,63 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import sys, time, types, unittest
+from sslcaudit.core.BaseClientAuditController import BaseClientAuditController, MODULE_MODULE_NAME_PREFIX, \
+    PROFILE_FACTORY_MODULE_NAME
+from sslcaudit.core.ConfigError import ConfigError
+from sslcaudit.modules.base.BaseProfileFactory import BaseProfileFactory
+from sslcaudit.ui import SSLCAuditUI
+
+def register_stub_module(name, build_delay=0, error=None):
+    '''
+    Makes a module with given name loadable by the controller. Its profile factory takes build_delay seconds to build
+    and raises ConfigError with given message if there is one.
+    '''
+    class ProfileFactory(BaseProfileFactory):
+        def __init__(self, file_bag, options):
+            BaseProfileFactory.__init__(self, file_bag, options)
+            time.sleep(build_delay)
+            if error is not None:
+                raise ConfigError(error)
+            self.name = name
+
+    package_name = MODULE_MODULE_NAME_PREFIX + '.' + name
+    module_name = package_name + '.' + PROFILE_FACTORY_MODULE_NAME
+    sys.modules[package_name] = types.ModuleType(package_name)
+    sys.modules[module_name] = types.ModuleType(module_name)
+    sys.modules[module_name].ProfileFactory = ProfileFactory
+
+register_stub_module('stub_slow', build_delay=0.2)
+register_stub_module('stub_fast')
+register_stub_module('stub_slow_failing', build_delay=0.2, error='slow failure')
+register_stub_module('stub_failing', error='failure')
+
+class TestProfileFactoryInit(unittest.TestCase):
+    def init_profile_factories(self, modules):
+        # only the attributes init_profile_factories() uses
+        controller = BaseClientAuditController.__new__(BaseClientAuditController)
+        controller.options = SSLCAuditUI.parse_options(['-m', modules, '--no-cert-cache'])
+        controller.file_bag = None
+        controller.init_profile_factories()
+        return controller.profile_factories
+
+    def test_order(self):
+        # the slow factory gets built last, but stays first
+        profile_factories = self.init_profile_factories('stub_slow,stub_fast')
+        self.assertEqual(['stub_slow', 'stub_fast'], [profile_factory.name for profile_factory in profile_factories])
+
+    def test_failure(self):
+        self.assertRaises(ConfigError, self.init_profile_factories, 'stub_fast,stub_failing')
+
+        # the failure of the first module in the list gets reported, even if the other one fails earlier
+        try:
+            self.init_profile_factories('stub_slow_failing,stub_failing')
+            self.fail('ConfigError expected')
+        except ConfigError as ex:
+            self.assertEqual('slow failure', str(ex))
+
+if __name__ == '__main__':
+    unittest.main()
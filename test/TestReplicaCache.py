@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import time, unittest
+from threading import Event
+from sslcaudit.core.ReplicaCache import ReplicaCache
+
+TIMEOUT = 5
+
+def wait_for(fn):
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        value = fn()
+        if value is not None:
+            return value
+        time.sleep(0.01)
+    return None
+
+class TestReplicaCache(unittest.TestCase):
+    def test_single_flight(self):
+        release = Event()
+        fetched = []
+
+        def fetch(destination):
+            fetched.append(destination)
+            release.wait(TIMEOUT)
+            return 'cert of %s:%d' % destination
+
+        cache = ReplicaCache(fetch, lambda cert: 'replica of ' + cert, lambda cert: cert)
+        try:
+            # the lookups do not wait for the fetch, nor start their own
+            for _ in range(10):
+                self.assertEqual(None, cache.get(('192.0.2.1', 443)))
+            release.set()
+
+            replica = wait_for(lambda: cache.get(('192.0.2.1', 443)))
+            self.assertEqual('replica of cert of 192.0.2.1:443', replica)
+            self.assertEqual([('192.0.2.1', 443)], fetched)
+        finally:
+            cache.stop()
+
+    def test_shared_fingerprint(self):
+        forged = []
+
+        def forge(cert):
+            forged.append(cert)
+            return 'replica of ' + cert
+
+        cache = ReplicaCache(lambda destination: 'cert', forge, lambda cert: 'fp(%s)' % cert)
+        try:
+            cache.get(('192.0.2.1', 443))
+            self.assertEqual('replica of cert', wait_for(lambda: cache.get(('192.0.2.1', 443))))
+            cache.get(('192.0.2.2', 443))
+            self.assertEqual('replica of cert', wait_for(lambda: cache.get(('192.0.2.2', 443))))
+
+            # both destinations present the same certificate, it gets replicated once
+            self.assertEqual(['cert'], forged)
+            self.assertEqual({'destinations': 2, 'replicas': 1, 'fetched': 2, 'forged': 1, 'failed': 0},
+                cache.get_stats())
+        finally:
+            cache.stop()
+
+    def test_failed_fetch(self):
+        attempts = []
+
+        def fetch(destination):
+            attempts.append(destination)
+            if len(attempts) == 1:
+                raise IOError('connection refused')
+            return 'cert'
+
+        cache = ReplicaCache(fetch, lambda cert: 'replica', lambda cert: cert, retry_interval=0.1)
+        try:
+            cache.get(('192.0.2.1', 443))
+            wait_for(lambda: cache.get_stats()['failed'] or None)
+            # no retries until retry_interval passes
+            self.assertEqual(None, cache.get(('192.0.2.1', 443)))
+            self.assertEqual(1, len(attempts))
+
+            time.sleep(0.2)
+            cache.get(('192.0.2.1', 443))
+            self.assertEqual('replica', wait_for(lambda: cache.get(('192.0.2.1', 443))))
+            self.assertEqual(2, len(attempts))
+        finally:
+            cache.stop()
+
+    def test_lru(self):
+        cache = ReplicaCache(lambda destination: destination, lambda cert: cert, lambda cert: cert, max_entries=2)
+        try:
+            for port in (1, 2, 3):
+                cache.get(('192.0.2.1', port))
+                wait_for(lambda: cache.get(('192.0.2.1', port)))
+            self.assertEqual(2, len(cache))
+            self.assertEqual(2, cache.get_stats()['replicas'])
+        finally:
+            cache.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import gc, socket, unittest
+from sslcaudit.core.ClientConnection import ClientConnection
+from sslcaudit.core.ConnectionAuditEvent import ConnectionAuditResult, SessionEndResult, ResultRecord
+
+class GotRequest(object):
+    # stands for sslcert ConnectedGotRequest, which needs M2Crypto
+    def __init__(self, req, req_file):
+        self.req = req
+        self.req_file = req_file
+
+    def __str__(self):
+        return 'connected, got %d octets (see %s)' % (len(self.req), self.req_file)
+
+class TestResultRecord(unittest.TestCase):
+    def test_session_end_result(self):
+        sock = socket.socket()
+        conn = ClientConnection(sock, ('10.0.0.1', 40000), ('127.0.0.1', 8443))
+        conn.release()
+        sock.close()
+        self.assertTrue(conn.sock is None)
+        self.assertTrue(conn.get_duration() >= 0)
+
+        session_res = SessionEndResult('10.0.0.1')
+        session_res.add(ConnectionAuditResult(conn, 'sslproto(tlsv1, RC4-MD5)', ''.join(['unexpected', ' eof'])))
+        record = session_res.results[0]
+
+        self.assertTrue(isinstance(record, ResultRecord))
+        self.assertEqual(('10.0.0.1', 40000), record.client_address)
+        self.assertEqual(('127.0.0.1', 8443), record.server_address)
+        self.assertEqual('sslproto(tlsv1, RC4-MD5)', record.profile_id)
+        self.assertTrue(record.result is intern('unexpected eof'))
+        self.assertEqual(conn.start_time, record.start_time)
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_orig_dst(self):
+        # connections to the proxy itself belong to the session of the client
+        conn = ClientConnection(None, ('10.0.0.1', 40000), ('127.0.0.1', 8443), ('127.0.0.1', 8443))
+        self.assertEqual(None, conn.orig_dst)
+        self.assertEqual('10.0.0.1', conn.get_session_id())
+
+        # redirected connections get a session per destination
+        conn = ClientConnection(None, ('10.0.0.1', 40000), ('127.0.0.1', 8443), ('192.0.2.1', 443))
+        self.assertEqual('10.0.0.1->192.0.2.1:443', conn.get_session_id())
+
+        session_res = SessionEndResult(conn.get_session_id())
+        session_res.add(ConnectionAuditResult(conn, 'dummy', 'res'))
+        self.assertEqual(('192.0.2.1', 443), session_res.results[0].server_address)
+
+    def test_capture_ref(self):
+        conn = ClientConnection(None, ('10.0.0.1', 40000), ('127.0.0.1', 8443))
+        req = 'GET / HTTP/1.0\r\n' * 1000
+        session_res = SessionEndResult(conn.get_session_id())
+        session_res.add(ConnectionAuditResult(conn, 'sslcert', GotRequest(req, '/tmp/bag.0/req-00000001')))
+        record = session_res.results[0]
+
+        self.assertEqual('GotRequest', record.result_class)
+        self.assertEqual('/tmp/bag.0/req-00000001', record.capture_ref)
+        self.assertTrue(record.result.startswith('connected, got'))
+        # neither the result object nor the data received from the client are kept
+        for obj in gc.get_referents(record):
+            self.assertFalse(obj is req or isinstance(obj, GotRequest))
+
+    def test_excess(self):
+        conn = ClientConnection(None, ('10.0.0.1', 40000), ('127.0.0.1', 8443))
+        session_res = SessionEndResult(conn.get_session_id())
+        session_res.add(ConnectionAuditResult(conn, 'dummy', 'res'))
+        for _ in range(100):
+            session_res.add(ConnectionAuditResult(conn, 'dummy', 'res'), excess=True)
+        self.assertEqual(1, len(session_res.results))
+        self.assertEqual(100, session_res.nexcess)
+
+if __name__ == '__main__':
+    unittest.main()
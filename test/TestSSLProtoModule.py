@@ -4,13 +4,18 @@
 # Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
 # ----------------------------------------------------------------------
 
-import logging, unittest, re
+import logging, socket, unittest, re
 
 from sslcaudit.modules.sslcert.ProfileFactory import DEFAULT_CN, SSLProfileSpec_SelfSigned, SSLProfileSpec_IMCA_Signed, SSLProfileSpec_Signed, IM_CA_FALSE_CN, IM_CA_TRUE_CN, IM_CA_NONE_CN, SSLProfileSpec_UserSupplied
 from sslcaudit.modules.sslcert.SSLServerHandler import     UNEXPECTED_EOF, ALERT_UNKNOWN_CA, ConnectedGotEOFBeforeTimeout, ConnectedGotRequest
 from sslcaudit.modules.sslproto.suites import SUITES
-from sslcaudit.modules.sslproto.ProfileFactory import SSLServerProtoSpec
-from sslcaudit.modules.sslproto.ServerHandler import Connected
+from sslcaudit.core.CertFactory import CertFactory
+from sslcaudit.core.ClientConnection import ClientConnection
+from sslcaudit.core.FileBag import FileBag
+from sslcaudit.core.LazyValue import LazyValue
+from sslcaudit.modules.sslproto.ProfileFactory import SSLServerProtoSpec, SSLServerProtoProfile, ProfileFactory, SSLPROTO_CN
+from sslcaudit.modules.sslproto.ServerHandler import Connected, ServerHandler
+from sslcaudit.ui import SSLCAuditUI
 from sslcaudit.test.ExternalCommandHammer import CurlHammer, OpenSSLHammer
 from sslcaudit.test.TCPConnectionHammer import TCPConnectionHammer
 from sslcaudit.test.TestConfig import *
@@ -118,6 +123,40 @@ class TestSSLProtoModule(TestModule.TestModule):
             eccars
         )
 
+    def test_unsupported_cipher_dropped(self):
+        # a cipher string OpenSSL rejects is dropped at startup, rather than failing each connection offered with it
+        options = SSLCAuditUI.parse_options(['-m', 'sslproto', '--protocols', 'tlsv1',
+            '--ciphers', 'NO-SUCH-CIPHER,HIGH', '--no-cert-cache'])
+        profile_factory = ProfileFactory(FileBag('testsslproto', use_tempdir=True), options)
+        self.assertEqual(['HIGH'], [profile.profile_spec.cipher for profile in profile_factory.profiles])
+
+    def test_context_reuse(self):
+        # the connections handled with the same protocol, cipher and certificate share a single SSL context
+        file_bag = FileBag('testsslproto', use_tempdir=True)
+        cert_factory = CertFactory(file_bag)
+        certnkey = LazyValue(lambda: cert_factory.sign_cert_req(cert_factory.mk_certreq_n_keys(SSLPROTO_CN), None))
+        handler = ServerHandler()
+
+        listen_sock = socket.socket()
+        listen_sock.bind((TEST_LISTENER_ADDR, 0))
+        listen_sock.listen(1)
+        try:
+            for _ in range(2):
+                client_sock = socket.create_connection(listen_sock.getsockname())
+                (server_sock, client_address) = listen_sock.accept()
+                # the client goes away, the handshake fails once the context is set up
+                client_sock.close()
+                try:
+                    conn = ClientConnection(server_sock, client_address)
+                    profile = SSLServerProtoProfile(SSLServerProtoSpec('tlsv1', 'HIGH'), certnkey)
+                    handler.handle(conn, profile, file_bag)
+                finally:
+                    server_sock.close()
+        finally:
+            listen_sock.close()
+
+        self.assertEqual(1, len(handler.context_cache))
+
 
 def create_per_proto_tests():
     def _(self, proto):
@@ -0,0 +1,65 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import os, tempfile, unittest
+from sslcaudit.core.SegmentArchive import SegmentArchive, INDEX_FILENAME, INDEX_ENTRY, SEGMENT_FILENAME
+
+class TestSegmentArchive(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(prefix='testsegmentarchive'), 'archive')
+
+    def test_append_read(self):
+        archive = SegmentArchive(self.path, segment_size=100)
+        record_ids = [archive.append('record %d ' % i * 5) for i in range(20)]
+        self.assertEqual(range(20), record_ids)
+        self.assertEqual('', archive.read(archive.append('')))
+
+        # the records do not fit in one segment
+        self.assertTrue(archive.get_stats()['segments'] > 1)
+        for i in range(20):
+            self.assertEqual('record %d ' % i * 5, archive.read(i))
+        archive.close()
+
+    def test_read_while_appending(self):
+        archive = SegmentArchive(self.path)
+        for i in range(10):
+            self.assertEqual('record %d' % i, archive.read(archive.append('record %d' % i)))
+        archive.close()
+
+    def test_reopen(self):
+        archive = SegmentArchive(self.path, segment_size=100)
+        for i in range(10):
+            archive.append('record %d' % i)
+        archive.close()
+
+        # an incomplete index entry left by a crash gets dropped
+        with open(os.path.join(self.path, INDEX_FILENAME), 'ab') as f:
+            f.write('\0' * (INDEX_ENTRY.size - 1))
+
+        archive = SegmentArchive(self.path, segment_size=100)
+        self.assertEqual(10, len(archive))
+        self.assertEqual(10, archive.append('record 10'))
+        for i in range(11):
+            self.assertEqual('record %d' % i, archive.read(i))
+        (last_segment, last_offset, _) = archive.index[-1]
+        archive.close()
+
+        # so do the complete entries whose data has not made it to disk
+        with open(os.path.join(self.path, SEGMENT_FILENAME % last_segment), 'r+b') as f:
+            f.truncate(last_offset + 1)
+        with open(os.path.join(self.path, INDEX_FILENAME), 'ab') as f:
+            f.write(INDEX_ENTRY.pack(last_segment + 1, 0, 10))
+
+        archive = SegmentArchive(self.path, segment_size=100)
+        self.assertEqual(10, len(archive))
+        self.assertEqual(10 * INDEX_ENTRY.size, os.path.getsize(os.path.join(self.path, INDEX_FILENAME)))
+        self.assertEqual(10, archive.append('record 10'))
+        for i in range(11):
+            self.assertEqual('record %d' % i, archive.read(i))
+        archive.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import time, unittest
+from Queue import Queue
+from threading import Thread, Event
+from sslcaudit.core import CFG_PTA_EXIT
+from sslcaudit.core.ClientServerSessionHandler import ClientServerSessionHandler
+from sslcaudit.core.ConnectionAuditEvent import SessionEndResult
+from sslcaudit.core.SessionTable import SessionTable
+
+class TestSessionTable(unittest.TestCase):
+    def test_lru(self):
+        evicted = []
+        table = SessionTable(max_sessions=2, on_evict=evicted.append, nstripes=1)
+        table.get('a', lambda: 'A')
+        table.get('b', lambda: 'B')
+        # 'a' becomes the most recently seen one, 'b' gets evicted by 'c'
+        self.assertEqual('A', table.get('a', lambda: self.fail('existing session got recreated')))
+        table.get('c', lambda: 'C')
+
+        self.assertEqual(['B'], evicted)
+        self.assertEqual({'sessions': 2, 'created': 3, 'evicted': 1, 'expired': 0}, table.get_stats())
+
+    def test_ttl(self):
+        evicted = []
+        table = SessionTable(ttl=0.05, on_evict=evicted.append, nstripes=1)
+        table.get('a', lambda: 'A')
+        time.sleep(0.1)
+        table.get('b', lambda: 'B')
+        self.assertEqual(['A'], evicted)
+
+        time.sleep(0.1)
+        table.expire()
+        self.assertEqual(['A', 'B'], evicted)
+        self.assertEqual(0, len(table))
+
+    def test_slow_handler_creation(self):
+        table = SessionTable(nstripes=1)
+        created = Event()
+        release = Event()
+        ncalls = []
+
+        def mk_slow_handler():
+            ncalls.append(1)
+            created.set()
+            release.wait(5)
+            return 'A'
+
+        threads = [Thread(target=table.get, args=('a', mk_slow_handler)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        created.wait(5)
+
+        # other sessions do not wait for the handler of 'a' to get created
+        self.assertEqual('B', table.get('b', lambda: 'B'))
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(1, len(ncalls))
+        self.assertEqual('A', table.get('a', lambda: self.fail('existing session got recreated')))
+
+    def test_stripes(self):
+        table = SessionTable(max_sessions=100, nstripes=4)
+        for i in range(1000):
+            table.get(str(i), lambda: i)
+        self.assertEqual(100, len(table))
+        self.assertEqual(900, table.get_stats()['evicted'])
+
+    def test_partial_session_end(self):
+        res_queue = Queue()
+        handler = ClientServerSessionHandler('s', ['p1', 'p2'], CFG_PTA_EXIT, res_queue, None)
+        res_queue.get()
+
+        handler.evict()
+        res = res_queue.get_nowait()
+        self.assertTrue(isinstance(res, SessionEndResult))
+        self.assertTrue(res.partial)
+
+        # the session does not end twice
+        handler.evict()
+        self.assertTrue(res_queue.empty())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import socket, time, unittest
+from Queue import Queue, Empty
+from sslcaudit.core import CFG_PTA_DROP
+from sslcaudit.core.ConnectionAuditEvent import SessionStartEvent, SessionEndResult, ConnectionAuditResult
+from sslcaudit.core.FileBag import FileBag
+from sslcaudit.core.ShardedClientAuditorServer import ShardedClientAuditorServer, ShardClientAuditorServer
+from sslcaudit.modules.dummy.ProfileFactory import DummyServerProfile
+from sslcaudit.test.TestConfig import get_next_listener_port, TEST_LISTENER_ADDR
+
+NPROFILES = 4
+NPROCESSES = 2
+CLIENT_ADDRS = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+TIMEOUT = 10
+
+class TestShardedClientAuditorServer(unittest.TestCase):
+    def setUp(self):
+        self.file_bag = FileBag('testsharded', use_tempdir=True)
+        self.listen_on = (TEST_LISTENER_ADDR, get_next_listener_port())
+        self.profile_factories = [[DummyServerProfile(value) for value in range(NPROFILES)]]
+        self.res_queue = Queue()
+
+    def mk_worker_server(self, shard_queue, listen_sock):
+        return ShardClientAuditorServer(self.listen_on, self.profile_factories, CFG_PTA_DROP, shard_queue,
+            self.file_bag, listen_sock)
+
+    def connect(self, client_addr):
+        sock = socket.socket()
+        try:
+            sock.bind((client_addr, 0))
+            sock.connect(self.listen_on)
+            # wait for the server to close the connection
+            sock.settimeout(TIMEOUT)
+            sock.recv(1)
+        finally:
+            sock.close()
+
+    def collect_events(self):
+        events = []
+        nends = 0
+        deadline = time.time() + TIMEOUT
+        while nends < len(CLIENT_ADDRS) and time.time() < deadline:
+            try:
+                event = self.res_queue.get(timeout=0.1)
+            except Empty:
+                continue
+            events.append(event)
+            if isinstance(event, SessionEndResult):
+                nends += 1
+        return events
+
+    def test_merged_sessions(self):
+        server = ShardedClientAuditorServer(self.listen_on, self.profile_factories, CFG_PTA_DROP, self.res_queue,
+            self.file_bag, NPROCESSES, self.mk_worker_server)
+        server.start()
+        try:
+            # interleave the clients, with two processes they get spread over both
+            for _ in range(NPROFILES + 1):
+                for client_addr in CLIENT_ADDRS:
+                    self.connect(client_addr)
+            events = self.collect_events()
+        finally:
+            server.stop()
+
+        for client_addr in CLIENT_ADDRS:
+            starts = [event for event in events
+                      if isinstance(event, SessionStartEvent) and event.session_id == client_addr]
+            self.assertEqual(1, len(starts))
+
+            values = [event.profile.value for event in events
+                      if isinstance(event, ConnectionAuditResult) and event.conn.client_address[0] == client_addr]
+            self.assertEqual(range(NPROFILES), sorted(values))
+
+            ends = [event for event in events
+                    if isinstance(event, SessionEndResult) and event.session_id == client_addr]
+            self.assertEqual(1, len(ends))
+            self.assertFalse(ends[0].partial)
+            self.assertEqual(NPROFILES, len(ends[0].results))
+
+if __name__ == '__main__':
+    unittest.main()
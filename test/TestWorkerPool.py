@@ -0,0 +1,91 @@
+# ----------------------------------------------------------------------
+# SSLCAUDIT - a tool for automating security audit of SSL clients
+# Released under terms of GPLv3, see COPYING.TXT
+# Copyright (C) 2012 Alexandre Bezroutchko abb@gremwell.com
+# ----------------------------------------------------------------------
+
+import threading, time
+import unittest
+from sslcaudit.core.WorkerPool import WorkerPool, OVERFLOW_DROP, OVERFLOW_WAIT
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = None
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        if self.pool is not None:
+            self.pool.stop()
+
+    def test_runs_jobs(self):
+        self.pool = WorkerPool(2, queue_size=10)
+        done = []
+        done_event = threading.Event()
+
+        def job(n):
+            done.append(n)
+            if len(done) == 5:
+                done_event.set()
+
+        for n in range(5):
+            self.assertTrue(self.pool.submit(job, n))
+        done_event.wait(5)
+
+        self.assertEqual(sorted(done), range(5))
+        self.assertEqual(self.pool.get_stats()['submitted'], 5)
+
+    def test_drop_on_overflow(self):
+        # one busy worker and one queued job fill the pool up
+        self.pool = WorkerPool(1, queue_size=1, overflow_policy=OVERFLOW_DROP)
+        self.assertTrue(self.pool.submit(self.release.wait))
+        time.sleep(0.2)
+        self.assertTrue(self.pool.submit(self.release.wait))
+
+        self.assertFalse(self.pool.submit(self.release.wait))
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['nbusy'], 1)
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertEqual(stats['utilization'], 1.0)
+
+    def test_wait_on_overflow(self):
+        self.pool = WorkerPool(1, queue_size=1, overflow_policy=OVERFLOW_WAIT, overflow_timeout=0.2)
+        self.assertTrue(self.pool.submit(self.release.wait))
+        time.sleep(0.2)
+        self.assertTrue(self.pool.submit(self.release.wait))
+
+        # no slot gets free in time
+        start_time = time.time()
+        self.assertFalse(self.pool.submit(self.release.wait))
+        self.assertTrue(time.time() - start_time >= 0.2)
+
+        # a slot gets free while waiting
+        threading.Timer(0.1, self.release.set).start()
+        self.pool.overflow_timeout = 5
+        self.assertTrue(self.pool.submit(self.release.wait))
+
+    def test_discard_on_stop(self):
+        self.pool = WorkerPool(1, queue_size=10)
+        self.assertTrue(self.pool.submit(self.release.wait))
+        time.sleep(0.2)
+
+        ran = []
+        discarded = []
+        for n in range(3):
+            self.assertTrue(self.pool.submit(ran.append, n, on_discard=lambda n=n: discarded.append(n)))
+        self.assertTrue(self.pool.submit(ran.append, 3))
+
+        # the queued jobs do not run, the ones having a hook get it invoked
+        self.pool.stop()
+        self.assertEqual([0, 1, 2], discarded)
+        self.assertEqual(4, self.pool.get_stats()['discarded'])
+        self.assertFalse(self.pool.submit(ran.append, 4, on_discard=lambda: discarded.append(4)))
+
+        self.release.set()
+        time.sleep(0.2)
+        self.assertEqual([], ran)
+        self.assertEqual([0, 1, 2], discarded)
+
+if __name__ == '__main__':
+    unittest.main()